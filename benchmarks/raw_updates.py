@@ -0,0 +1,93 @@
+# Measures work done by `Dispatcher` for raw updates: how many `PackedRawUpdate`
+# objects are built, peak of traced memory and time per update.
+#
+# Usage: python benchmarks/raw_updates.py [updates_count]
+
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from pyrogram import handlers, raw
+
+from dispyro import Dispatcher, Router, dispatcher, types
+
+
+class CountingPackedRawUpdate(types.PackedRawUpdate):
+    __slots__ = ()
+
+    created: int = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPackedRawUpdate.created += 1
+        super().__init__(*args, **kwargs)
+
+
+dispatcher.PackedRawUpdate = CountingPackedRawUpdate
+
+
+def make_update(index: int) -> raw.types.UpdateUserStatus:
+    return raw.types.UpdateUserStatus(user_id=index, status=raw.types.UserStatusOnline(expires=0))
+
+
+async def measure(router: Router, count: int) -> None:
+    dispatcher = Dispatcher()
+    dispatcher.add_router(router)
+
+    handler = dispatcher._make_handler(handler_type=handlers.RawUpdateHandler)
+    updates = [make_update(index) for index in range(count)]
+    users = {index: raw.types.UserEmpty(id=index) for index in range(100)}
+
+    # warm up caches (indexes, signatures)
+    await handler(None, updates[0], users, {})
+    CountingPackedRawUpdate.created = 0
+
+    tracemalloc.start()
+    started_at = time.perf_counter()
+
+    for update in updates:
+        await handler(None, update, users, {})
+
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{router._name:<20}"
+        f" {CountingPackedRawUpdate.created:>8} packed"
+        f" {peak / 1024:>10.1f} KiB peak"
+        f" {elapsed / count * 1e6:>8.2f} us/update"
+    )
+
+
+def no_handlers() -> Router:
+    return Router(name="no_handlers")
+
+
+def other_type_handler() -> Router:
+    router = Router(name="other_type_handler")
+
+    @router.raw_update(allowed_update=raw.types.UpdateNewMessage)
+    async def handler(_, update):
+        pass
+
+    return router
+
+
+def matching_handler() -> Router:
+    router = Router(name="matching_handler")
+
+    @router.raw_update(allowed_update=raw.types.UpdateUserStatus)
+    async def handler(_, update):
+        update.user
+
+    return router
+
+
+async def main(count: int) -> None:
+    for case in (no_handlers, other_type_handler, matching_handler):
+        await measure(case(), count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
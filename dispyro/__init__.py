@@ -1,19 +1,48 @@
-from . import filters, handlers, types, utils
+from . import filters, fsm, handlers, limits, stages, types, utils
+from .circuit_breaker import CircuitBreaker
 from .dispatcher import Dispatcher, RunLogic
+from .enums import CircuitState
 from .filters import Filter
+from .inline_cache import InlineQueryCache
+from .lazy_router import LazyRouter
+from .limits import Limits
+from .outgoing import OutgoingQueue
+from .peer_cache import PeerCache
+from .process_pool import ProcessPool, offload
 from .router import Router
+from .router_order import AdaptiveOrder
+from .scheduler import Scheduler, SQLiteJobStore
+from .sharding import ShardedDispatcher
+from .single_flight import SingleFlight
 from .types import PackedRawUpdate
 
 __version__ = "0.2.0"
 
 __all__ = (
     "filters",
+    "fsm",
     "Dispatcher",
+    "ShardedDispatcher",
+    "SingleFlight",
     "RunLogic",
+    "CircuitBreaker",
+    "CircuitState",
     "Router",
+    "LazyRouter",
+    "AdaptiveOrder",
     "Filter",
+    "InlineQueryCache",
+    "Limits",
+    "limits",
+    "OutgoingQueue",
+    "PeerCache",
+    "ProcessPool",
+    "offload",
+    "Scheduler",
+    "SQLiteJobStore",
     "utils",
     "types",
     "handlers",
+    "stages",
     "PackedRawUpdate",
 )
@@ -0,0 +1,150 @@
+# This file defines circuit breaker, which stops calling handlers and filters
+# that keep failing (e.g. because service they depend on is down).
+#
+# Breaker is closed by default, so calls go through. When `failure_threshold`
+# calls fail during last `window` seconds, breaker opens and calls are not
+# made at all: handler calls `fallback` instead (or is skipped, so update goes
+# to next handlers according to `RunLogic`), filter returns result of `fallback`
+# (or `False`), which is not inverted by `~`. After `recovery_timeout` seconds
+# breaker becomes half-open and lets single probe call through: if it
+# succeeds, breaker closes, otherwise opens again. Exceptions and timeouts (see
+# `dispyro.limits`) are considered failures, exceptions are still propagated.
+# Cancelled calls (e.g. on shutdown) are neither successes nor failures.
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Optional
+
+from .enums import CircuitState
+from .utils import safe_call
+
+
+@dataclass
+class CircuitBreakerStats:
+    state: CircuitState = CircuitState.CLOSED
+    calls: int = 0
+    failures: int = 0
+    rejected: int = 0
+    opened: int = 0
+    # failures during current window
+    recent_failures: int = 0
+
+
+class CircuitBreaker:
+    """Circuit breaker, see top of this file. Instance passed to several
+    handlers or filters is shared by them.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        window: float = 60,
+        recovery_timeout: float = 30,
+        fallback: Callable[..., Any] = None,
+    ):
+        self._failure_threshold = failure_threshold
+        self._window = window
+        self._recovery_timeout = recovery_timeout
+        self.fallback = safe_call(fallback) if fallback is not None else None
+
+        self._state = CircuitState.CLOSED
+        self._failures: Deque[float] = deque()
+        self._opened_at: float = 0.0
+        self._probing: bool = False
+        self._stats = CircuitBreakerStats()
+
+    @property
+    def state(self) -> CircuitState:
+        if (
+            self._state is CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self._recovery_timeout
+        ):
+            self._state = CircuitState.HALF_OPEN
+            self._probing = False
+
+        return self._state
+
+    @property
+    def stats(self) -> CircuitBreakerStats:
+        self._prune(time.monotonic())
+        self._stats.state = self.state
+        self._stats.recent_failures = len(self._failures)
+
+        return self._stats
+
+    def allow(self) -> bool:
+        """Whether call can be made now. Caller must report its result with
+        `record_success` or `record_failure`.
+        """
+
+        state = self.state
+
+        if state is CircuitState.CLOSED:
+            allowed = True
+
+        elif state is CircuitState.HALF_OPEN and not self._probing:
+            self._probing = True
+            allowed = True
+
+        else:
+            allowed = False
+
+        if allowed:
+            self._stats.calls += 1
+        else:
+            self._stats.rejected += 1
+
+        return allowed
+
+    def _open(self) -> None:
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._failures.clear()
+        self._stats.opened += 1
+
+    def _prune(self, now: float) -> None:
+        # failures that are out of window
+        while self._failures and self._failures[0] <= now - self._window:
+            self._failures.popleft()
+
+    def record_success(self) -> None:
+        self._prune(time.monotonic())
+
+        if self._state is CircuitState.HALF_OPEN:
+            self._state = CircuitState.CLOSED
+            self._probing = False
+            self._failures.clear()
+
+    def record_cancelled(self) -> None:
+        """Reports call that was allowed, but didn't finish. Lets next call
+        probe half-open breaker.
+        """
+
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._stats.failures += 1
+        now = time.monotonic()
+        self._prune(now)
+
+        if self._state is CircuitState.HALF_OPEN:
+            self._open()
+            return
+
+        if self._state is CircuitState.OPEN:
+            return
+
+        self._failures.append(now)
+
+        if len(self._failures) >= self._failure_threshold:
+            self._open()
+
+    def reset(self) -> None:
+        self._state = CircuitState.CLOSED
+        self._probing = False
+        self._failures.clear()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} `{self.state.name}`"
@@ -1,25 +1,90 @@
 import asyncio
-from typing import Any, Callable, Coroutine, Dict, List, Union
+import importlib
+import logging
+import sys
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, replace
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from pyrogram import Client, handlers, idle
 from pyrogram.handlers.handler import Handler
 from pyrogram.raw import base
 
+import dispyro
+
 from .enums import RunLogic
+from .fsm import BaseStorage, FSMContext
 from .handlers_holders import (
     CallbackQueryHandlersHolder,
     ChatMemberUpdatedHandlersHolder,
     ChosenInlineResultHandlersHolder,
     DeletedMessagesHandlersHolder,
+    DispatchPlan,
     EditedMessageHandlersHolder,
+    HandlersHolder,
     InlineQueryHandlersHolder,
     MessageHandlersHolder,
     PollHandlersHolder,
     RawUpdateHandlersHolder,
     UserStatusHandlersHolder,
 )
+from .lazy_router import LazyRouter, LazyRouterReport
+from .outgoing import OutgoingQueue
+from .process_pool import ProcessPool
 from .router import Router
-from .types import PackedRawUpdate, Update
+from .router_order import AdaptiveOrder
+from .scheduler import Scheduler
+from .stages import UpdateStage
+from .types import AnyFilter, PackedRawUpdate, Update
+from .utils import get_chat_id, get_user_id, resolve_import_path, set_executor
+from .waiters import Waiters
+
+log = logging.getLogger(__name__)
+
+# dependencies loaded from FSM storage for every update
+STATE_DEPS = frozenset(("state", "raw_state"))
+
+HANDLER_TYPES: Tuple[Type[Handler], ...] = (
+    handlers.CallbackQueryHandler,
+    handlers.ChatMemberUpdatedHandler,
+    handlers.ChosenInlineResultHandler,
+    handlers.DeletedMessagesHandler,
+    handlers.EditedMessageHandler,
+    handlers.InlineQueryHandler,
+    handlers.MessageHandler,
+    handlers.PollHandler,
+    handlers.RawUpdateHandler,
+    handlers.UserStatusHandler,
+)
+
+# routers with handlers of every update type
+DispatchTable = Dict[Type[Handler], Tuple[Router, ...]]
+
+
+@dataclass
+class FreezeReport:
+    # seconds spent on validation and building dispatch plans
+    compile_time: float = 0
+    routers: int = 0
+    handlers: int = 0
+    # handlers found through indexes and ones checked for every update
+    indexed: int = 0
+    unindexed: int = 0
+    # number of (update type, router) pairs in dispatch table
+    table_size: int = 0
 
 
 class Dispatcher:
@@ -33,6 +98,12 @@ class Dispatcher:
         ignore_preparation: bool = False,
         clear_on_prepare: bool = True,
         run_logic: RunLogic = RunLogic.ONE_RUN_PER_EVENT,
+        executor: Executor = None,
+        process_pool: ProcessPool = None,
+        storage: BaseStorage = None,
+        scheduler: Scheduler = None,
+        adaptive_order: AdaptiveOrder = None,
+        outgoing: OutgoingQueue = None,
         **deps,
     ):
         self._default_router = Router(name="root_router")
@@ -44,6 +115,44 @@ class Dispatcher:
         self._clear_on_prepare = clear_on_prepare
         self._run_logic = run_logic
 
+        if adaptive_order is not None and run_logic is not RunLogic.ONE_RUN_PER_EVENT:
+            raise ValueError("adaptive order of routers requires `RunLogic.ONE_RUN_PER_EVENT`")
+
+        self._adaptive_order = adaptive_order
+
+        if executor is not None:
+            set_executor(executor)
+
+        self._process_pool = process_pool
+
+        if process_pool is not None:
+            self._deps["process_pool"] = process_pool
+
+        self._storage = storage
+        self._stages: List[UpdateStage] = []
+
+        self._scheduler = scheduler
+
+        if scheduler is not None:
+            self._deps["scheduler"] = scheduler
+
+        self._outgoing = outgoing
+
+        if outgoing is not None:
+            self._deps["outgoing"] = outgoing
+
+        self.waiters = Waiters(scheduler=scheduler)
+
+        # built by `freeze`
+        self._dispatch_table: DispatchTable = {}
+        # routers that need FSM state, by update types
+        self._state_routers: Dict[Type[Handler], Set[Router]] = {}
+        self._frozen = False
+        self.freeze_report: Optional[FreezeReport] = None
+        # routers attached by `load_router`, by import paths
+        self._loaded_routers: Dict[str, Router] = {}
+        self._lazy_routers: List[LazyRouter] = []
+
         if ignore_preparation:
             self._clients = list(clients)
 
@@ -101,6 +210,12 @@ class Dispatcher:
                 users: Dict[int, base.User],
                 chats: Dict[int, base.Chat],
             ):
+                for stage in self._stages:
+                    stage.feed_peers(users, chats)
+
+                if not self.accepts_raw_update_type(type(update)):
+                    return
+
                 packed_update = PackedRawUpdate(update=update, users=users, chats=chats)
                 await self.feed_update(
                     client=client, update=packed_update, handler_type=handler_type
@@ -113,20 +228,12 @@ class Dispatcher:
 
         return handler
 
-    def prepare_client(self, client: Client, clear_handlers: bool = True) -> Client:
-        handler_types: List[Handler] = [
-            handlers.CallbackQueryHandler,
-            handlers.ChatMemberUpdatedHandler,
-            handlers.ChosenInlineResultHandler,
-            handlers.DeletedMessagesHandler,
-            handlers.EditedMessageHandler,
-            handlers.InlineQueryHandler,
-            handlers.MessageHandler,
-            handlers.PollHandler,
-            handlers.RawUpdateHandler,
-            handlers.UserStatusHandler,
-        ]
+    def accepts_raw_update_type(self, update_type: type) -> bool:
+        routers = self._dispatch_table.get(handlers.RawUpdateHandler, self.routers)
+
+        return any(router.raw_update.accepts_update_type(update_type) for router in routers)
 
+    def prepare_client(self, client: Client, clear_handlers: bool = True) -> Client:
         group = 0
 
         if clear_handlers:
@@ -138,37 +245,464 @@ class Dispatcher:
             if groups:
                 group = max(groups) + 1
 
-        for handler_type in handler_types:
+        for handler_type in HANDLER_TYPES:
             handler = self._make_handler(handler_type=handler_type)
 
             client.add_handler(handler_type(handler), group=group)
 
         return client
 
+    # Routers list is replaced instead of being changed in place, so updates
+    # that are being processed keep iterating routers they started with. When
+    # dispatcher is frozen, new routers are validated and dispatch table is
+    # rebuilt before list is replaced.
+
+    def _set_routers(self, routers: List[Router]) -> None:
+        if self._frozen:
+            self._dispatch_table, self.freeze_report = self._compile(routers)
+            self._state_routers = self._find_state_routers(routers)
+
+        self.routers = routers
+
     def add_router(self, router: Router):
-        self.routers.append(router)
+        self._set_routers([*self.routers, router])
 
     def add_routers(self, *routers: Router):
-        self.routers.extend(routers)
+        self._set_routers([*self.routers, *routers])
+
+    def remove_router(self, router: Router):
+        if router not in self.routers:
+            raise ValueError(f"{router!r} is not attached to dispatcher")
+
+        self._set_routers([item for item in self.routers if item is not router])
+        router.thaw()
+
+        self._loaded_routers = {
+            path: item for path, item in self._loaded_routers.items() if item is not router
+        }
+
+    def add_stage(self, stage: UpdateStage):
+        self._stages.append(stage)
+        stage.attach(self)
+
+    def add_stages(self, *stages: UpdateStage):
+        for stage in stages:
+            self.add_stage(stage)
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
+    def get_available_deps(self) -> Set[str]:
+        """Returns names of dependencies every handler gets (ones provided by
+        indexes are not included).
+        """
+
+        deps = {*self._deps, "dispatcher"}
+
+        if self._storage is not None:
+            deps.update(("state", "raw_state"))
+
+        for stage in self._stages:
+            deps.update(stage.provides)
+
+        return deps
+
+    def validate(self, routers: List[Router] = None) -> List[str]:
+        """Checks that all filters and handlers callbacks of `routers` (all
+        attached routers by default) get dependencies they require. Returns
+        descriptions of problems found.
+        """
+
+        deps = self.get_available_deps()
+
+        return [
+            problem
+            for router in (self.routers if routers is None else routers)
+            for handlers_holder in router.handlers_correlation.values()
+            for problem in handlers_holder.validate(deps)
+        ]
+
+    def _compile(self, routers: List[Router]) -> Tuple[DispatchTable, FreezeReport]:
+        started_at = time.perf_counter()
+        # routers that are frozen already (e.g. when reloading) stay frozen on failure
+        thawed = [router for router in routers if not router.frozen]
+
+        for router in thawed:
+            router.freeze(dispatcher=self)
+
+        problems = self.validate(routers)
+
+        if problems:
+            for router in thawed:
+                router.thaw()
+
+            raise ValueError("Handlers don't pass validation:\n" + "\n".join(problems))
+
+        report = FreezeReport(routers=len(routers))
+        dispatch_table: DispatchTable = {}
+
+        for handler_type in HANDLER_TYPES:
+            table_routers: List[Router] = []
+
+            for router in routers:
+                if not router.handles(handler_type):
+                    continue
+
+                plan = router.handlers_correlation[handler_type].get_plan()
+                table_routers.append(router)
+                report.handlers += len(plan.handlers)
+                report.unindexed += len(plan.unindexed)
+
+            dispatch_table[handler_type] = tuple(table_routers)
+            report.table_size += len(table_routers)
+
+        if self._adaptive_order is not None:
+            dispatch_table = self._adaptive_order.apply(dispatch_table)
+
+        report.indexed = report.handlers - report.unindexed
+        report.compile_time = time.perf_counter() - started_at
+
+        return dispatch_table, report
+
+    def _find_state_routers(self, routers: List[Router]) -> Dict[Type[Handler], Set[Router]]:
+        state_routers: Dict[Type[Handler], Set[Router]] = {}
+
+        for handler_type in HANDLER_TYPES:
+            state_routers[handler_type] = {
+                router
+                for router in routers
+                if router.handles(handler_type)
+                and (
+                    # handlers of lazy router are not known until it's loaded
+                    isinstance(router, LazyRouter)
+                    or router.handlers_correlation[handler_type].uses_deps(STATE_DEPS)
+                )
+            }
+
+        return state_routers
+
+    def freeze(self) -> FreezeReport:
+        """Validates handlers and builds dispatch plans of all routers and
+        table of routers for every update type. Is called by `start`. Raises
+        `ValueError` if some handlers or filters require dependencies that are
+        not provided.
+
+        Routers and handlers can still be added and removed: plans and table
+        are rebuilt right away and changes that don't pass validation are
+        reverted (with `ValueError` raised).
+        """
+
+        self._dispatch_table, report = self._compile(self.routers)
+        self._state_routers = self._find_state_routers(self.routers)
+        self._frozen = True
+        self.freeze_report = report
+
+        log.info("Dispatcher is frozen: %s", report)
+
+        return report
+
+    def _update_holder(
+        self,
+        router: Router,
+        handlers_holder: HandlersHolder,
+        previous_plan: Optional[DispatchPlan],
+        added: Iterable["dispyro.handlers.Handler"],
+    ) -> None:
+        """Is called by frozen routers after handlers of `handlers_holder` are
+        changed. Only filters of holder and `added` handlers are validated and
+        only entry of holder's update type in dispatch table is rebuilt, so
+        cost of change doesn't depend on number of other handlers.
+        """
+
+        problems = handlers_holder.validate(self.get_available_deps(), handlers=added)
+
+        if problems:
+            raise ValueError("Handlers don't pass validation:\n" + "\n".join(problems))
+
+        handler_type = next(
+            handler_type
+            for handler_type, item in router.handlers_correlation.items()
+            if item is handlers_holder
+        )
+        table_routers = self._dispatch_table.get(handler_type, ())
+        new_table_routers = table_routers
+
+        if (router in table_routers) != router.handles(handler_type):
+            new_table_routers = tuple(item for item in self.routers if item.handles(handler_type))
+
+            if self._adaptive_order is not None:
+                new_table_routers = self._adaptive_order.order(handler_type, new_table_routers)
+                self._adaptive_order.stats.order[handler_type] = new_table_routers
+
+            self._dispatch_table = {**self._dispatch_table, handler_type: new_table_routers}
+
+        state_routers = self._state_routers.setdefault(handler_type, set())
+
+        if router.handles(handler_type) and handlers_holder.uses_deps(STATE_DEPS):
+            state_routers.add(router)
+        else:
+            state_routers.discard(router)
+
+        report = self.freeze_report
+
+        if report is None:
+            return
+
+        plan = handlers_holder.get_plan()
+        handlers = len(plan.handlers) - (len(previous_plan.handlers) if previous_plan else 0)
+        unindexed = len(plan.unindexed) - (len(previous_plan.unindexed) if previous_plan else 0)
+
+        self.freeze_report = replace(
+            report,
+            handlers=report.handlers + handlers,
+            unindexed=report.unindexed + unindexed,
+            indexed=report.indexed + handlers - unindexed,
+            table_size=report.table_size + len(new_table_routers) - len(table_routers),
+        )
+
+    def _reorder(self, handler_type: Type[Handler]) -> None:
+        table = self._dispatch_table
+
+        if handler_type not in table:
+            return
+
+        self._dispatch_table = {
+            **table,
+            handler_type: self._adaptive_order.reorder(handler_type, table[handler_type]),
+        }
+
+    def thaw(self) -> None:
+        """Turns off validation, dispatch table and adaptive order of routers,
+        until dispatcher is frozen again.
+        """
+
+        self._frozen = False
+        self._dispatch_table = {}
+        self._state_routers = {}
+
+        for router in self.routers:
+            router.thaw()
+
+    def load_router(self, path: str) -> Router:
+        """Imports router by `path` (e.g. `bot.routers.admin:router`) and
+        attaches it. Routers loaded this way can be reloaded with `reload_router`.
+        """
+
+        router = resolve_import_path(path)
+
+        if not isinstance(router, Router):
+            raise TypeError(f"`{path}` is not a router")
+
+        self.add_router(router)
+        self._loaded_routers[path] = router
+
+        return router
+
+    def add_lazy_router(
+        self,
+        path: str,
+        update_types: List[Type[Handler]] = None,
+        commands: List[str] = None,
+        prefixes: Union[str, List[str]] = "/",
+        preload: bool = True,
+    ) -> LazyRouter:
+        """Attaches router, which module is imported on first update matching
+        `update_types` and `commands`, or in background after dispatcher is
+        started if `preload` is set. See `dispyro.lazy_router`.
+        """
+
+        router = LazyRouter(
+            path=path,
+            update_types=update_types,
+            commands=commands,
+            prefixes=prefixes,
+            preload=preload,
+        )
+
+        self.add_router(router)
+        self._lazy_routers.append(router)
+
+        return router
+
+    @property
+    def import_report(self) -> List[LazyRouterReport]:
+        return [router.report for router in self._lazy_routers]
+
+    async def load_lazy_routers(self) -> None:
+        """Loads all lazy routers that are not loaded yet and waits for them."""
+
+        tasks = [router.load(dispatcher=self) for router in self._lazy_routers]
+
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def reload_router(self, path: str) -> Router:
+        """Re-executes module of router loaded with `load_router` and replaces
+        router with the new one, keeping its position. Works with running
+        dispatcher: clients stay connected, updates being processed finish with
+        old router. If module raises error, or new router doesn't pass
+        validation (when dispatcher is frozen), module is restored and old
+        router is kept. Note that only router module itself is reloaded.
+        """
+
+        old_router = self._loaded_routers.get(path)
+
+        if old_router is None:
+            raise ValueError(f"router `{path}` is not loaded")
+
+        module_name = path.partition(":")[0]
+        module = sys.modules[module_name]
+        namespace = dict(module.__dict__)
+
+        try:
+            importlib.reload(module)
+            router = resolve_import_path(path)
+
+            if not isinstance(router, Router):
+                raise TypeError(f"`{path}` is not a router")
+
+            if router is old_router:
+                raise ValueError(f"module of `{path}` didn't create new router")
+
+            self._replace_router(old_router, router)
+
+        except BaseException:
+            module.__dict__.clear()
+            module.__dict__.update(namespace)
+            sys.modules[module_name] = module
+
+            raise
+
+        self._loaded_routers[path] = router
+
+        log.info("%r is reloaded from `%s`", router, path)
+
+        await old_router.flush_batches()
+
+        return router
+
+    def _replace_router(self, old_router: Router, router: Router) -> None:
+        """Puts `router` in place of `old_router`, validating it first if
+        dispatcher is frozen.
+        """
+
+        if old_router not in self.routers:
+            raise ValueError(f"{old_router!r} is not attached to dispatcher")
+
+        self._set_routers([router if item is old_router else item for item in self.routers])
+        old_router.thaw()
+
+    async def wait_for(
+        self,
+        update_type: Type[Handler],
+        filters: AnyFilter = None,
+        timeout: float = None,
+        chat_id: int = None,
+        user_id: int = None,
+        consume: bool = True,
+    ) -> Update:
+        """Waits for next update of `update_type` (pyrogram handler type, e.g.
+        `MessageHandler`) from given chat and/or user, which passes `filters`.
+        Matched update is not fed to routers, unless `consume` is `False`.
+        Raises `asyncio.TimeoutError` if no update received in `timeout` seconds.
+        """
+
+        return await self.waiters.wait(
+            update_type=update_type,
+            filters=filters,
+            timeout=timeout,
+            chat_id=chat_id,
+            user_id=user_id,
+            consume=consume,
+        )
 
     def cleanup(self) -> None:
         for router in self.routers:
             router.cleanup()
 
+    def _needs_state(self, handler_type: Type[Handler]) -> bool:
+        # handlers of thawed dispatcher can change without notice, and filters
+        # of waiters are not known in advance
+        return (
+            not self._frozen or bool(self._state_routers.get(handler_type)) or bool(self.waiters)
+        )
+
+    async def _load_state(self, update: Update) -> Dict[str, Any]:
+        key = (get_chat_id(update), get_user_id(update))
+
+        if key == (None, None):
+            return {}
+
+        raw_state = await self._storage.get_state(key)
+        state = FSMContext(storage=self._storage, key=key, state=raw_state)
+
+        return {"state": state, "raw_state": raw_state}
+
     async def feed_update(self, client: Client, update: Update, handler_type: Handler) -> None:
-        for router in self.routers:
+        await self._feed_update(client, update, handler_type, dict(self._deps), self._stages)
+
+    async def resume_update(
+        self, stage: UpdateStage, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> None:
+        """Feeds `update` held back by `stage` to stages after it and to routers.
+        `deps` are ones stage got with update.
+        """
+
+        stages = self._stages[self._stages.index(stage) + 1 :]
+
+        await self._feed_update(client, update, handler_type, deps, stages)
+
+    async def _feed_update(
+        self,
+        client: Client,
+        update: Update,
+        handler_type: Handler,
+        deps: Dict,
+        stages: List[UpdateStage],
+    ) -> None:
+        for stage in stages:
+            update = await stage(
+                client=client, update=update, handler_type=handler_type, deps=deps
+            )
+
+            if update is None:
+                return
+
+        if self._storage is not None and self._needs_state(handler_type):
+            deps.update(await self._load_state(update))
+
+        if await self.waiters.feed_update(
+            client=client, update=update, handler_type=handler_type, deps=deps
+        ):
+            return
+
+        routers = self._dispatch_table.get(handler_type, self.routers)
+        handled_by = None
+
+        for router in routers:
             result = await router.feed_update(
                 client=client,
                 dispatcher=self,
                 update=update,
                 handler_type=handler_type,
-                **self._deps,
+                **deps,
             )
 
             if self._run_logic is RunLogic.ONE_RUN_PER_EVENT and result:
+                handled_by = router
                 break
 
-        self.cleanup()
+        if (
+            self._adaptive_order is not None
+            and self._frozen
+            and self._adaptive_order.record(handler_type, handled_by)
+        ):
+            self._reorder(handler_type)
+
+        # routers could be replaced while update was processed
+        for router in routers:
+            router.cleanup()
 
     async def start(
         self,
@@ -178,6 +712,15 @@ class Dispatcher:
     ) -> None:
         self.cleanup()
 
+        if not self._frozen:
+            self.freeze()
+
+        if self._process_pool is not None:
+            self._process_pool.start()
+
+        if self._scheduler is not None:
+            await self._scheduler.start(dispatcher=self)
+
         if ignore_preparation is None:
             ignore_preparation = self._ignore_preparation
 
@@ -190,11 +733,42 @@ class Dispatcher:
                 for client in clients
             ]
 
-        clients = self._clients + clients
+        self._clients.extend(client for client in clients if client not in self._clients)
 
-        for client in clients:
+        for client in self._clients:
             if not client.is_connected:
                 await client.start()
 
+        # clients are started first, so they don't wait for heavy imports
+        for router in self._lazy_routers:
+            if router.preload:
+                router.load(dispatcher=self)
+
         if not only_start:
             await idle()
+            await self.stop()
+
+    async def stop(self) -> None:
+        # updates held by stages are processed before batches are flushed
+        for stage in self._stages:
+            await stage.flush()
+
+        for router in self.routers:
+            await router.flush_batches()
+
+        # queued requests are made before clients are stopped
+        if self._outgoing is not None:
+            await self._outgoing.close()
+
+        for client in self._clients:
+            if client.is_connected:
+                await client.stop()
+
+        if self._scheduler is not None:
+            await self._scheduler.shutdown()
+
+        if self._process_pool is not None:
+            await self._process_pool.shutdown()
+
+        if self._storage is not None:
+            await self._storage.close()
@@ -5,3 +5,9 @@ class RunLogic(Enum):
     ONE_RUN_PER_EVENT = auto()
     ONE_RUN_PER_ROUTER = auto()
     UNLIMITED = auto()
+
+
+class CircuitState(Enum):
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
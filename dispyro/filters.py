@@ -1,9 +1,38 @@
+import re
+import weakref
+from collections.abc import Container
+from concurrent.futures import Executor
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Match,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    Union,
+)
+
 from pyrogram import Client
 from pyrogram.filters import Filter as PyrogramFilter
 
-from .types import AnyFilter, Update
+import dispyro
+
+from .circuit_breaker import CircuitBreaker
+from .keywords import KeywordAutomaton
+from .types import AnyFilter, PackedRawUpdate, Update
 from .types.signatures import FilterCallback
-from .utils import safe_call
+from .utils import (
+    get_chat_id,
+    get_missing_kwargs,
+    get_text,
+    get_user_id,
+    safe_call,
+    takes_kwargs,
+)
 
 
 class Filter:
@@ -11,18 +40,64 @@ class Filter:
     combined with default pyrogram filters.
     """
 
+    _circuit_breaker: Optional[CircuitBreaker] = None
+
     async def _default_callback(self, client: Client, update: Update):
         return True
 
-    def __init__(self, callback: FilterCallback = None):
+    def __init__(
+        self,
+        callback: FilterCallback = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        circuit_breaker: CircuitBreaker = None,
+    ):
         self._unwrapped_callback = callback
-        self._callback: FilterCallback = safe_call(callback or self._default_callback)
+        self._executor = executor
+        self._run_inline = run_inline
+        self._circuit_breaker = circuit_breaker
+        self._callback: FilterCallback = safe_call(
+            callback or self._default_callback, executor=executor, run_inline=run_inline
+        )
 
     async def __call__(self, client: Client, update: Update, **deps) -> bool:
+        if self._circuit_breaker is None:
+            return await self._callback(client, update, **deps)
+
+        return await self._call_with_circuit_breaker(client, update, **deps)
+
+    async def _call_callback(self, client: Client, update: Update, **deps) -> bool:
         return await self._callback(client, update, **deps)
 
+    async def _call_with_circuit_breaker(self, client: Client, update: Update, **deps) -> bool:
+        circuit_breaker = self._circuit_breaker
+
+        if not circuit_breaker.allow():
+            if circuit_breaker.fallback is None:
+                return False
+
+            return await circuit_breaker.fallback(client, update, **deps)
+
+        try:
+            result = await self._call_callback(client, update, **deps)
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            circuit_breaker.record_cancelled()
+            raise
+
+        circuit_breaker.record_success()
+
+        return result
+
     def __invert__(self) -> "InvertedFilter":
-        return InvertedFilter(callback=self._unwrapped_callback)
+        return InvertedFilter(
+            callback=self._unwrapped_callback,
+            executor=self._executor,
+            run_inline=self._run_inline,
+            circuit_breaker=self._circuit_breaker,
+        )
 
     def __and__(self, other: AnyFilter) -> "AndFilter":
         return AndFilter(left=self, right=other)
@@ -33,10 +108,21 @@ class Filter:
 
 class InvertedFilter(Filter):
     async def __call__(self, client: Client, update: Update, **deps) -> bool:
-        return not await super().__call__(client, update, **deps)
+        if self._circuit_breaker is None:
+            return not await self._callback(client, update, **deps)
+
+        return await self._call_with_circuit_breaker(client, update, **deps)
+
+    async def _call_callback(self, client: Client, update: Update, **deps) -> bool:
+        return not await self._callback(client, update, **deps)
 
     def __invert__(self) -> Filter:
-        return Filter(callback=self._unwrapped_callback)
+        return Filter(
+            callback=self._unwrapped_callback,
+            executor=self._executor,
+            run_inline=self._run_inline,
+            circuit_breaker=self._circuit_breaker,
+        )
 
 
 class AndFilter(Filter):
@@ -81,3 +167,181 @@ class OrFilter(Filter):
         right_value = await self._right(client, update, **deps)
 
         return left_value or right_value
+
+
+class UpdateTypeFilter(Filter):
+    """Filter that passes raw updates of one of `update_types`. Raw handlers
+    holders index handlers by this filter.
+    """
+
+    def __init__(self, update_types: Container):
+        self.update_types = update_types
+
+        super().__init__(callback=self._check, run_inline=True)
+
+    async def _check(self, client: Client, update: PackedRawUpdate) -> bool:
+        return type(update.update) in self.update_types
+
+
+class Regex(Filter):
+    """Filter that passes updates which text (see `utils.get_text`) matches
+    `pattern`. Handlers holders index such filters (see `indexes.RegexIndex`):
+    text of update is scanned once for all of them and match object is passed
+    to handler as `match` dependency, so filter doesn't search text again. This
+    works only if filter is not a part of `|` or `~` expression.
+    """
+
+    def __init__(self, pattern: Union[str, Pattern], flags: int = 0):
+        self.pattern: Pattern = re.compile(pattern, flags)
+
+        super().__init__(callback=self._check, run_inline=True)
+
+    async def _check(self, client: Client, update: Update, match: Match = None) -> bool:
+        # match found by index for this filter
+        if match is not None and getattr(match, "re", None) is self.pattern:
+            return True
+
+        text = get_text(update)
+
+        return text is not None and self.pattern.search(text) is not None
+
+
+class Keywords(Filter):
+    """Filter that passes updates which text (see `utils.get_text`) contains
+    any of `keywords`. Message handlers holders pool such filters into single
+    automaton and pass first found keyword to handlers as `keyword` dependency
+    (only if filter is not a part of `|` or `~` expression).
+    """
+
+    def __init__(self, *keywords: str, ignore_case: bool = True):
+        self.keywords: Tuple[str, ...] = keywords
+        self.ignore_case = ignore_case
+        self._automaton = KeywordAutomaton(
+            ((keyword, keyword) for keyword in keywords), ignore_case=ignore_case
+        )
+
+        super().__init__(callback=self._check, run_inline=True)
+
+    async def _check(self, client: Client, update: Update) -> bool:
+        text = get_text(update)
+
+        return text is not None and next(self._automaton.iter(text), None) is not None
+
+
+class IdSet(Filter):
+    """Base class of filters passing updates which id (chat id or user id) is
+    in set of `ids`. Handlers holders index handlers by such filters. Set can
+    be changed at runtime, indexes are updated incrementally.
+    """
+
+    def __init__(self, *ids: int):
+        self.ids: Set[int] = set(ids)
+        # indexes of holders (and handlers in them) that must be notified when
+        # set is changed; indexes are held weakly, since holders rebuild them
+        self._subscribers: List[Tuple[weakref.ref, "dispyro.types.Handler"]] = []
+
+        super().__init__(callback=self._check, run_inline=True)
+
+    @staticmethod
+    def get_id(update: Update) -> Optional[int]:
+        raise NotImplementedError
+
+    async def _check(self, client: Client, update: Update) -> bool:
+        return self.get_id(update) in self.ids
+
+    def subscribe(self, index: Any, handler: "dispyro.types.Handler") -> None:
+        self._subscribers.append((weakref.ref(index), handler))
+
+    def _notify(self, method: str, ids: Set[int]) -> None:
+        alive = []
+
+        for index_ref, handler in self._subscribers:
+            index = index_ref()
+
+            if index is not None:
+                getattr(index, method)(handler, ids)
+                alive.append((index_ref, handler))
+
+        self._subscribers = alive
+
+    def update(self, ids: Iterable[int]) -> None:
+        new_ids = set(ids) - self.ids
+        self.ids |= new_ids
+        self._notify("add_ids", new_ids)
+
+    def add(self, id: int) -> None:
+        self.update((id,))
+
+    def difference_update(self, ids: Iterable[int]) -> None:
+        removed_ids = self.ids & set(ids)
+        self.ids -= removed_ids
+        self._notify("remove_ids", removed_ids)
+
+    def discard(self, id: int) -> None:
+        self.difference_update((id,))
+
+    def __contains__(self, id: int) -> bool:
+        return id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class ChatIds(IdSet):
+    """Filter passing updates from chats with given ids."""
+
+    @staticmethod
+    def get_id(update: Update) -> Optional[int]:
+        return get_chat_id(update)
+
+
+class UserIds(IdSet):
+    """Filter passing updates from users with given ids."""
+
+    @staticmethod
+    def get_id(update: Update) -> Optional[int]:
+        return get_user_id(update)
+
+
+def iter_conjuncts(filter: AnyFilter) -> Iterator[AnyFilter]:
+    """Yields filters, which all must pass for `filter` to pass (parts of
+    `AndFilter` chains). Any other filter is yielded as is.
+    """
+
+    if isinstance(filter, AndFilter):
+        yield from iter_conjuncts(filter._left)
+        yield from iter_conjuncts(filter._right)
+
+    else:
+        yield filter
+
+
+def iter_callables(filter: AnyFilter) -> Iterator[Callable]:
+    """Yields callables, called when `filter` is checked."""
+
+    if isinstance(filter, (AndFilter, OrFilter)):
+        yield from iter_callables(filter._left)
+        yield from iter_callables(filter._right)
+
+    elif isinstance(filter, Filter):
+        yield filter._callback
+
+    else:
+        yield filter
+
+
+def get_missing_deps(filter: AnyFilter, deps: Set[str]) -> Set[str]:
+    """Returns names of dependencies required by `filter`, which are not in `deps`."""
+
+    missing: Set[str] = set()
+
+    for callable in iter_callables(filter):
+        missing |= get_missing_kwargs(callable, deps)
+
+    return missing
+
+
+def uses_deps(filter: AnyFilter, names: Set[str]) -> bool:
+    """Whether `filter` takes any of dependencies `names`."""
+
+    return any(takes_kwargs(callable, names) for callable in iter_callables(filter))
@@ -0,0 +1,16 @@
+from .context import FSMContext
+from .filters import ANY_STATE, StateFilter
+from .state import State, StatesGroup
+from .storage import BaseStorage, MemoryStorage, SQLiteStorage, StorageKey
+
+__all__ = (
+    "ANY_STATE",
+    "BaseStorage",
+    "FSMContext",
+    "MemoryStorage",
+    "SQLiteStorage",
+    "State",
+    "StateFilter",
+    "StatesGroup",
+    "StorageKey",
+)
@@ -0,0 +1,50 @@
+from typing import Any, Dict, Optional
+
+from .state import StateType, get_state_name
+from .storage import BaseStorage, StorageKey
+
+
+class FSMContext:
+    """State of current chat and user. Is created by `Dispatcher` once per update
+    and available for handlers and filters as `state` dependency.
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey, state: Optional[str]):
+        self._storage = storage
+        self._state = state
+        self.key = key
+
+    @property
+    def state(self) -> Optional[str]:
+        """State loaded for current update (or set during its processing)."""
+
+        return self._state
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} `{self.key}`: `{self._state}`"
+
+    async def get_state(self) -> Optional[str]:
+        return self._state
+
+    async def set_state(self, state: StateType = None) -> None:
+        state = get_state_name(state)
+
+        await self._storage.set_state(self.key, state)
+        self._state = state
+
+    async def get_data(self) -> Dict[str, Any]:
+        return await self._storage.get_data(self.key)
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        await self._storage.set_data(self.key, data)
+
+    async def update_data(self, **kwargs) -> Dict[str, Any]:
+        data = await self.get_data()
+        data.update(kwargs)
+        await self.set_data(data)
+
+        return data
+
+    async def clear(self) -> None:
+        await self.set_state(None)
+        await self.set_data({})
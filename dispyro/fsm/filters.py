@@ -0,0 +1,40 @@
+from typing import FrozenSet, Optional
+
+from pyrogram import Client
+
+from ..filters import Filter
+from ..types import Update
+from .state import StateType, get_state_name
+
+ANY_STATE = "*"
+
+
+class StateFilter(Filter):
+    """Filter that passes updates which current state is one of `states`.
+    `None` stands for "no state", `"*"` stands for any state.
+
+    Handlers holders index handlers by this filter, so only handlers for current
+    state are checked.
+
+    Put this filter first when combining it with Pyrogram filters:
+    `StateFilter(None) & filters.command("form")` is dispyro filter, which
+    passes `raw_state` dependency to this filter, while
+    `filters.command("form") & StateFilter(None)` is Pyrogram filter, which
+    calls this filter without dependencies, so it always sees "no state".
+    """
+
+    def __init__(self, *states: StateType):
+        if not states:
+            raise ValueError("at least one state should be passed")
+
+        self.states: FrozenSet[Optional[str]] = frozenset(map(get_state_name, states))
+
+        super().__init__(callback=self._check, run_inline=True)
+
+    async def _check(
+        self, client: Client, update: Update, raw_state: Optional[str] = None
+    ) -> bool:
+        return ANY_STATE in self.states or raw_state in self.states
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} {sorted(self.states, key=str)}"
@@ -0,0 +1,52 @@
+from typing import Optional, Tuple, Union
+
+
+class State:
+    """Single state of conversation. When defined as class attribute, gets name
+    in form of `ClassName:attribute`.
+    """
+
+    def __init__(self, name: str = None):
+        self.name: Optional[str] = name
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        if self.name is None:
+            self.name = f"{owner.__name__}:{name}"
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} `{self.name}`"
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, State):
+            return self.name == other.name
+
+        if isinstance(other, str):
+            return self.name == other
+
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
+
+class StatesGroup:
+    """Base class for grouping related states together."""
+
+    __states__: Tuple[State, ...] = ()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.__states__ = tuple(value for value in vars(cls).values() if isinstance(value, State))
+
+
+StateType = Union[State, str, None]
+
+
+def get_state_name(state: StateType) -> Optional[str]:
+    if isinstance(state, State):
+        return state.name
+
+    return state
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+ReturnType = TypeVar("ReturnType")
+
+# (chat_id, user_id) pair, any of values can be `None`
+StorageKey = Tuple[Optional[int], Optional[int]]
+
+
+class BaseStorage:
+    """Base class for FSM storages. Storage keeps state and data for each
+    `StorageKey`.
+    """
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set_state(self, key: StorageKey, state: Optional[str]) -> None:
+        raise NotImplementedError
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class _Record:
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.expires_at: Optional[float] = None
+
+
+class MemoryStorage(BaseStorage):
+    """Storage that keeps records in memory. At most `max_size` records are
+    kept, least recently used are dropped first. If `ttl` is set, records
+    that were not accessed for `ttl` seconds are dropped as well.
+    """
+
+    def __init__(self, max_size: int = 100_000, ttl: float = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._records: "OrderedDict[StorageKey, _Record]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _get_record(self, key: StorageKey, create: bool = False) -> Optional[_Record]:
+        record = self._records.get(key)
+        now = time.monotonic()
+
+        if record is not None and record.expires_at is not None and record.expires_at <= now:
+            del self._records[key]
+            record = None
+
+        if record is None:
+            if not create:
+                return None
+
+            record = self._records[key] = _Record()
+
+            while len(self._records) > self._max_size:
+                self._records.popitem(last=False)
+
+        else:
+            self._records.move_to_end(key)
+
+        if self._ttl is not None:
+            record.expires_at = now + self._ttl
+
+        return record
+
+    def _drop_empty(self, key: StorageKey, record: _Record) -> None:
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get_record(key)
+
+        return record.state if record is not None else None
+
+    async def set_state(self, key: StorageKey, state: Optional[str]) -> None:
+        record = self._get_record(key, create=True)
+        record.state = state
+        self._drop_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get_record(key)
+
+        return dict(record.data) if record is not None else {}
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._get_record(key, create=True)
+        record.data = dict(data)
+        self._drop_empty(key, record)
+
+
+class SQLiteStorage(BaseStorage):
+    """Storage that keeps records in local SQLite database. Data must be
+    JSON-serializable. If `ttl` is set, records that were not changed for
+    `ttl` seconds are considered empty.
+
+    All queries are made in separate thread, so they don't block event loop.
+    """
+
+    def __init__(self, path: str, ttl: float = None, table: str = "dispyro_fsm"):
+        self._path = path
+        self._ttl = ttl
+        self._table = table
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispyro-fsm")
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} ("
+                "chat_id INTEGER NOT NULL, "
+                "user_id INTEGER NOT NULL, "
+                "state TEXT, "
+                "data TEXT, "
+                "updated_at REAL NOT NULL, "
+                "PRIMARY KEY (chat_id, user_id))"
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    async def _run(self, function: Callable[..., ReturnType], *args) -> ReturnType:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._executor, partial(function, *args))
+
+    @staticmethod
+    def _key(key: StorageKey) -> Tuple[int, int]:
+        # SQLite doesn't treat NULLs as equal in primary keys
+        chat_id, user_id = key
+
+        return chat_id or 0, user_id or 0
+
+    def _select(self, key: StorageKey) -> Tuple[Optional[str], Optional[str]]:
+        connection = self._connect()
+        row = connection.execute(
+            f"SELECT state, data, updated_at FROM {self._table} WHERE chat_id = ? AND user_id = ?",
+            self._key(key),
+        ).fetchone()
+
+        if row is None:
+            return None, None
+
+        state, data, updated_at = row
+
+        if self._ttl is not None and updated_at + self._ttl <= time.time():
+            connection.execute(
+                f"DELETE FROM {self._table} WHERE chat_id = ? AND user_id = ?", self._key(key)
+            )
+            connection.commit()
+            return None, None
+
+        return state, data
+
+    def _upsert(self, key: StorageKey, column: str, value: Optional[str]) -> None:
+        connection = self._connect()
+        state, data = self._select(key)
+        values = {"state": state, "data": data, column: value}
+
+        if values["state"] is None and values["data"] is None:
+            connection.execute(
+                f"DELETE FROM {self._table} WHERE chat_id = ? AND user_id = ?", self._key(key)
+            )
+
+        else:
+            connection.execute(
+                f"INSERT OR REPLACE INTO {self._table} "
+                "(chat_id, user_id, state, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (*self._key(key), values["state"], values["data"], time.time()),
+            )
+
+        connection.commit()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._run(self._select, key)
+
+        return state
+
+    async def set_state(self, key: StorageKey, state: Optional[str]) -> None:
+        await self._run(self._upsert, key, "state", state)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._run(self._select, key)
+
+        return json.loads(data) if data else {}
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._upsert, key, "data", json.dumps(data) if data else None)
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+
+        self._executor.shutdown()
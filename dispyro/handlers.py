@@ -12,16 +12,29 @@
 # `priority_factory`. This function must take 2 arguments
 # (handler itself and `router` that registering this handler) and return
 # positive `int`.
-
-from typing import Callable, List
+#
+# Callbacks don't have to be coroutine functions: synchronous callbacks are
+# called in executor (`dispyro.utils.get_executor()` by default, can be
+# overridden with `executor` argument), so blocking code doesn't stall event
+# loop. Callbacks known to be cheap can be called right in event loop by
+# passing `run_inline=True`.
+
+import asyncio
+import logging
+from concurrent.futures import Executor
+from contextlib import AsyncExitStack
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from pyrogram import Client, types
 
 import dispyro
 
-from .filters import Filter
+from .circuit_breaker import CircuitBreaker
+from .filters import Filter, get_missing_deps, uses_deps
+from .limits import Limits, get_timeout
 from .types import AnyFilter, Callback, PackedRawUpdate, Update
 from .types.signatures import (
+    BatchHandlerCallback,
     CallbackQueryHandlerCallback,
     ChatMemberUpdatedHandlerCallback,
     ChosenInlineResultHandlerCallback,
@@ -33,7 +46,9 @@ from .types.signatures import (
     RawUpdateHandlerCallback,
     UserStatusHandlerCallback,
 )
-from .utils import safe_call
+from .utils import get_missing_kwargs, safe_call, takes_kwargs
+
+log = logging.getLogger(__name__)
 
 PriorityFactory = Callable[["Handler", "dispyro.Router"], int]
 
@@ -56,6 +71,10 @@ class Handler:
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         if priority is not None:
             self._priority = priority
@@ -63,9 +82,16 @@ class Handler:
             self._priority = self._priority_factory(router)
 
         self._name = name or "unnamed_handler"
-        self.callback: Callback = safe_call(callable=callback)
+        self._unwrapped_callback = callback
+        self.callback: Callback = safe_call(
+            callable=callback, executor=executor, run_inline=run_inline
+        )
         self._router = router
         self._filters: Filter = Filter() & filters
+        self._limits = limits
+        self._circuit_breaker = circuit_breaker
+        # holder this handler is registered in, `None` if not registered
+        self._holder: Optional["dispyro.handlers_holders.HandlersHolder"] = None
 
         # This field indicates whether handler was called during handling current
         # update. Defaults to `False`. Set to `False` on cleanup (after finishing
@@ -84,8 +110,95 @@ class Handler:
         if not filters_passed:
             return
 
-        await self.callback(client, update, **deps)
-        self._triggered = True
+        if self._circuit_breaker is None:
+            triggered = await self._run_callback(client, update, deps)
+        else:
+            triggered = await self._run_with_circuit_breaker(client, update, deps)
+
+        if triggered:
+            self._triggered = True
+
+    async def _run_with_circuit_breaker(self, client: Client, update: Update, deps: Dict) -> bool:
+        circuit_breaker = self._circuit_breaker
+
+        if not circuit_breaker.allow():
+            if circuit_breaker.fallback is None:
+                return False
+
+            await circuit_breaker.fallback(client, update, **deps)
+            return True
+
+        try:
+            triggered = await self._run_callback(client, update, deps)
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            circuit_breaker.record_cancelled()
+            raise
+
+        if triggered:
+            circuit_breaker.record_success()
+        else:
+            # callback timed out
+            circuit_breaker.record_failure()
+
+        return triggered
+
+    async def _run_callback(self, client: Client, update: Update, deps: Dict) -> bool:
+        """Calls callback within router and handler limits. Returns `False` if
+        callback timed out.
+        """
+
+        limits = [item for item in (self._router.limits, self._limits) if item is not None]
+
+        if not limits:
+            await self.callback(client, update, **deps)
+            return True
+
+        async with AsyncExitStack() as stack:
+            for item in limits:
+                await stack.enter_async_context(item.acquire(update))
+
+            timeout = get_timeout(limits)
+
+            try:
+                await asyncio.wait_for(self.callback(client, update, **deps), timeout)
+
+            except asyncio.TimeoutError:
+                for item in limits:
+                    item.stats.timeouts += 1
+
+                log.warning("%r timed out after %s seconds", self, timeout)
+                return False
+
+        return True
+
+    def get_missing_deps(self, deps: Set[str]) -> Set[str]:
+        """Returns names of dependencies required by filters or callback, which
+        are not in `deps`.
+        """
+
+        return get_missing_deps(self._filters, deps) | get_missing_kwargs(self.callback, deps)
+
+    def uses_deps(self, names: Set[str]) -> bool:
+        """Whether filters or callback take any of dependencies `names`."""
+
+        return uses_deps(self._filters, names) or takes_kwargs(self.callback, names)
+
+    @property
+    def registered(self) -> bool:
+        return self._holder is not None
+
+    def unregister(self) -> None:
+        """Removes handler from holder it's registered in. Handler is not called
+        for new updates, but can still finish updates it's processing.
+        """
+
+        if self._holder is None:
+            raise ValueError(f"{self!r} is not registered")
+
+        self._holder.unregister(self)
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__} `{self._name}`"
@@ -102,6 +215,10 @@ class CallbackQueryHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -109,6 +226,10 @@ class CallbackQueryHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -132,6 +253,10 @@ class ChatMemberUpdatedHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -139,6 +264,10 @@ class ChatMemberUpdatedHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -162,6 +291,10 @@ class ChosenInlineResultHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -169,6 +302,10 @@ class ChosenInlineResultHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -192,6 +329,10 @@ class DeletedMessagesHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -199,6 +340,10 @@ class DeletedMessagesHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -222,6 +367,10 @@ class EditedMessageHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -229,6 +378,10 @@ class EditedMessageHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -252,6 +405,10 @@ class InlineQueryHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -259,6 +416,10 @@ class InlineQueryHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -282,6 +443,10 @@ class MessageHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -289,6 +454,10 @@ class MessageHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -312,6 +481,10 @@ class PollHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -319,6 +492,10 @@ class PollHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -342,6 +519,10 @@ class RawUpdateHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -349,6 +530,10 @@ class RawUpdateHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -372,6 +557,10 @@ class UserStatusHandler(Handler):
         name: str = None,
         priority: int = None,
         filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ):
         super().__init__(
             callback=callback,
@@ -379,6 +568,10 @@ class UserStatusHandler(Handler):
             name=name,
             priority=priority,
             filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
         )
 
     async def __call__(
@@ -389,3 +582,147 @@ class UserStatusHandler(Handler):
         **deps,
     ) -> None:
         await super().__call__(client=client, update=update, **deps)
+
+
+class BatchHandler(Handler):
+    """Handler that collects updates and calls callback with list of them. Batch
+    is processed when it has `max_size` updates or `max_delay` seconds passed
+    since its first update was collected.
+
+    Only callback is batched: filters are still called for every update
+    separately, with dependencies of that update (calls for updates of one
+    batch run concurrently, right before calling callback). Filters that can
+    check many updates at once should be done by callback itself.
+
+    Callback gets dependencies shared by all its updates (e.g. `dispatcher`)
+    and `batch_deps`: list of dependencies of every update, in order of updates.
+
+    Batch handlers never stop update propagation, since callback is called later.
+    """
+
+    callback: BatchHandlerCallback
+
+    def __init__(
+        self,
+        *,
+        callback: BatchHandlerCallback,
+        router: "dispyro.Router",
+        name: str = None,
+        priority: int = None,
+        filters: AnyFilter = Filter(),
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+        max_size: int = 100,
+        max_delay: float = 0.05,
+    ):
+        super().__init__(
+            callback=callback,
+            router=router,
+            name=name,
+            priority=priority,
+            filters=filters,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
+        )
+
+        self._max_size = max_size
+        self._max_delay = max_delay
+
+        self._batch: List[Tuple[Client, Update, Dict]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        *,
+        client: Client,
+        update: Update,
+        **deps,
+    ) -> None:
+        self._batch.append((client, update, deps))
+
+        if len(self._batch) >= self._max_size:
+            self._schedule_flush()
+
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self._max_delay, self._schedule_flush)
+
+    def _take_batch(self) -> List[Tuple[Client, Update, Dict]]:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._batch = self._batch, []
+
+        return batch
+
+    def _schedule_flush(self) -> None:
+        batch = self._take_batch()
+
+        if not batch:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._process(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def get_missing_deps(self, deps: Set[str]) -> Set[str]:
+        return super().get_missing_deps({*deps, "batch_deps"})
+
+    def uses_deps(self, names: Set[str]) -> bool:
+        # `batch_deps` has all dependencies of every update
+        return super().uses_deps({*names, "batch_deps"})
+
+    @staticmethod
+    def _merge_deps(batch_deps: List[Dict]) -> Dict:
+        shared = {
+            name: value
+            for name, value in batch_deps[-1].items()
+            if all(deps.get(name, ...) is value for deps in batch_deps)
+        }
+
+        return {**shared, "batch_deps": batch_deps}
+
+    async def _process(self, batch: List[Tuple[Client, Update, Dict]]) -> None:
+        groups: Dict[Client, Tuple[List[Update], List[Dict]]] = {}
+
+        try:
+            # filters take single update, so they are called for each of them
+            passed = await asyncio.gather(
+                *(
+                    self._filters(client=client, update=update, **deps)
+                    for client, update, deps in batch
+                )
+            )
+
+            for (client, update, deps), filters_passed in zip(batch, passed):
+                if filters_passed:
+                    updates, batch_deps = groups.setdefault(client, ([], []))
+                    updates.append(update)
+                    batch_deps.append(deps)
+
+            for client, (updates, batch_deps) in groups.items():
+                deps = self._merge_deps(batch_deps)
+
+                if self._circuit_breaker is None:
+                    await self._run_callback(client, updates, deps)
+                else:
+                    await self._run_with_circuit_breaker(client, updates, deps)
+
+        except Exception:
+            log.exception("Error while processing batch in %r", self)
+
+    async def flush(self) -> None:
+        """Processes collected updates right now and waits for all batches to be
+        processed.
+        """
+
+        self._schedule_flush()
+
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
@@ -1,14 +1,36 @@
 from collections.abc import Container
-from typing import Callable, List, Optional
+from concurrent.futures import Executor
+from itertools import chain
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from pyrogram import Client, types
 from pyrogram.raw import base
 
 import dispyro
 
+from .circuit_breaker import CircuitBreaker
 from .enums import RunLogic
-from .filters import Filter
+from .filters import (
+    Filter,
+    Keywords,
+    UpdateTypeFilter,
+    get_missing_deps,
+    iter_conjuncts,
+    uses_deps,
+)
 from .handlers import (
+    BatchHandler,
     CallbackQueryHandler,
     ChatMemberUpdatedHandler,
     ChosenInlineResultHandler,
@@ -20,44 +42,409 @@ from .handlers import (
     RawUpdateHandler,
     UserStatusHandler,
 )
+from .indexes import (
+    ChatIdIndex,
+    HandlersDeps,
+    HandlersIndex,
+    KeywordIndex,
+    RegexIndex,
+    StateIndex,
+    UpdateTypeIndex,
+    UserIdIndex,
+)
+from .limits import Limits
 from .types import AnyFilter, Callback, Handler, PackedRawUpdate, Update
+from .types.signatures import BatchHandlerCallback
+
+
+class DispatchPlan(NamedTuple):
+    """Immutable snapshot of holder handlers, used to process single update.
+    Is rebuilt (not changed) when handlers are registered or unregistered, so
+    updates that are being processed keep using plan they started with.
+    """
+
+    # all handlers sorted by priority
+    handlers: Tuple[Handler, ...]
+    # handlers that must be checked for every update, sorted by priority
+    unindexed: List[Handler]
+    indexes: List[HandlersIndex]
+    # position of each handler in `handlers`
+    order: Dict[Handler, int]
+    # names of dependencies provided for handlers by indexes they are in
+    provided: Dict[Handler, Tuple[str, ...]]
 
 
 class HandlersHolder:
     __handler_type__: Handler
+    __indexes__: Tuple[Type[HandlersIndex], ...] = (ChatIdIndex, UserIdIndex, StateIndex)
 
     def __init__(self, router: "dispyro.Router", filters: AnyFilter = None):
         self.filters = Filter() & filters if filters else Filter()
-        self.handlers: List[Handler] = []
+        # used as ordered set, so handlers can be removed in O(1)
+        self._handlers: Dict[Handler, None] = {}
         self._router = router
+        self._plan: Optional[DispatchPlan] = None
+        # position of index in `__indexes__` and filter handler is indexed by,
+        # found once per handler, so plans are rebuilt cheaply
+        self._index_filters: Dict[Handler, Optional[Tuple[int, AnyFilter]]] = {}
+
+        self._batch_max_size: int = 100
+        self._batch_max_delay: float = 0.05
+
+    def _apply_changes(
+        self, handlers: Dict[Handler, None], filters: AnyFilter, added: Iterable[Handler] = ()
+    ) -> None:
+        """Rebuilds plan after handlers or filters were changed. Filters and
+        `added` handlers of frozen router are checked by dispatcher, previous
+        `handlers`, `filters` and plan are restored if check fails.
+        """
+
+        previous_plan, self._plan = self._plan, None
+
+        if not self._router.frozen:
+            return
+
+        try:
+            self.get_plan()
+            self._router._handlers_changed(self, previous_plan, added)
+
+        except BaseException:
+            for handler in self._handlers:
+                handler._holder = None
+
+            for handler in handlers:
+                handler._holder = self
+
+            self._handlers = handlers
+            self.filters = filters
+            self._plan = previous_plan
+
+            for handler in added:
+                self._index_filters.pop(handler, None)
+
+            raise
 
     def filter(self, filter: AnyFilter) -> None:
+        filters = self.filters
         self.filters &= filter
+        self._apply_changes(dict(self._handlers), filters)
+
+    def configure_batching(self, max_size: int = None, max_delay: float = None) -> None:
+        """Sets default batch size and delay for batch handlers of this holder."""
+
+        if max_size is not None:
+            self._batch_max_size = max_size
+
+        if max_delay is not None:
+            self._batch_max_delay = max_delay
+
+    @property
+    def handlers(self) -> List[Handler]:
+        return list(self._handlers)
+
+    def add_handler(self, handler: Handler) -> Handler:
+        handlers = dict(self._handlers)
+
+        handler._holder = self
+        self._handlers[handler] = None
+        self._apply_changes(handlers, self.filters, added=(handler,))
+
+        return handler
+
+    def unregister(self, handler: Union[Handler, Callback]) -> None:
+        """Removes handler. Callback can be passed instead of handler, in such case
+        all handlers with this callback are removed. Updates that are already
+        being processed are not affected.
+        """
+
+        if isinstance(handler, dispyro.handlers.Handler):
+            handlers = [handler]
+        else:
+            handlers = [item for item in self._handlers if item._unwrapped_callback is handler]
+
+        for item in handlers:
+            if item not in self._handlers:
+                raise ValueError(f"{item!r} is not registered in {self!r}")
+
+        previous = dict(self._handlers)
+
+        for item in handlers:
+            del self._handlers[item]
+            self._index_filters.pop(item, None)
+            item._holder = None
+
+        self._apply_changes(previous, self.filters)
+
+    def add(
+        self,
+        callback: Callback,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+    ) -> Handler:
+        """Same as `register`, but returns created handler, which can be used to
+        unregister it later.
+        """
 
-    def register(
-        self, callback: Callback, filters: Filter = Filter(), priority: int = None
-    ) -> Callback:
         handler_type = self.__handler_type__
 
-        self.handlers.append(
+        return self.add_handler(
             handler_type(
                 callback=callback,
                 router=self._router,
                 priority=priority,
                 filters=filters,
+                executor=executor,
+                run_inline=run_inline,
+                limits=limits,
+                circuit_breaker=circuit_breaker,
             )
         )
 
+    def register(
+        self,
+        callback: Callback,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+    ) -> Callback:
+        self.add(
+            callback=callback,
+            filters=filters,
+            priority=priority,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
+        )
+
         return callback
 
     def __call__(
-        self, filters: Filter = Filter(), priority: int = None
+        self,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
     ) -> Callable[[Callback], Callback]:
         def decorator(callback: Callback) -> Callback:
-            return self.register(callback=callback, filters=filters, priority=priority)
+            return self.register(
+                callback=callback,
+                filters=filters,
+                priority=priority,
+                executor=executor,
+                run_inline=run_inline,
+                limits=limits,
+                circuit_breaker=circuit_breaker,
+            )
+
+        return decorator
+
+    def register_batch(
+        self,
+        callback: BatchHandlerCallback,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+        max_size: int = None,
+        max_delay: float = None,
+    ) -> BatchHandlerCallback:
+        """Registers `BatchHandler`, which callback receives list of updates
+        collected during `max_delay` seconds (but not more than `max_size`).
+        `filters` are checked for every update separately.
+        """
+
+        self.add_handler(
+            BatchHandler(
+                callback=callback,
+                router=self._router,
+                priority=priority,
+                filters=filters,
+                executor=executor,
+                run_inline=run_inline,
+                limits=limits,
+                circuit_breaker=circuit_breaker,
+                max_size=max_size or self._batch_max_size,
+                max_delay=max_delay or self._batch_max_delay,
+            )
+        )
+
+        return callback
+
+    def batch(
+        self,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+        max_size: int = None,
+        max_delay: float = None,
+    ) -> Callable[[BatchHandlerCallback], BatchHandlerCallback]:
+        def decorator(callback: BatchHandlerCallback) -> BatchHandlerCallback:
+            return self.register_batch(
+                callback=callback,
+                filters=filters,
+                priority=priority,
+                executor=executor,
+                run_inline=run_inline,
+                limits=limits,
+                circuit_breaker=circuit_breaker,
+                max_size=max_size,
+                max_delay=max_delay,
+            )
 
         return decorator
 
+    async def flush_batches(self) -> None:
+        for handler in self._handlers:
+            if isinstance(handler, BatchHandler):
+                await handler.flush()
+
+    def _find_index_filter(
+        self, handler: Handler, indexes: List[HandlersIndex]
+    ) -> Optional[Tuple[int, AnyFilter]]:
+        try:
+            return self._index_filters[handler]
+        except KeyError:
+            pass
+
+        found = None
+
+        for filter in iter_conjuncts(handler._filters):
+            found = next(
+                (
+                    (position, filter)
+                    for position, index in enumerate(indexes)
+                    if index.accepts(filter)
+                ),
+                None,
+            )
+
+            if found is not None:
+                break
+
+        self._index_filters[handler] = found
+
+        return found
+
+    def _build_plan(self) -> DispatchPlan:
+        handlers = tuple(sorted(self._handlers, key=lambda x: x._priority))
+        indexes = [index_type() for index_type in self.__indexes__]
+        unindexed: List[Handler] = []
+        provided: Dict[Handler, Tuple[str, ...]] = {}
+
+        for handler in handlers:
+            found = self._find_index_filter(handler, indexes)
+
+            if found is None:
+                unindexed.append(handler)
+                continue
+
+            position, filter = found
+            index = indexes[position]
+            index.add(handler, filter)
+
+            if index.provides:
+                provided[handler] = index.provides
+
+        for index in indexes:
+            index.build()
+
+        order = {handler: position for position, handler in enumerate(handlers)}
+
+        return DispatchPlan(
+            handlers=handlers,
+            unindexed=unindexed,
+            indexes=indexes,
+            order=order,
+            provided=provided,
+        )
+
+    def get_plan(self) -> DispatchPlan:
+        plan = self._plan
+
+        if plan is None:
+            plan = self._plan = self._build_plan()
+
+        return plan
+
+    def get_handlers(
+        self, client: Client, update: Update, plan: DispatchPlan = None, **deps
+    ) -> List[Handler]:
+        """Returns handlers that can be triggered by `update`, sorted by priority."""
+
+        handlers, _ = self._get_candidates(client, update, plan or self.get_plan(), deps)
+
+        return handlers
+
+    def _get_candidates(
+        self, client: Client, update: Update, plan: DispatchPlan, deps: dict
+    ) -> Tuple[List[Handler], HandlersDeps]:
+        unindexed, indexes, order = plan.unindexed, plan.indexes, plan.order
+
+        found: List[Handler] = []
+        handlers_deps: HandlersDeps = {}
+
+        for index in indexes:
+            index_handlers, index_deps = index.lookup_with_deps(client, update, deps)
+            found.extend(index_handlers)
+
+            if index_deps:
+                handlers_deps.update(index_deps)
+
+        if not found:
+            return unindexed, handlers_deps
+
+        return sorted(chain(unindexed, found), key=order.__getitem__), handlers_deps
+
+    def validate(self, deps: Set[str], handlers: Iterable[Handler] = None) -> List[str]:
+        """Checks that filters and callbacks of `handlers` (all handlers by
+        default) get all dependencies they require, when `deps` are provided.
+        Returns descriptions of problems.
+        """
+
+        problems = [
+            f"filter of {self!r} in {self._router!r} requires `{name}`, which is not provided"
+            for name in sorted(get_missing_deps(self.filters, deps))
+        ]
+
+        plan = self.get_plan()
+
+        for handler in plan.handlers if handlers is None else handlers:
+            handler_deps = deps.union(plan.provided.get(handler, ()))
+
+            problems.extend(
+                f"{handler!r} in {self._router!r} requires `{name}`, which is not provided"
+                for name in sorted(handler.get_missing_deps(handler_deps))
+            )
+
+        return problems
+
+    def uses_deps(self, names: Set[str]) -> bool:
+        """Whether holder filters or any of its handlers take any of
+        dependencies `names`.
+        """
+
+        return uses_deps(self.filters, names) or any(
+            handler.uses_deps(names) for handler in self.get_plan().handlers
+        )
+
+    def __repr__(self) -> str:
+        return self.__class__.__name__
+
     async def feed_update(
         self, client: Client, run_logic: RunLogic, update: Update, **deps
     ) -> bool:
@@ -68,9 +455,19 @@ class HandlersHolder:
 
         self._router._triggered = True
 
-        handlers = sorted(self.handlers, key=lambda x: x._priority)
+        plan = self.get_plan()
+
+        handlers, handlers_deps = self._get_candidates(client, update, plan, deps)
         for handler in handlers:
-            await handler(client=client, update=update, **deps)
+            handler_deps = handlers_deps.get(handler)
+
+            if handler_deps:
+                await handler(client=client, update=update, **{**deps, **handler_deps})
+            else:
+                await handler(client=client, update=update, **deps)
+
+            if handler._triggered:
+                self._router._triggered_handlers.append(handler)
 
             if handler._triggered and run_logic in {
                 RunLogic.ONE_RUN_PER_ROUTER,
@@ -123,6 +520,7 @@ class DeletedMessagesHandlersHolder(HandlersHolder):
 
 class EditedMessageHandlersHolder(HandlersHolder):
     __handler_type__ = EditedMessageHandler
+    __indexes__ = (ChatIdIndex, UserIdIndex, KeywordIndex, RegexIndex, StateIndex)
     handlers: List[EditedMessageHandler]
 
     async def feed_update(
@@ -143,6 +541,7 @@ class InlineQueryHandlersHolder(HandlersHolder):
 
 class MessageHandlersHolder(HandlersHolder):
     __handler_type__ = MessageHandler
+    __indexes__ = (ChatIdIndex, UserIdIndex, KeywordIndex, RegexIndex, StateIndex)
     handlers: List[MessageHandler]
 
     async def feed_update(
@@ -150,6 +549,58 @@ class MessageHandlersHolder(HandlersHolder):
     ) -> bool:
         return await super().feed_update(client=client, run_logic=run_logic, update=update, **deps)
 
+    def register_keywords(
+        self,
+        callback: Callback,
+        keywords: Iterable[str],
+        ignore_case: bool = True,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+    ) -> Callback:
+        """Registers handler triggered by messages containing any of `keywords`
+        (see `filters.Keywords`). Found keyword is passed as `keyword` dependency.
+        """
+
+        return self.register(
+            callback=callback,
+            filters=Keywords(*keywords, ignore_case=ignore_case) & filters,
+            priority=priority,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
+        )
+
+    def keywords(
+        self,
+        *keywords: str,
+        ignore_case: bool = True,
+        filters: Filter = Filter(),
+        priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
+    ) -> Callable[[Callback], Callback]:
+        def decorator(callback: Callback) -> Callback:
+            return self.register_keywords(
+                callback=callback,
+                keywords=keywords,
+                ignore_case=ignore_case,
+                filters=filters,
+                priority=priority,
+                executor=executor,
+                run_inline=run_inline,
+                limits=limits,
+                circuit_breaker=circuit_breaker,
+            )
+
+        return decorator
+
 
 class PollHandlersHolder(HandlersHolder):
     __handler_type__ = PollHandler
@@ -163,8 +614,21 @@ class PollHandlersHolder(HandlersHolder):
 
 class RawUpdateHandlersHolder(HandlersHolder):
     __handler_type__ = RawUpdateHandler
+    __indexes__ = (UpdateTypeIndex, ChatIdIndex, UserIdIndex, StateIndex)
     handlers: List[RawUpdateHandler]
 
+    def accepts_update_type(self, update_type: type[base.Update]) -> bool:
+        """Whether any handler can be triggered by raw update of `update_type`."""
+
+        plan = self.get_plan()
+
+        if not plan.handlers:
+            return False
+
+        type_index: UpdateTypeIndex = plan.indexes[0]
+
+        return type_index.size < len(plan.handlers) or update_type in type_index
+
     async def feed_update(
         self, client: Client, run_logic: RunLogic, update: PackedRawUpdate, **deps
     ) -> bool:
@@ -175,6 +639,10 @@ class RawUpdateHandlersHolder(HandlersHolder):
         callback: Callback,
         filters: Filter = Filter(),
         priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
         allowed_updates: List[type[base.Update]] = None,
         allowed_update: type[base.Update] = None,
     ) -> Callback:
@@ -198,19 +666,26 @@ class RawUpdateHandlersHolder(HandlersHolder):
             _allowed_updates = allowed_updates
 
         if _allowed_updates is not None:
-
-            async def types_filter_callback(_, update: PackedRawUpdate) -> bool:
-                return type(update.update) in _allowed_updates
-
-            types_filter = Filter(callback=types_filter_callback)
-            filters = types_filter & filters
-
-        return super().register(callback=callback, filters=filters, priority=priority)
+            filters = UpdateTypeFilter(update_types=_allowed_updates) & filters
+
+        return super().register(
+            callback=callback,
+            filters=filters,
+            priority=priority,
+            executor=executor,
+            run_inline=run_inline,
+            limits=limits,
+            circuit_breaker=circuit_breaker,
+        )
 
     def __call__(
         self,
         filters: Filter = Filter(),
         priority: int = None,
+        executor: Executor = None,
+        run_inline: bool = False,
+        limits: Limits = None,
+        circuit_breaker: CircuitBreaker = None,
         allowed_updates: List[type[base.Update]] = None,
         allowed_update: type[base.Update] = None,
     ) -> Callable[[Callback], Callback]:
@@ -219,6 +694,10 @@ class RawUpdateHandlersHolder(HandlersHolder):
                 callback=callback,
                 filters=filters,
                 priority=priority,
+                executor=executor,
+                run_inline=run_inline,
+                limits=limits,
+                circuit_breaker=circuit_breaker,
                 allowed_updates=allowed_updates,
                 allowed_update=allowed_update,
             )
@@ -0,0 +1,387 @@
+# This file defines indexes, used by handlers holders to pick handlers that can
+# be triggered by update without checking filters of all of them.
+#
+# When building index, holder looks through parts of handler filters combined
+# with `&` (see `filters.iter_conjuncts`). First part recognized by one of
+# holder indexes puts handler to that index, such handler is checked only when
+# index returns it for update. Handlers without recognized filters are checked
+# for every update, as usual. Recognized filter is still checked when handler is
+# called, so indexes only narrow down list of candidates.
+#
+# Besides candidates, index can return dependencies for specific handlers
+# (e.g. match objects of regular expressions), they are passed to handlers
+# together with other dependencies.
+
+import re
+from collections.abc import Iterable
+from typing import Any, Dict, List, Match, Optional, Pattern, Set, Tuple, Type
+
+from pyrogram import Client
+
+from .filters import ChatIds, IdSet, Keywords, Regex, UpdateTypeFilter, UserIds
+from .fsm import ANY_STATE, StateFilter
+from .keywords import KeywordAutomaton
+from .types import AnyFilter, Handler, PackedRawUpdate, Update
+from .utils import get_text
+
+HandlersDeps = Dict[Handler, Dict[str, Any]]
+
+
+class HandlersIndex:
+    """Base class for handlers indexes."""
+
+    # names of dependencies index provides for handlers, see `lookup_with_deps`
+    provides: Tuple[str, ...] = ()
+
+    def accepts(self, filter: AnyFilter) -> bool:
+        """Whether handler can be indexed by `filter`."""
+
+        raise NotImplementedError
+
+    def add(self, handler: Handler, filter: AnyFilter) -> None:
+        """Adds `handler` to index by `filter`. Handlers are added in order they
+        should be called.
+        """
+
+        raise NotImplementedError
+
+    def build(self) -> None:
+        """Is called once all handlers are added."""
+
+    def lookup(self, client: Client, update: Update, deps: dict) -> List[Handler]:
+        """Returns indexed handlers that can be triggered by `update`."""
+
+        raise NotImplementedError
+
+    def lookup_with_deps(
+        self, client: Client, update: Update, deps: dict
+    ) -> Tuple[List[Handler], HandlersDeps]:
+        """Same as `lookup`, but also returns dependencies for found handlers."""
+
+        return self.lookup(client, update, deps), {}
+
+
+class StateIndex(HandlersIndex):
+    """Index of handlers by FSM state (see `fsm.StateFilter`)."""
+
+    def __init__(self):
+        self._handlers: Dict[Optional[str], List[Handler]] = {}
+
+    def accepts(self, filter: AnyFilter) -> bool:
+        return isinstance(filter, StateFilter) and ANY_STATE not in filter.states
+
+    def add(self, handler: Handler, filter: StateFilter) -> None:
+        for state in filter.states:
+            self._handlers.setdefault(state, []).append(handler)
+
+    def lookup(self, client: Client, update: Update, deps: dict) -> List[Handler]:
+        return self._handlers.get(deps.get("raw_state"), [])
+
+
+class UpdateTypeIndex(HandlersIndex):
+    """Index of raw handlers by type of raw update (see `filters.UpdateTypeFilter`)."""
+
+    def __init__(self):
+        self._handlers: Dict[type, List[Handler]] = {}
+        self.size: int = 0
+
+    def __contains__(self, update_type: type) -> bool:
+        return update_type in self._handlers
+
+    def accepts(self, filter: AnyFilter) -> bool:
+        return isinstance(filter, UpdateTypeFilter) and isinstance(filter.update_types, Iterable)
+
+    def add(self, handler: Handler, filter: UpdateTypeFilter) -> None:
+        for update_type in filter.update_types:
+            self._handlers.setdefault(update_type, []).append(handler)
+
+        self.size += 1
+
+    def lookup(self, client: Client, update: PackedRawUpdate, deps: dict) -> List[Handler]:
+        return self._handlers.get(type(update.update), [])
+
+
+# flags that can be scoped to part of pattern, see `(?aiLmsux-imsx:...)` syntax
+SCOPED_FLAGS = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s", re.VERBOSE: "x"}
+
+# numbered and named backreferences change meaning when patterns are combined
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def _scope_pattern(pattern: Pattern) -> Optional[str]:
+    """Returns source of `pattern` which can be put into alternation with
+    other patterns, or `None` if it's not possible.
+    """
+
+    if not isinstance(pattern.pattern, str) or BACKREFERENCE.search(pattern.pattern):
+        return None
+
+    flags = pattern.flags & ~re.UNICODE
+    inline_flags = "".join(letter for flag, letter in SCOPED_FLAGS.items() if flags & flag)
+
+    if flags & ~sum(SCOPED_FLAGS):
+        return None
+
+    source = f"(?{inline_flags}:{pattern.pattern})" if inline_flags else f"(?:{pattern.pattern})"
+
+    try:
+        re.compile(source)
+    except re.error:
+        # e.g. global inline flags in the middle of pattern
+        return None
+
+    return source
+
+
+class RegexIndex(HandlersIndex):
+    """Index of handlers by regular expressions (see `filters.Regex`). Patterns
+    are combined into alternation, which finds positions where any of them
+    matches, so text of update is scanned once no matter how many patterns
+    there are. At every such position all patterns are tried at once by
+    expression of lookaheads with named groups, groups that matched map to
+    handlers. Handlers get match object as `match` dependency.
+    """
+
+    provides = ("match",)
+
+    def __init__(self):
+        self._handlers: Dict[Pattern, List[Handler]] = {}
+        # `None` if there are no patterns that can be combined
+        self._combined: Optional[Pattern] = None
+        # captures all combined patterns matching at position
+        self._captures: Optional[Pattern] = None
+        # combined patterns and numbers of their groups in `_captures`
+        self._groups: List[Tuple[Pattern, int]] = []
+        # patterns that can't be combined, they are searched one by one
+        self._separate: List[Pattern] = []
+
+    def accepts(self, filter: AnyFilter) -> bool:
+        return isinstance(filter, Regex)
+
+    def add(self, handler: Handler, filter: Regex) -> None:
+        self._handlers.setdefault(filter.pattern, []).append(handler)
+
+    def build(self) -> None:
+        combined: List[Tuple[Pattern, str]] = []
+        group_names: Set[str] = set()
+
+        for pattern in self._handlers:
+            source = _scope_pattern(pattern)
+
+            if source is None or group_names & pattern.groupindex.keys():
+                self._separate.append(pattern)
+                continue
+
+            group_names.update(pattern.groupindex)
+            combined.append((pattern, source))
+
+        if not combined:
+            return
+
+        names = []
+
+        for number in range(len(combined)):
+            name = f"_pattern{number}"
+
+            while name in group_names:
+                name = f"_{name}"
+
+            names.append(name)
+
+        self._combined = re.compile("|".join(source for _, source in combined))
+        self._captures = re.compile(
+            "".join(
+                f"(?:(?=(?P<{name}>{source})))?" for name, (_, source) in zip(names, combined)
+            )
+        )
+        self._groups = [
+            (pattern, self._captures.groupindex[name])
+            for name, (pattern, _) in zip(names, combined)
+        ]
+
+    def lookup(self, client: Client, update: Update, deps: dict) -> List[Handler]:
+        handlers, _ = self.lookup_with_deps(client, update, deps)
+
+        return handlers
+
+    def _search(self, text: str) -> Dict[Pattern, Match]:
+        matches: Dict[Pattern, Match] = {}
+
+        if self._combined is not None:
+            # starts of first matches of patterns, same as their `search` gives
+            starts: Dict[Pattern, int] = {}
+            groups = self._groups
+            position = 0
+
+            # `re` clamps positions past end of text, so empty match at the end
+            # would be found again and again
+            while groups and position <= len(text):
+                combined_match = self._combined.search(text, position)
+
+                if combined_match is None:
+                    break
+
+                position = combined_match.start()
+                captured = self._captures.match(text, position)
+                remaining = []
+
+                for pattern, group in groups:
+                    if captured.start(group) == -1:
+                        remaining.append((pattern, group))
+                    else:
+                        starts[pattern] = position
+
+                groups = remaining
+                position += 1
+
+            for pattern, start in starts.items():
+                matches[pattern] = pattern.match(text, start)
+
+        for pattern in self._separate:
+            match = pattern.search(text)
+
+            if match is not None:
+                matches[pattern] = match
+
+        return matches
+
+    def lookup_with_deps(
+        self, client: Client, update: Update, deps: dict
+    ) -> Tuple[List[Handler], HandlersDeps]:
+        if not self._handlers:
+            return [], {}
+
+        text = get_text(update)
+
+        if text is None:
+            return [], {}
+
+        matches = self._search(text)
+
+        handlers: List[Handler] = []
+        handlers_deps: HandlersDeps = {}
+
+        # handlers are kept in order of patterns they were added with
+        for pattern, pattern_handlers in self._handlers.items():
+            match = matches.get(pattern)
+
+            if match is None:
+                continue
+
+            for handler in pattern_handlers:
+                handlers.append(handler)
+                handlers_deps[handler] = {"match": match}
+
+        return handlers, handlers_deps
+
+
+class KeywordIndex(HandlersIndex):
+    """Index of handlers by keywords (see `filters.Keywords`). Keywords of all
+    handlers are put to two Aho-Corasick automatons (case-sensitive and not), so
+    text of update is scanned at most twice no matter how many keywords there
+    are. Handlers get first found keyword as `keyword` dependency.
+    """
+
+    provides = ("keyword",)
+
+    def __init__(self):
+        self._automatons = {
+            False: KeywordAutomaton(ignore_case=False),
+            True: KeywordAutomaton(ignore_case=True),
+        }
+        self._size = 0
+
+    def accepts(self, filter: AnyFilter) -> bool:
+        return isinstance(filter, Keywords)
+
+    def add(self, handler: Handler, filter: Keywords) -> None:
+        automaton = self._automatons[filter.ignore_case]
+
+        for keyword in filter.keywords:
+            automaton.add(keyword, (handler, keyword))
+
+        self._size += 1
+
+    def build(self) -> None:
+        for automaton in self._automatons.values():
+            automaton.build()
+
+    def lookup(self, client: Client, update: Update, deps: dict) -> List[Handler]:
+        handlers, _ = self.lookup_with_deps(client, update, deps)
+
+        return handlers
+
+    def lookup_with_deps(
+        self, client: Client, update: Update, deps: dict
+    ) -> Tuple[List[Handler], HandlersDeps]:
+        if not self._size:
+            return [], {}
+
+        text = get_text(update)
+
+        if text is None:
+            return [], {}
+
+        handlers_deps: HandlersDeps = {}
+
+        for automaton in self._automatons.values():
+            if not len(automaton):
+                continue
+
+            for handler, keyword in automaton.iter(text):
+                if handler not in handlers_deps:
+                    handlers_deps[handler] = {"keyword": keyword}
+
+        return list(handlers_deps), handlers_deps
+
+
+class IdIndex(HandlersIndex):
+    """Base class of indexes of handlers by chat or user ids (see
+    `filters.IdSet`). Index is updated when ids are added to filter or removed
+    from it, without rebuilding the whole holder plan.
+    """
+
+    __filter_type__: Type[IdSet]
+
+    def __init__(self):
+        self._handlers: Dict[int, List[Handler]] = {}
+
+    def accepts(self, filter: AnyFilter) -> bool:
+        return type(filter) is self.__filter_type__
+
+    def add(self, handler: Handler, filter: IdSet) -> None:
+        self.add_ids(handler, filter.ids)
+        filter.subscribe(self, handler)
+
+    def add_ids(self, handler: Handler, ids: Iterable[int]) -> None:
+        for id in ids:
+            handlers = self._handlers.setdefault(id, [])
+
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def remove_ids(self, handler: Handler, ids: Iterable[int]) -> None:
+        for id in ids:
+            handlers = self._handlers.get(id)
+
+            if handlers is None or handler not in handlers:
+                continue
+
+            handlers.remove(handler)
+
+            if not handlers:
+                del self._handlers[id]
+
+    def lookup(self, client: Client, update: Update, deps: dict) -> List[Handler]:
+        if not self._handlers:
+            return []
+
+        return self._handlers.get(self.__filter_type__.get_id(update), [])
+
+
+class ChatIdIndex(IdIndex):
+    __filter_type__ = ChatIds
+
+
+class UserIdIndex(IdIndex):
+    __filter_type__ = UserIds
@@ -0,0 +1,193 @@
+# This file defines cache of inline query answers. It's used as decorator of
+# inline query handlers callbacks, which return answer instead of sending it:
+# either list of results or dict of `InlineQuery.answer` arguments. Decorator
+# answers query itself, with cached answer if there is one.
+#
+# Answers are cached by normalized query text and offset (and by user, if
+# cache is created with `per_user=True`) for `ttl` seconds, at most `max_size`
+# least recently used answers are kept. Concurrent identical queries share one
+# callback call. When `cancel_superseded` is set, previous query of the same
+# user is not answered once user sends new one (since user doesn't see it
+# anyway), callback call is cancelled if no other query waits for it.
+#
+# Callbacks that return `None` are considered to answer query by themselves,
+# their results are not cached.
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from pyrogram import Client, types
+
+from .single_flight import SingleFlight
+from .types.signatures import InlineQueryHandlerCallback
+from .utils import safe_call
+
+Answer = Union[List[types.InlineQueryResult], Dict[str, Any]]
+QueryNormalizer = Callable[[str], str]
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+@dataclass
+class InlineQueryCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    superseded: int = 0
+    size: int = 0
+
+
+class InlineQueryCache:
+    """Decorator of inline query handlers callbacks, see top of this file.
+    `answer_kwargs` are passed to every `InlineQuery.answer` call.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60,
+        max_size: int = 10_000,
+        per_user: bool = False,
+        cancel_superseded: bool = True,
+        normalize: QueryNormalizer = normalize_query,
+        **answer_kwargs,
+    ):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._per_user = per_user
+        self._cancel_superseded = cancel_superseded
+        self._normalize = normalize
+        self._answer_kwargs = answer_kwargs
+
+        self._answers: "OrderedDict[Hashable, Tuple[float, Answer]]" = OrderedDict()
+        self._flights = SingleFlight()
+        # latest query of every user, resolved when it's superseded
+        self._latest: Dict[int, asyncio.Future] = {}
+        self._stats = InlineQueryCacheStats()
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    @property
+    def stats(self) -> InlineQueryCacheStats:
+        self._stats.size = len(self._answers)
+        self._stats.misses = self._flights.stats.calls
+        self._stats.coalesced = self._flights.stats.coalesced
+
+        return self._stats
+
+    def _key(self, inline_query: types.InlineQuery) -> Hashable:
+        user_id = inline_query.from_user.id if self._per_user else None
+
+        return user_id, self._normalize(inline_query.query), inline_query.offset
+
+    def get(self, key: Hashable) -> Optional[Answer]:
+        entry = self._answers.get(key)
+
+        if entry is None:
+            return None
+
+        expires_at, answer = entry
+
+        if expires_at <= time.monotonic():
+            del self._answers[key]
+            return None
+
+        self._answers.move_to_end(key)
+
+        return answer
+
+    def put(self, key: Hashable, answer: Answer) -> None:
+        self._answers[key] = (time.monotonic() + self._ttl, answer)
+        self._answers.move_to_end(key)
+
+        while len(self._answers) > self._max_size:
+            self._answers.popitem(last=False)
+
+    def clear(self) -> None:
+        self._answers.clear()
+
+    async def _compute(self, key: Hashable, call: Callable[[], Any]) -> Optional[Answer]:
+        answer = await call()
+
+        if answer is not None:
+            self.put(key, answer)
+
+        return answer
+
+    def _supersede(self, inline_query: types.InlineQuery) -> Optional[asyncio.Future]:
+        if not self._cancel_superseded:
+            return None
+
+        user_id = inline_query.from_user.id
+        previous = self._latest.get(user_id)
+
+        if previous is not None and not previous.done():
+            previous.set_result(None)
+
+        superseded = self._latest[user_id] = asyncio.get_running_loop().create_future()
+
+        return superseded
+
+    async def _wait(
+        self, key: Hashable, call: Callable[[], Any], superseded: Optional[asyncio.Future]
+    ) -> Tuple[bool, Optional[Answer]]:
+        if superseded is None:
+            return True, await self._flights.do(key, self._compute, key, call)
+
+        waiter = asyncio.ensure_future(self._flights.do(key, self._compute, key, call))
+
+        try:
+            await asyncio.wait([waiter, superseded], return_when=asyncio.FIRST_COMPLETED)
+
+            if not waiter.done():
+                self._stats.superseded += 1
+                return False, None
+
+            return True, waiter.result()
+
+        finally:
+            # shared call is cancelled if no other query waits for it
+            if not waiter.done():
+                waiter.cancel()
+
+    async def _answer(self, inline_query: types.InlineQuery, answer: Answer) -> None:
+        if isinstance(answer, dict):
+            await inline_query.answer(**{**self._answer_kwargs, **answer})
+        else:
+            await inline_query.answer(results=answer, **self._answer_kwargs)
+
+    def __call__(self, callback: InlineQueryHandlerCallback) -> InlineQueryHandlerCallback:
+        callback = safe_call(callable=callback)
+
+        @wraps(callback)
+        async def wrapper(client: Client, inline_query: types.InlineQuery, **deps) -> None:
+            key = self._key(inline_query)
+            superseded = self._supersede(inline_query)
+
+            try:
+                answer = self.get(key)
+
+                if answer is not None:
+                    self._stats.hits += 1
+                    await self._answer(inline_query, answer)
+                    return
+
+                call = partial(callback, client, inline_query, **deps)
+                completed, answer = await self._wait(key, call, superseded)
+
+                if completed and answer is not None:
+                    await self._answer(inline_query, answer)
+
+            finally:
+                user_id = inline_query.from_user.id
+
+                if superseded is not None and self._latest.get(user_id) is superseded:
+                    del self._latest[user_id]
+
+        return wrapper
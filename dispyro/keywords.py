@@ -0,0 +1,113 @@
+# This file defines Aho-Corasick automaton, used to find all occurrences of
+# many keywords in text in single pass. Matching costs O(text length + number
+# of matches) no matter how many keywords automaton has.
+
+from collections import deque
+from typing import Deque, Dict, Generic, Hashable, Iterable, Iterator, List, Tuple, TypeVar
+
+Value = TypeVar("Value", bound=Hashable)
+
+
+class KeywordAutomaton(Generic[Value]):
+    """Automaton built from `(keyword, value)` pairs. Searching yields values
+    of keywords found in text, in order their ends appear in text. With
+    `ignore_case`, keywords and text are compared case-insensitively
+    (using `str.casefold`).
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, Value]] = (), ignore_case: bool = False):
+        self.ignore_case = ignore_case
+
+        # state 0 is root
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # values of keywords ending in state
+        self._values: List[List[Value]] = [[]]
+        # nearest state reachable by fail links that has values, -1 if none
+        self._output: List[int] = [-1]
+        self._size = 0
+        self._built = False
+
+        for keyword, value in keywords:
+            self.add(keyword, value)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, keyword: str, value: Value) -> None:
+        if not keyword:
+            raise ValueError("keyword can't be empty")
+
+        if self.ignore_case:
+            keyword = keyword.casefold()
+
+        state = 0
+
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._values.append([])
+                self._output.append(-1)
+
+            state = next_state
+
+        self._values[state].append(value)
+        self._size += 1
+        self._built = False
+
+    def build(self) -> None:
+        queue: Deque[int] = deque(self._goto[0].values())
+
+        for state in queue:
+            self._fail[state] = 0
+
+        while queue:
+            state = queue.popleft()
+
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fail = self._fail[state]
+
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+
+        # output links are set in order of depth, so fail state is already done
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+            fail = self._fail[state]
+            self._output[state] = fail if self._values[fail] else self._output[fail]
+            queue.extend(self._goto[state].values())
+
+        self._built = True
+
+    def iter(self, text: str) -> Iterator[Value]:
+        if not self._built:
+            self.build()
+
+        if self.ignore_case:
+            text = text.casefold()
+
+        goto, fail, values, output = self._goto, self._fail, self._values, self._output
+        state = 0
+
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+            found = state if values[state] else output[state]
+
+            while found > 0:
+                yield from values[found]
+                found = output[found]
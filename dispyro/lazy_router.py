@@ -0,0 +1,165 @@
+# This file defines lazy routers: placeholders of routers, which modules are
+# imported only when router is needed. Placeholder is attached with cheap
+# precondition: update types and/or commands router handles. Module is
+# imported on first update matching precondition or in background right after
+# dispatcher is started (if `preload` is set), whichever happens first, then
+# real router takes place of placeholder.
+#
+# Module is imported in executor thread, so heavy imports don't block event
+# loop. Updates matching precondition wait for import to finish, other updates
+# are not delayed. If import fails, error is logged and placeholder stays,
+# handling nothing. Time spent on import is kept in `LazyRouter.report`.
+#
+# Raw updates are fed to lazy router only after it's loaded, since their types
+# are filtered before they reach routers.
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional, Union
+
+from pyrogram import Client, handlers
+from pyrogram.handlers.handler import Handler as PyrogramHandler
+
+import dispyro
+
+from .router import Router
+from .types import Update
+from .utils import get_text, resolve_import_path
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class LazyRouterReport:
+    path: str
+    # what caused import: "background" or "update"
+    trigger: Optional[str] = None
+    import_time: Optional[float] = None
+    loaded: bool = False
+    error: Optional[str] = None
+
+
+class LazyRouter(Router):
+    """Placeholder of router imported by `path` (e.g. `bot.routers.admin:router`),
+    see top of this file. Router is needed for updates of `update_types` (all
+    types by default) and, if `commands` are given, only for messages with
+    these commands (`update_types` default to messages then).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        update_types: Iterable[PyrogramHandler] = None,
+        commands: Iterable[str] = None,
+        prefixes: Union[str, Iterable[str]] = "/",
+        preload: bool = True,
+    ):
+        super().__init__(name=path)
+
+        self.path = path
+        self.preload = preload
+
+        if update_types is None and commands is not None:
+            update_types = (handlers.MessageHandler,)
+
+        self._update_types = frozenset(update_types) if update_types is not None else None
+        self._commands = (
+            frozenset(command.lower() for command in commands) if commands is not None else None
+        )
+        self._prefixes = (prefixes,) if isinstance(prefixes, str) else tuple(prefixes)
+
+        self._loading: Optional[asyncio.Task] = None
+        self.report = LazyRouterReport(path=path)
+
+    def handles(self, handler_type: PyrogramHandler) -> bool:
+        return self._update_types is None or handler_type in self._update_types
+
+    def matches(self, update: Update, handler_type: PyrogramHandler) -> bool:
+        """Checks precondition of router."""
+
+        if not self.handles(handler_type):
+            return False
+
+        if self._commands is None:
+            return True
+
+        text = get_text(update)
+
+        if not text:
+            return False
+
+        for prefix in self._prefixes:
+            if text.startswith(prefix):
+                words = text[len(prefix) :].split(maxsplit=1)
+
+                return bool(words) and words[0].partition("@")[0].lower() in self._commands
+
+        return False
+
+    def load(self, dispatcher: "dispyro.Dispatcher", trigger: str = "background") -> asyncio.Task:
+        """Starts loading router, if it's not started yet. Returned task
+        results in loaded router or `None` if loading failed.
+        """
+
+        if self._loading is None:
+            self.report.trigger = trigger
+            self._loading = asyncio.get_running_loop().create_task(self._load(dispatcher))
+
+        return self._loading
+
+    async def _load(self, dispatcher: "dispyro.Dispatcher") -> Optional[Router]:
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+
+        try:
+            router = await loop.run_in_executor(None, resolve_import_path, self.path)
+            self.report.import_time = time.perf_counter() - started_at
+
+            if not isinstance(router, Router):
+                raise TypeError(f"`{self.path}` is not a router")
+
+            dispatcher._replace_router(self, router)
+
+        except Exception as error:
+            self.report.error = repr(error)
+            log.exception("Can't load router `%s`", self.path)
+
+            return None
+
+        dispatcher._loaded_routers[self.path] = router
+        self.report.loaded = True
+
+        log.info("%r is loaded in %.3f seconds", router, self.report.import_time)
+
+        return router
+
+    async def feed_update(
+        self,
+        client: Client,
+        dispatcher: "dispyro.Dispatcher",
+        update: Update,
+        handler_type: PyrogramHandler,
+        **deps,
+    ) -> bool:
+        if not self.matches(update, handler_type):
+            return False
+
+        router = await asyncio.shield(self.load(dispatcher=dispatcher, trigger="update"))
+
+        if router is None:
+            return False
+
+        # dispatcher cleans up routers it started with, so placeholder does it
+        # for router it fed update to
+        try:
+            return await router.feed_update(
+                client=client,
+                dispatcher=dispatcher,
+                update=update,
+                handler_type=handler_type,
+                **deps,
+            )
+        finally:
+            router.cleanup()
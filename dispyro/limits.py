@@ -0,0 +1,168 @@
+# This file defines execution limits of handlers. Limits can be set for
+# specific handler (`limits` argument of registration methods) and for whole
+# router (`limits` argument of `Router`), in the latter case they are shared
+# by all handlers of router. Same `Limits` instance passed to several handlers
+# limits them together as well.
+#
+# When both router and handler have limits, router's ones are acquired first,
+# handler's timeout takes precedence. Timed out callbacks are cancelled and
+# handler is considered not triggered, so update goes to next handlers. Note
+# that synchronous callbacks, called in executor, can't be actually cancelled,
+# their threads keep running until callback returns.
+
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+from .types import Update
+from .utils import get_chat_id, get_user_id
+
+LockKeyFactory = Callable[[Update], Optional[Hashable]]
+
+
+def user_key(update: Update) -> Optional[Hashable]:
+    return get_user_id(update)
+
+
+def chat_key(update: Update) -> Optional[Hashable]:
+    return get_chat_id(update)
+
+
+class _KeyedLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # number of coroutines holding or waiting for lock
+        self.users = 0
+
+
+class KeyedLocks:
+    """Table of locks, created on demand for every key. Lock is removed from
+    table as soon as nobody holds or waits for it, so idle keys take no memory.
+    At most `max_keys` keys are locked at the same time, locking other keys
+    waits until some key is released.
+    """
+
+    def __init__(self, max_keys: int = 10_000):
+        self._max_keys = max_keys
+
+        self._locks: Dict[Hashable, _KeyedLock] = {}
+        self._released: Optional[asyncio.Condition] = None
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def acquire(self, key: Hashable) -> AsyncIterator[None]:
+        if self._released is None:
+            self._released = asyncio.Condition()
+
+        entry = self._locks.get(key)
+
+        if entry is None:
+            async with self._released:
+                await self._released.wait_for(
+                    lambda: key in self._locks or len(self._locks) < self._max_keys
+                )
+
+            entry = self._locks.get(key)
+
+            if entry is None:
+                entry = self._locks[key] = _KeyedLock()
+
+        entry.users += 1
+
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+
+            if not entry.users:
+                del self._locks[key]
+
+                async with self._released:
+                    self._released.notify_all()
+
+
+@dataclass
+class LimitsStats:
+    running: int = 0
+    waiting: int = 0
+    timeouts: int = 0
+
+
+class Limits:
+    """Execution limits: `timeout` of callback in seconds, `max_concurrency`
+    of callback calls and mutual exclusion of calls with the same key, returned
+    by `lock_key` (e.g. `user_key`). Updates without key are not locked.
+    """
+
+    def __init__(
+        self,
+        timeout: float = None,
+        max_concurrency: int = None,
+        lock_key: LockKeyFactory = None,
+        max_keys: int = 10_000,
+    ):
+        self.timeout = timeout
+        self._max_concurrency = max_concurrency
+        self._lock_key = lock_key
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._locks = KeyedLocks(max_keys=max_keys) if lock_key is not None else None
+        self.stats = LimitsStats()
+
+    @asynccontextmanager
+    async def acquire(self, update: Update) -> AsyncIterator[None]:
+        self.stats.waiting += 1
+        acquired = False
+
+        try:
+            async with self._lock(update), self._concurrency():
+                acquired = True
+                self.stats.waiting -= 1
+                self.stats.running += 1
+
+                try:
+                    yield
+                finally:
+                    self.stats.running -= 1
+        finally:
+            if not acquired:
+                self.stats.waiting -= 1
+
+    @asynccontextmanager
+    async def _lock(self, update: Update) -> AsyncIterator[None]:
+        key = self._lock_key(update) if self._lock_key is not None else None
+
+        if key is None:
+            yield
+            return
+
+        async with self._locks.acquire(key):
+            yield
+
+    @asynccontextmanager
+    async def _concurrency(self) -> AsyncIterator[None]:
+        if self._max_concurrency is None:
+            yield
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async with self._semaphore:
+            yield
+
+
+def get_timeout(limits: List[Limits]) -> Optional[float]:
+    """Returns timeout of the most specific limits (the last ones) that have it."""
+
+    for item in reversed(limits):
+        if item.timeout is not None:
+            return item.timeout
+
+    return None
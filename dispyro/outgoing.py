@@ -0,0 +1,302 @@
+# This file defines queue of outgoing requests, which keeps bot within
+# Telegram rate limits. Dispatcher created with `outgoing=OutgoingQueue()`
+# passes queue to handlers as `outgoing` dependency. Handlers put requests
+# (e.g. `outgoing.send_message(client, chat_id, text)`) to the queue and
+# return immediately, every call returns future, which can be awaited to get
+# result of request.
+#
+# Requests to every chat are made one by one, in order they were queued, at
+# most `chat_rate` per second in private chats and `group_rate` per second in
+# groups and channels. Requests of every client are made at most `global_rate`
+# per second. Edits of the same message queued while previous edit is still
+# waiting are merged: only the last one is made, all of them get its result.
+#
+# FloodWait is handled in one place: client's requests are paused for the
+# time Telegram asks, then failed request is retried. FloodWait longer than
+# `max_flood_wait` fails request. Errors of requests nobody awaits are logged.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple, Union
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+log = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+
+
+class _Request:
+    __slots__ = ("method", "args", "kwargs", "merge_key", "futures")
+
+    def __init__(self, method: str, args: tuple, kwargs: dict, merge_key: Optional[Hashable]):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.merge_key = merge_key
+        self.futures: List[asyncio.Future] = []
+
+
+class _ChatQueue:
+    __slots__ = ("requests", "next_at", "task")
+
+    def __init__(self):
+        self.requests: Deque[_Request] = deque()
+        # time next request to chat can be made at
+        self.next_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    # errors are logged by queue, so futures nobody awaits don't warn
+    if not future.cancelled():
+        future.exception()
+
+
+@dataclass
+class OutgoingQueueStats:
+    sent: int = 0
+    merged: int = 0
+    flood_waits: int = 0
+    failed: int = 0
+    overflows: int = 0
+    pending: int = 0
+
+
+class OutgoingQueue:
+    """Rate-limited queue of outgoing requests, see top of this file. At most
+    `max_pending` requests can be queued, queueing more raises
+    `asyncio.QueueFull`.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        group_rate: float = 20 / 60,
+        max_flood_wait: float = 300,
+        max_pending: int = 10_000,
+    ):
+        self._global_interval = 1 / global_rate
+        self._chat_interval = 1 / chat_rate
+        self._group_interval = 1 / group_rate
+        self._max_flood_wait = max_flood_wait
+        self._max_pending = max_pending
+
+        self._chats: Dict[Tuple[Client, ChatId], _ChatQueue] = {}
+        # edits waiting in queues, by client, chat, message and method
+        self._edits: Dict[Hashable, _Request] = {}
+        # time next request of client can be made at
+        self._clients_next_at: Dict[Client, float] = {}
+        # set when all queued requests are made, used by `close`
+        self._idle: Optional[asyncio.Event] = None
+        self.stats = OutgoingQueueStats()
+
+    def __len__(self) -> int:
+        return self.stats.pending
+
+    def _get_interval(self, chat_id: ChatId) -> float:
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self._group_interval
+
+        return self._chat_interval
+
+    def call(
+        self,
+        client: Client,
+        chat_id: ChatId,
+        method: str,
+        args: tuple = (),
+        kwargs: Dict[str, Any] = None,
+        merge_key: Hashable = None,
+    ) -> asyncio.Future:
+        """Queues call of client's `method` with `args` and `kwargs`, made in
+        `chat_id` queue. Queued calls with the same `merge_key` are merged into
+        the last one.
+        """
+
+        kwargs = kwargs or {}
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_retrieve)
+
+        if merge_key is not None:
+            merge_key = (client, chat_id, method, merge_key)
+            request = self._edits.get(merge_key)
+
+            if request is not None:
+                request.args = args
+                request.kwargs = kwargs
+                request.futures.append(future)
+                self.stats.merged += 1
+
+                return future
+
+        if self.stats.pending >= self._max_pending:
+            self.stats.overflows += 1
+            raise asyncio.QueueFull("too many outgoing requests are queued")
+
+        request = _Request(method=method, args=args, kwargs=kwargs, merge_key=merge_key)
+        request.futures.append(future)
+
+        if merge_key is not None:
+            self._edits[merge_key] = request
+
+        key = (client, chat_id)
+        chat = self._chats.get(key)
+
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue()
+
+        chat.requests.append(request)
+        self.stats.pending += 1
+
+        if chat.task is None:
+            chat.task = loop.create_task(self._drain(key, chat))
+
+        return future
+
+    def send_message(self, client: Client, chat_id: ChatId, text: str, **kwargs) -> asyncio.Future:
+        return self.call(
+            client, chat_id, "send_message", kwargs={"chat_id": chat_id, "text": text, **kwargs}
+        )
+
+    def edit_message_text(
+        self, client: Client, chat_id: ChatId, message_id: int, text: str, **kwargs
+    ) -> asyncio.Future:
+        return self.call(
+            client,
+            chat_id,
+            "edit_message_text",
+            kwargs={"chat_id": chat_id, "message_id": message_id, "text": text, **kwargs},
+            merge_key=message_id,
+        )
+
+    async def _wait_turn(self, client: Client, chat: _ChatQueue, interval: float) -> None:
+        while True:
+            now = time.monotonic()
+            next_at = max(chat.next_at, self._clients_next_at.get(client, 0))
+
+            if next_at <= now:
+                break
+
+            await asyncio.sleep(next_at - now)
+
+        self._clients_next_at[client] = now + self._global_interval
+        chat.next_at = now + interval
+
+    async def _drain(self, key: Tuple[Client, ChatId], chat: _ChatQueue) -> None:
+        client, chat_id = key
+        interval = self._get_interval(chat_id)
+
+        try:
+            while True:
+                while chat.requests:
+                    await self._wait_turn(client, chat, interval)
+                    await self._make(client, chat)
+
+                # queue is kept until chat limit passes, so requests queued
+                # right after it is drained wait for their turn too
+                delay = chat.next_at - time.monotonic()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                if not chat.requests:
+                    break
+        finally:
+            del self._chats[key]
+
+            for request in chat.requests:
+                self._finish(request)
+
+                for future in request.futures:
+                    future.cancel()
+
+    def _finish(self, request: _Request) -> None:
+        if request.merge_key is not None and self._edits.get(request.merge_key) is request:
+            del self._edits[request.merge_key]
+
+        self.stats.pending -= 1
+
+        if not self.stats.pending and self._idle is not None:
+            self._idle.set()
+
+    async def _make(self, client: Client, chat: _ChatQueue) -> None:
+        request = chat.requests[0]
+
+        # request is not merged with new ones since it's being made
+        if request.merge_key is not None and self._edits.get(request.merge_key) is request:
+            del self._edits[request.merge_key]
+
+        try:
+            result = await getattr(client, request.method)(*request.args, **request.kwargs)
+
+        except FloodWait as error:
+            self.stats.flood_waits += 1
+
+            if error.value <= self._max_flood_wait:
+                # request is retried when client can make requests again
+                next_at = time.monotonic() + error.value
+                self._clients_next_at[client] = max(self._clients_next_at.get(client, 0), next_at)
+
+                log.warning("Got FloodWait, waiting %s seconds before next request", error.value)
+
+                if request.merge_key is not None:
+                    newer = self._edits.setdefault(request.merge_key, request)
+
+                    # edit queued while request was being made replaces it
+                    if newer is not request:
+                        chat.requests.popleft()
+                        self.stats.pending -= 1
+                        self.stats.merged += len(request.futures)
+                        newer.futures.extend(request.futures)
+
+                return
+
+            self._fail(chat, request, error)
+
+        except Exception as error:
+            self._fail(chat, request, error)
+
+        else:
+            chat.requests.popleft()
+            self._finish(request)
+            self.stats.sent += 1
+
+            for future in request.futures:
+                if not future.done():
+                    future.set_result(result)
+
+    def _fail(self, chat: _ChatQueue, request: _Request, error: Exception) -> None:
+        chat.requests.popleft()
+        self._finish(request)
+        self.stats.failed += 1
+
+        log.error("Outgoing request `%s` failed", request.method, exc_info=error)
+
+        for future in request.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self) -> None:
+        """Waits until all queued requests are made."""
+
+        if self.stats.pending:
+            self._idle = asyncio.Event()
+            await self._idle.wait()
+            self._idle = None
+
+        # remaining tasks only wait for chat limits to pass
+        tasks = [chat.task for chat in self._chats.values() if chat.task is not None]
+
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            await asyncio.wait(tasks)
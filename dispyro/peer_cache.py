@@ -0,0 +1,200 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from pyrogram import Client, raw, types
+from pyrogram import utils as pyrogram_utils
+from pyrogram.handlers.handler import Handler
+
+from .stages import UpdateStage
+from .types import PackedRawUpdate, Update
+
+Peer = Union[raw.base.User, raw.base.Chat, types.User, types.Chat]
+# peers with their expiration times, in order they were used
+PeersMap = Dict[int, Tuple[float, Peer]]
+
+# attributes of high-level updates which contain peers
+PEER_ATTRIBUTES = ("from_user", "chat", "sender_chat", "user")
+
+
+def get_raw_peer_id(peer: Union[raw.base.User, raw.base.Chat]) -> Optional[int]:
+    if isinstance(peer, raw.types.User):
+        return peer.id
+
+    if isinstance(peer, (raw.types.Chat, raw.types.ChatForbidden)):
+        return -peer.id
+
+    if isinstance(peer, (raw.types.Channel, raw.types.ChannelForbidden)):
+        return pyrogram_utils.get_channel_id(peer.id)
+
+    return None
+
+
+@dataclass
+class PeerCacheStats:
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+
+        return self.hits / requests if requests else 0.0
+
+
+class PeerCache(UpdateStage):
+    """Stage that remembers users and chats seen in updates, so handlers can get
+    them without API requests. Is available for handlers as `peer_cache`
+    dependency.
+
+    Peers are taken from `users` and `chats` maps of raw updates (even if raw
+    update is not dispatched) and from high-level updates. Users and chats are
+    kept apart, since private chat has the same id as its user. At most
+    `max_size` users and `max_size` chats are kept, least recently used are
+    dropped first. Peers older than `ttl` seconds are considered missing.
+
+    Cached peers are either raw or high-level pyrogram objects, whichever was
+    received last. `get_user` and `get_chat` always return high-level objects.
+    """
+
+    provides = ("peer_cache",)
+
+    def __init__(self, max_size: int = 50_000, ttl: float = 3600):
+        self._max_size = max_size
+        self._ttl = ttl
+
+        self._users: PeersMap = OrderedDict()
+        # raw users are kept here as well, as private chats
+        self._chats: PeersMap = OrderedDict()
+        self._stats = PeerCacheStats()
+
+    def __len__(self) -> int:
+        return len(self._users) + len(self._chats)
+
+    def __contains__(self, peer_id: int) -> bool:
+        now = time.monotonic()
+
+        return any(
+            entry is not None and entry[0] > now
+            for entry in (self._users.get(peer_id), self._chats.get(peer_id))
+        )
+
+    @property
+    def stats(self) -> PeerCacheStats:
+        self._stats.size = len(self)
+
+        return self._stats
+
+    def _put(self, peers: PeersMap, peer_id: int, peer: Peer) -> None:
+        entry = peers.get(peer_id)
+
+        if getattr(peer, "min", False) and entry is not None and entry[0] > time.monotonic():
+            # "min" peers lack some fields, so they don't replace complete ones
+            return
+
+        peers[peer_id] = (time.monotonic() + self._ttl, peer)
+        peers.move_to_end(peer_id)
+
+        while len(peers) > self._max_size:
+            peers.popitem(last=False)
+
+    def put(self, peer_id: int, peer: Peer) -> None:
+        if isinstance(peer, types.User):
+            self._put(self._users, peer_id, peer)
+
+        elif isinstance(peer, raw.types.User):
+            self._put(self._users, peer_id, peer)
+            self._put(self._chats, peer_id, peer)
+
+        else:
+            self._put(self._chats, peer_id, peer)
+
+    def _get(self, peers: PeersMap, peer_id: int) -> Optional[Peer]:
+        entry = peers.get(peer_id)
+
+        if entry is None:
+            return None
+
+        if entry[0] <= time.monotonic():
+            del peers[peer_id]
+            return None
+
+        peers.move_to_end(peer_id)
+
+        return entry[1]
+
+    def _count(self, found: bool) -> None:
+        if found:
+            self._stats.hits += 1
+        else:
+            self._stats.misses += 1
+
+    async def get_user(self, client: Client, user_id: int) -> Optional[types.User]:
+        peer = self._get(self._users, user_id)
+
+        if isinstance(peer, raw.types.User):
+            peer = await types.User._parse(client, peer)
+            self._put(self._users, user_id, peer)
+
+        user = peer if isinstance(peer, types.User) else None
+        self._count(user is not None)
+
+        return user
+
+    async def get_chat(self, client: Client, chat_id: int) -> Optional[types.Chat]:
+        peer = self._get(self._chats, chat_id)
+
+        if isinstance(peer, (raw.types.User, raw.types.Chat, raw.types.Channel)):
+            peer = await types.Chat._parse_chat(client, peer)
+            self._put(self._chats, chat_id, peer)
+
+        chat = peer if isinstance(peer, types.Chat) else None
+        self._count(chat is not None)
+
+        return chat
+
+    def feed_peers(
+        self, users: Dict[int, raw.base.User], chats: Dict[int, raw.base.Chat]
+    ) -> None:
+        for peer in (*users.values(), *chats.values()):
+            peer_id = get_raw_peer_id(peer)
+
+            if peer_id is not None:
+                self.put(peer_id, peer)
+
+    def _iter_peers(self, update: Any) -> Iterable[Union[types.User, types.Chat]]:
+        if isinstance(update, (types.User, types.Chat)):
+            yield update
+
+        for attribute in PEER_ATTRIBUTES:
+            value = getattr(update, attribute, None)
+
+            if isinstance(value, (types.User, types.Chat)):
+                yield value
+
+        message = getattr(update, "message", None)
+
+        if isinstance(message, types.Message):
+            yield from self._iter_peers(message)
+
+    def feed(self, update: Update) -> None:
+        if isinstance(update, PackedRawUpdate):
+            self.feed_peers(update.users, update.chats)
+            return
+
+        for item in update if isinstance(update, list) else (update,):
+            for peer in self._iter_peers(item):
+                self.put(peer.id, peer)
+
+    async def __call__(
+        self, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> Optional[Update]:
+        if not isinstance(update, PackedRawUpdate):
+            # maps of raw updates were already consumed by `feed_peers`
+            self.feed(update)
+
+        deps["peer_cache"] = self
+
+        return update
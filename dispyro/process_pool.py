@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from pyrogram import Client
+
+from .types import Callback, Update
+from .utils import provide_deps, safe_call
+
+ReturnType = TypeVar("ReturnType")
+
+Extractor = Callable[[Update], Tuple[Any, ...]]
+
+
+class ProcessPool:
+    """Pool of processes used to run CPU-bound functions. Is started and shut
+    down together with `Dispatcher` and is available for handlers as
+    `process_pool` dependency.
+
+    At most `max_workers + max_queue` calls can be submitted at the same time,
+    other calls wait for free slot.
+    """
+
+    def __init__(self, max_workers: int = None, max_queue: int = 100, mp_context: str = "spawn"):
+        self._max_workers = max_workers or multiprocessing.cpu_count()
+        self._max_queue = max_queue
+        self._mp_context = multiprocessing.get_context(mp_context)
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self) -> None:
+        if self.running:
+            return
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._max_workers, mp_context=self._mp_context
+        )
+        self._semaphore = asyncio.Semaphore(self._max_workers + self._max_queue)
+
+    async def shutdown(self, wait: bool = True) -> None:
+        if not self.running:
+            return
+
+        executor, self._executor = self._executor, None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(executor.shutdown, wait=wait))
+
+    async def run(self, function: Callable[..., ReturnType], *args, **kwargs) -> ReturnType:
+        """Runs `function` in one of pool processes and returns its result.
+        `function` and all arguments must be picklable.
+        """
+
+        if not self.running:
+            raise RuntimeError("process pool is not running, start dispatcher first")
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+
+            return await loop.run_in_executor(self._executor, partial(function, *args, **kwargs))
+
+
+def offload(function: Callable, extract: Extractor) -> Callable[[Callback], Callback]:
+    """Decorator for handlers callbacks, which runs `function` in dispatcher's
+    process pool before calling handler. `extract` takes update and returns
+    tuple of picklable arguments for `function`. Value returned by `function`
+    is passed to callback as `result` dependency.
+    """
+
+    def decorator(callback: Callback) -> Callback:
+        callback = safe_call(callable=callback)
+
+        @wraps(callback)
+        async def wrapper(
+            client: Client, update: Update, process_pool: ProcessPool, **deps
+        ) -> Any:
+            result = await process_pool.run(function, *extract(update))
+
+            return await callback(client, update, process_pool=process_pool, result=result, **deps)
+
+        provide_deps(wrapper, "result")
+
+        return wrapper
+
+    return decorator
@@ -1,5 +1,5 @@
 from functools import cached_property
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional
 
 from pyrogram import Client, handlers
 from pyrogram.handlers.handler import Handler as PyrogramHandler
@@ -12,6 +12,7 @@ from .handlers_holders import (
     ChatMemberUpdatedHandlersHolder,
     ChosenInlineResultHandlersHolder,
     DeletedMessagesHandlersHolder,
+    DispatchPlan,
     EditedMessageHandlersHolder,
     HandlersHolder,
     InlineQueryHandlersHolder,
@@ -20,6 +21,7 @@ from .handlers_holders import (
     RawUpdateHandlersHolder,
     UserStatusHandlersHolder,
 )
+from .limits import Limits
 from .types import Update
 
 
@@ -29,8 +31,16 @@ class Router:
     To put things to work, must be attached to `Dispatcher`.
     """
 
-    def __init__(self, name: str = None):
+    def __init__(self, name: str = None, limits: Limits = None, order_independent: bool = False):
         self._name = name or "unnamed_router"
+        # shared by all handlers of router, see `dispyro.limits`
+        self.limits = limits
+        # whether router can be moved by adaptive ordering, see `dispyro.router_order`
+        self.order_independent = order_independent
+        # set by `Dispatcher.freeze`, changes of handlers of frozen router are
+        # validated by dispatcher right away
+        self.frozen = False
+        self._dispatcher: Optional["dispyro.Dispatcher"] = None
 
         self.callback_query = CallbackQueryHandlersHolder(router=self)
         self.chat_member_updated = ChatMemberUpdatedHandlersHolder(router=self)
@@ -44,6 +54,9 @@ class Router:
         self.user_status = UserStatusHandlersHolder(router=self)
 
         self._triggered: bool = False
+        # handlers triggered during processing current update, so cleanup
+        # doesn't have to visit all handlers
+        self._triggered_handlers: List[Handler] = []
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__} `{self._name}`"
@@ -78,12 +91,53 @@ class Router:
             handlers.UserStatusHandler: self.user_status,
         }
 
+    def handles(self, handler_type: PyrogramHandler) -> bool:
+        """Whether router can handle updates of `handler_type`."""
+
+        return bool(self.handlers_correlation[handler_type].get_plan().handlers)
+
     def cleanup(self) -> None:
         self._triggered = False
 
-        for handler in self.all_handlers:
+        for handler in self._triggered_handlers:
             handler._triggered = False
 
+        self._triggered_handlers.clear()
+
+    def build_plans(self) -> None:
+        """Builds dispatch plans (and indexes) of all handlers holders, so first
+        updates don't have to wait for them.
+        """
+
+        for handlers_holder in self.handlers_correlation.values():
+            handlers_holder.get_plan()
+
+    def freeze(self, dispatcher: "dispyro.Dispatcher" = None) -> None:
+        self.build_plans()
+        self.frozen = True
+        self._dispatcher = dispatcher
+
+    def thaw(self) -> None:
+        self.frozen = False
+        self._dispatcher = None
+
+    def _handlers_changed(
+        self,
+        handlers_holder: HandlersHolder,
+        previous_plan: Optional[DispatchPlan],
+        added: Iterable[Handler],
+    ) -> None:
+        """Is called by handlers holders of frozen router after handlers are
+        changed. Raises `ValueError` if dispatcher doesn't accept changes.
+        """
+
+        if self._dispatcher is not None:
+            self._dispatcher._update_holder(self, handlers_holder, previous_plan, added)
+
+    async def flush_batches(self) -> None:
+        for handlers_holder in self.handlers_correlation.values():
+            await handlers_holder.flush_batches()
+
     async def feed_update(
         self,
         client: Client,
@@ -96,8 +150,9 @@ class Router:
 
         handlers_holder = self.handlers_correlation[handler_type]
 
+        # dispatcher is available for handlers as dependency, e.g. to use `wait_for`
         result = await handlers_holder.feed_update(
-            client=client, run_logic=run_logic, update=update, **deps
+            client=client, run_logic=run_logic, update=update, dispatcher=dispatcher, **deps
         )
 
         return result
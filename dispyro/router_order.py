@@ -0,0 +1,127 @@
+# This file defines adaptive ordering of routers. With
+# `RunLogic.ONE_RUN_PER_EVENT` update is fed to routers one by one until one of
+# them handles it, so routers handling most of updates are better tried first.
+# Routers created with `order_independent=True` declare that their handlers
+# don't overlap with handlers of neighbouring order-independent routers, so
+# their order doesn't change results.
+#
+# Dispatcher created with `adaptive_order=AdaptiveOrder()` counts which router
+# handled every update of every type and every `interval` updates of the type
+# reorders contiguous runs of order-independent routers by hits. Other routers
+# are barriers: they keep their positions and routers are never moved across
+# them. Hits decay on every reorder, so order follows changes of traffic.
+#
+# Routers are reordered in dispatch table, which is built when dispatcher is
+# frozen, so thawed dispatcher tries routers in order they were attached.
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from pyrogram.handlers.handler import Handler
+
+from .router import Router
+
+RoutersOrder = Tuple[Router, ...]
+
+
+@dataclass
+class AdaptiveOrderStats:
+    reorders: int = 0
+    # routers of every update type in order they are tried
+    order: Dict[Type[Handler], RoutersOrder] = field(default_factory=dict)
+    # decayed numbers of updates handled by routers
+    hits: Dict[Type[Handler], Dict[Router, float]] = field(default_factory=dict)
+
+
+class AdaptiveOrder:
+    """Reorders order-independent routers of every update type by number of
+    updates they handle, every `interval` updates of the type. Hits are
+    multiplied by `decay` after every reorder.
+    """
+
+    def __init__(self, interval: int = 1000, decay: float = 0.5):
+        if not 0 <= decay <= 1:
+            raise ValueError("decay should be between 0 and 1")
+
+        self._interval = interval
+        self._decay = decay
+
+        # updates of every type since last reorder
+        self._updates: Dict[Type[Handler], int] = {}
+        self.stats = AdaptiveOrderStats()
+
+    def order(self, handler_type: Type[Handler], routers: Iterable[Router]) -> RoutersOrder:
+        """Returns `routers` sorted by hits within runs of order-independent ones."""
+
+        hits = self.stats.hits.get(handler_type, {})
+        ordered: List[Router] = []
+        run: List[Router] = []
+
+        def flush() -> None:
+            # sort is stable, so routers with equal hits keep their order
+            ordered.extend(sorted(run, key=lambda router: -hits.get(router, 0)))
+            run.clear()
+
+        for router in routers:
+            if router.order_independent:
+                run.append(router)
+                continue
+
+            flush()
+            ordered.append(router)
+
+        flush()
+
+        return tuple(ordered)
+
+    def apply(self, table: Dict[Type[Handler], RoutersOrder]) -> Dict[Type[Handler], RoutersOrder]:
+        """Orders routers of freshly built dispatch table using hits counted
+        so far. Hits of routers that are not in table are dropped.
+        """
+
+        routers = {router for order in table.values() for router in order}
+
+        for hits in self.stats.hits.values():
+            for router in [router for router in hits if router not in routers]:
+                del hits[router]
+
+        table = {
+            handler_type: self.order(handler_type, order) for handler_type, order in table.items()
+        }
+        self.stats.order = dict(table)
+
+        return table
+
+    def record(self, handler_type: Type[Handler], router: Optional[Router]) -> bool:
+        """Counts update of `handler_type` handled by `router` (`None` if it's
+        not handled). Returns whether routers of the type should be reordered.
+        """
+
+        if router is not None:
+            hits = self.stats.hits.setdefault(handler_type, {})
+            hits[router] = hits.get(router, 0) + 1
+
+        updates = self._updates.get(handler_type, 0) + 1
+
+        if updates < self._interval:
+            self._updates[handler_type] = updates
+            return False
+
+        self._updates[handler_type] = 0
+
+        return True
+
+    def reorder(self, handler_type: Type[Handler], routers: RoutersOrder) -> RoutersOrder:
+        ordered = self.order(handler_type, routers)
+
+        if ordered != routers:
+            self.stats.reorders += 1
+
+        self.stats.order[handler_type] = ordered
+
+        hits = self.stats.hits.get(handler_type, {})
+
+        for router in hits:
+            hits[router] *= self._decay
+
+        return ordered
@@ -0,0 +1,508 @@
+# This file defines scheduler, used to run jobs and timeouts at given time
+# without creating separate task for every pending timer.
+#
+# Timers are kept in hierarchical timing wheel: `LEVELS` wheels of `SLOTS`
+# slots each. Slot of the lowest wheel covers one tick (`resolution` seconds),
+# slot of every next wheel covers whole previous wheel. Timer is put to the
+# lowest wheel that can fit its delay, when time comes, timers of upper wheel
+# slot are moved (cascaded) to lower wheels. Slots are dicts used as ordered
+# sets, so both scheduling and cancelling take O(1). Timers that don't fit even
+# the highest wheel (more than `SLOTS ** LEVELS` ticks ahead) are kept apart
+# and rescheduled every time the highest wheel makes full turn.
+#
+# Wheel is driven by single task, which wakes up once per tick while there are
+# pending timers, so timers fire up to `resolution` seconds late.
+#
+# Jobs are high-level timers. Like handlers, their callbacks take client (first
+# dispatcher's client) and job itself as positional arguments, and get needed
+# dependencies (dispatcher dependencies, `dispatcher`, `scheduler`, `clients`
+# and job's own `kwargs`).
+# Jobs created with `persistent=True` are saved to `SQLiteJobStore` (if
+# scheduler has one) and loaded again on next start. Callbacks of such jobs are
+# saved by import path, so they must be defined at module level, and `kwargs`
+# must be picklable.
+
+import asyncio
+import logging
+import math
+import pickle
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+import dispyro
+
+from .utils import get_import_path, resolve_import_path, safe_call
+
+log = logging.getLogger(__name__)
+
+ReturnType = TypeVar("ReturnType")
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4
+
+
+class Timer:
+    """Handle of callback scheduled with `Scheduler.call_later`."""
+
+    __slots__ = ("tick", "callback", "args", "_wheel", "_slot")
+
+    def __init__(self, wheel: "TimingWheel", tick: int, callback: Callable[..., Any], args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self._wheel = wheel
+        self._slot: Optional[Dict["Timer", None]] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._slot is None
+
+    def cancel(self) -> None:
+        if self._slot is not None:
+            self._slot.pop(self, None)
+            self._slot = None
+            self._wheel._size -= 1
+
+
+class TimingWheel:
+    def __init__(self, resolution: float):
+        self._resolution = resolution
+        self._origin = time.monotonic()
+        self._tick = 0
+
+        self._wheels: List[List[Dict[Timer, None]]] = [
+            [{} for _ in range(SLOTS)] for _ in range(LEVELS)
+        ]
+        self._overflow: Dict[Timer, None] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def current_tick(self) -> int:
+        return int((time.monotonic() - self._origin) / self._resolution)
+
+    def _insert(self, timer: Timer) -> None:
+        delta = timer.tick - self._tick
+
+        for level in range(LEVELS):
+            if delta < 1 << (SLOT_BITS * (level + 1)):
+                slot = self._wheels[level][(timer.tick >> (SLOT_BITS * level)) & SLOT_MASK]
+                break
+        else:
+            slot = self._overflow
+
+        slot[timer] = None
+        timer._slot = slot
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args) -> Timer:
+        current_tick = self.current_tick()
+
+        if not self._size:
+            # nothing to cascade, so idle ticks are skipped
+            self._tick = max(self._tick, current_tick)
+
+        timer = Timer(
+            wheel=self,
+            # current tick is already processed, so timer fires on next one at least
+            tick=max(current_tick + math.ceil(delay / self._resolution), self._tick + 1),
+            callback=callback,
+            args=args,
+        )
+        self._insert(timer)
+        self._size += 1
+
+        return timer
+
+    def _cascade(self, slot: Dict[Timer, None]) -> None:
+        timers = list(slot)
+        slot.clear()
+
+        for timer in timers:
+            self._insert(timer)
+
+    def advance(self, tick: int) -> List[Timer]:
+        """Moves wheel to `tick`, returns timers that are due."""
+
+        due: List[Timer] = []
+
+        while self._tick < tick:
+            self._tick += 1
+            current = self._tick
+
+            if current & ((1 << (SLOT_BITS * LEVELS)) - 1) == 0:
+                self._cascade(self._overflow)
+
+            for level in range(LEVELS - 1, 0, -1):
+                if current & ((1 << (SLOT_BITS * level)) - 1) == 0:
+                    slot_index = (current >> (SLOT_BITS * level)) & SLOT_MASK
+                    self._cascade(self._wheels[level][slot_index])
+
+            slot = self._wheels[0][current & SLOT_MASK]
+
+            for timer in slot:
+                timer._slot = None
+
+            due.extend(slot)
+            self._size -= len(slot)
+            slot.clear()
+
+        return due
+
+
+class Job:
+    """Handle of job scheduled with `Scheduler.schedule`."""
+
+    def __init__(
+        self,
+        scheduler: "Scheduler",
+        id: str,
+        callback: Callable[..., Any],
+        run_at: float,
+        kwargs: Dict[str, Any],
+        persistent: bool,
+    ):
+        self.id = id
+        self.callback = callback
+        # unix timestamp
+        self.run_at = run_at
+        self.kwargs = kwargs
+        self.persistent = persistent
+
+        self._scheduler = scheduler
+        self._timer: Optional[Timer] = None
+
+    @property
+    def pending(self) -> bool:
+        return self._timer is not None and not self._timer.cancelled
+
+    def cancel(self) -> None:
+        self._scheduler.cancel(self.id)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} `{self.id}`"
+
+
+class SQLiteJobStore:
+    """Store of persistent jobs, kept in local SQLite database.
+
+    All queries are made in separate thread, so they don't block event loop.
+    """
+
+    def __init__(self, path: str, table: str = "dispyro_jobs"):
+        self._path = path
+        self._table = table
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispyro-jobs")
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} ("
+                "id TEXT PRIMARY KEY, "
+                "callback TEXT NOT NULL, "
+                "run_at REAL NOT NULL, "
+                "kwargs BLOB NOT NULL)"
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    async def _run(self, function: Callable[..., ReturnType], *args) -> ReturnType:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._executor, partial(function, *args))
+
+    def _save(self, id: str, callback: str, run_at: float, kwargs: bytes) -> None:
+        connection = self._connect()
+        connection.execute(
+            f"INSERT OR REPLACE INTO {self._table} (id, callback, run_at, kwargs) "
+            "VALUES (?, ?, ?, ?)",
+            (id, callback, run_at, kwargs),
+        )
+        connection.commit()
+
+    def _delete(self, id: str) -> None:
+        connection = self._connect()
+        connection.execute(f"DELETE FROM {self._table} WHERE id = ?", (id,))
+        connection.commit()
+
+    def _load(self) -> List[Tuple[str, str, float, bytes]]:
+        connection = self._connect()
+
+        return connection.execute(
+            f"SELECT id, callback, run_at, kwargs FROM {self._table} ORDER BY run_at"
+        ).fetchall()
+
+    async def save(self, job: Job) -> None:
+        await self._run(
+            self._save,
+            job.id,
+            get_import_path(job.callback),
+            job.run_at,
+            pickle.dumps(job.kwargs),
+        )
+
+    async def delete(self, id: str) -> None:
+        await self._run(self._delete, id)
+
+    async def load(self) -> List[Tuple[str, str, float, Dict[str, Any]]]:
+        rows = await self._run(self._load)
+
+        return [
+            (id, callback, run_at, pickle.loads(kwargs)) for id, callback, run_at, kwargs in rows
+        ]
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+
+        self._executor.shutdown()
+
+
+@dataclass
+class SchedulerStats:
+    scheduled: int = 0
+    fired: int = 0
+    cancelled: int = 0
+    failed: int = 0
+
+
+class Scheduler:
+    """Scheduler of timers and jobs. Is started and stopped together with
+    `Dispatcher` and is available for handlers as `scheduler` dependency.
+    """
+
+    def __init__(self, resolution: float = 0.1, store: SQLiteJobStore = None):
+        self._resolution = resolution
+        self._store = store
+
+        self._wheel = TimingWheel(resolution=resolution)
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        # store calls made before event loop is running, they are made by `start`
+        self._deferred: List[Tuple[Callable[..., Awaitable], tuple]] = []
+
+        self._dispatcher: Optional["dispyro.Dispatcher"] = None
+        self._driver: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.stats = SchedulerStats()
+
+    def __len__(self) -> int:
+        return len(self._wheel)
+
+    @property
+    def running(self) -> bool:
+        return self._driver is not None
+
+    @property
+    def jobs(self) -> List[Job]:
+        return list(self._jobs.values())
+
+    def get_job(self, id: str) -> Optional[Job]:
+        return self._jobs.get(id)
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args) -> Timer:
+        """Calls `callback` with `args` in `delay` seconds, like `loop.call_later`.
+        Callback is called right in event loop, so it must be cheap.
+        """
+
+        timer = self._wheel.schedule(delay, callback, *args)
+        self.stats.scheduled += 1
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        return timer
+
+    async def _drive(self) -> None:
+        while True:
+            if not len(self._wheel):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            await asyncio.sleep(self._resolution)
+
+            due = self._wheel.advance(self._wheel.current_tick())
+
+            for timer in due:
+                self.stats.fired += 1
+
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    log.exception("Error in scheduled callback %r", timer.callback)
+
+    def schedule(
+        self,
+        callback: Callable[..., Any],
+        delay: float = None,
+        at: float = None,
+        id: str = None,
+        persistent: bool = False,
+        **kwargs,
+    ) -> Job:
+        """Schedules `callback` to be called in `delay` seconds or `at` given
+        unix timestamp. Callback gets client, job, dependencies (see top of this
+        file) and `kwargs`. Job with the same `id` is replaced. Persistent jobs
+        scheduled before event loop is running are saved by `start`.
+        """
+
+        if (delay is None) == (at is None):
+            raise ValueError("either `delay` or `at` must be passed")
+
+        if persistent and self._store is not None:
+            # fail early if job can't be saved
+            get_import_path(callback)
+
+        run_at = at if at is not None else time.time() + delay
+        id = id or uuid.uuid4().hex
+
+        self.cancel(id)
+
+        job = Job(
+            scheduler=self,
+            id=id,
+            callback=callback,
+            run_at=run_at,
+            kwargs=kwargs,
+            persistent=persistent,
+        )
+        job._timer = self.call_later(max(run_at - time.time(), 0), self._fire, job)
+        self._jobs[id] = job
+
+        if persistent and self._store is not None:
+            self._spawn(self._store.save, job)
+
+        return job
+
+    def cancel(self, id: str) -> bool:
+        job = self._jobs.pop(id, None)
+
+        if job is None:
+            return False
+
+        job._timer.cancel()
+        self.stats.cancelled += 1
+
+        if job.persistent and self._store is not None:
+            self._spawn(self._store.delete, id)
+
+        return True
+
+    def _spawn(self, function: Callable[..., Awaitable], *args) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._deferred.append((function, args))
+            return
+
+        task = loop.create_task(function(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _fire(self, job: Job) -> None:
+        # job could be replaced or cancelled after its timer became due
+        if self._jobs.get(job.id) is not job:
+            return
+
+        del self._jobs[job.id]
+
+        self._spawn(self._run_job, job)
+
+    async def _run_job(self, job: Job) -> None:
+        dispatcher = self._dispatcher
+        clients = list(dispatcher._clients) if dispatcher is not None else []
+        client = clients[0] if clients else None
+
+        deps = {
+            **(dispatcher._deps if dispatcher is not None else {}),
+            "dispatcher": dispatcher,
+            "scheduler": self,
+            "clients": clients,
+            **job.kwargs,
+        }
+
+        try:
+            await safe_call(job.callback)(client, job, **deps)
+
+        except Exception:
+            self.stats.failed += 1
+            log.exception("Error in job %r", job)
+
+        finally:
+            if job.persistent and self._store is not None:
+                await self._store.delete(job.id)
+
+    async def _load_jobs(self) -> None:
+        for id, path, run_at, kwargs in await self._store.load():
+            try:
+                callback = resolve_import_path(path)
+            except (ImportError, AttributeError):
+                log.exception("Can't load callback of job `%s`, skipping it", id)
+                continue
+
+            job = Job(
+                scheduler=self,
+                id=id,
+                callback=callback,
+                run_at=run_at,
+                kwargs=kwargs,
+                persistent=True,
+            )
+
+            # job scheduled before start is replaced, but is not deleted from
+            # store, since store already has loaded one
+            previous = self._jobs.pop(id, None)
+
+            if previous is not None:
+                previous._timer.cancel()
+                self.stats.cancelled += 1
+
+            job._timer = self.call_later(max(run_at - time.time(), 0), self._fire, job)
+            self._jobs[id] = job
+
+    async def start(self, dispatcher: "dispyro.Dispatcher" = None) -> None:
+        if self.running:
+            return
+
+        self._dispatcher = dispatcher
+        self._wakeup = asyncio.Event()
+        self._driver = asyncio.get_running_loop().create_task(self._drive())
+
+        deferred, self._deferred = self._deferred, []
+
+        # made before loading, so jobs cancelled before start are not loaded
+        for function, args in deferred:
+            try:
+                await function(*args)
+            except Exception:
+                log.exception("Error in deferred call of %r", function)
+
+        if self._store is not None:
+            await self._load_jobs()
+
+    async def shutdown(self) -> None:
+        """Stops scheduler. Persistent jobs are kept in store, others are lost."""
+
+        if not self.running:
+            return
+
+        self._driver.cancel()
+        self._driver = None
+
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+        if self._store is not None:
+            await self._store.close()
@@ -0,0 +1,494 @@
+# This file defines multi-process dispatching. `ShardedDispatcher` lives in
+# the process that owns pyrogram clients: instead of feeding updates to
+# routers, it pickles them and sends to one of N worker processes. Every
+# worker builds its own `Dispatcher` (with the same routers and deps) using
+# `factory` and feeds received updates to it.
+#
+# Updates are routed to workers by chat id (falling back to user id), so all
+# updates of one chat are handled by the same worker, one after another. Each
+# worker has a limited number of pending updates (`max_pending`), when limit is
+# reached, feeding awaits until worker reports finished updates, which makes
+# pyrogram workers wait as well (back-pressure). Dead workers are restarted,
+# updates that were pending on them are considered lost.
+#
+# Inside of workers handlers receive `ClientProxy` instead of `Client`. Every
+# coroutine method called on it is sent back to the owning process and
+# executed by the real client, result is sent back to the worker. Pyrogram
+# objects are bound to proxy, so bound methods (like `message.reply_text`)
+# work as well. Plain attributes listed in `CLIENT_ATTRIBUTES` (e.g. `me`,
+# read by `filters.command`) are sent to every worker once, before first
+# update of the client, other attributes are not available in workers.
+#
+# `factory` is sent to worker processes, so it must be picklable (e.g. defined
+# at module level).
+
+import asyncio
+import inspect
+import itertools
+import logging
+import multiprocessing
+import pickle
+import threading
+from functools import lru_cache
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from pyrogram import Client
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import Object
+
+from .dispatcher import Dispatcher
+from .types import Update
+from .utils import get_chat_id, get_user_id
+
+log = logging.getLogger(__name__)
+
+DispatcherFactory = Callable[[], Dispatcher]
+
+# plain attributes of clients, which are copied to workers
+CLIENT_ATTRIBUTES = ("name", "me", "parse_mode", "lang_code")
+
+
+def _bind(value: Any, client: "ClientProxy") -> Any:
+    if isinstance(value, Object):
+        value.bind(client)
+
+    elif isinstance(value, list):
+        for item in value:
+            _bind(item, client)
+
+    return value
+
+
+@lru_cache(maxsize=None)
+def _is_client_method(name: str) -> bool:
+    attribute = getattr(Client, name, None)
+
+    # pyrogram wraps methods to make them usable synchronously
+    return attribute is not None and inspect.iscoroutinefunction(inspect.unwrap(attribute))
+
+
+def _dump_client(client: Client) -> bytes:
+    return pickle.dumps({name: getattr(client, name, None) for name in CLIENT_ATTRIBUTES})
+
+
+def _dump_exception(exception: BaseException) -> bytes:
+    try:
+        return pickle.dumps(exception)
+    except Exception:
+        return pickle.dumps(RuntimeError(repr(exception)))
+
+
+def get_shard_key(update: Update) -> int:
+    """Returns key, used to pick worker for `update`. Updates with the same key
+    are handled by the same worker in order they were received.
+    """
+
+    key = get_chat_id(update) or get_user_id(update)
+
+    if key is None:
+        return hash(getattr(update, "id", 0))
+
+    return key
+
+
+class ClientProxy:
+    """Replacement of pyrogram `Client` inside worker processes. Every coroutine
+    method call is forwarded to the process owning original client, plain
+    attributes are copies of ones of original client (see `CLIENT_ATTRIBUTES`).
+    """
+
+    def __init__(self, worker: "_Worker", client_index: int, attributes: Dict[str, Any] = None):
+        self._worker = worker
+        self._client_index = client_index
+        self._attributes: Dict[str, Any] = {}
+
+        if attributes is not None:
+            self._set_attributes(attributes)
+
+    def _set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self._attributes = {name: _bind(value, self) for name, value in attributes.items()}
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        try:
+            return self._attributes[name]
+        except KeyError:
+            pass
+
+        if not _is_client_method(name):
+            raise AttributeError(f"`{name}` of client is not available in worker process")
+
+        async def method(*args, **kwargs) -> Any:
+            return await self._worker.call(self._client_index, name, args, kwargs)
+
+        method.__name__ = name
+        return method
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} `{self._client_index}`"
+
+
+class _Worker:
+    def __init__(self, factory: DispatcherFactory, inbound: Queue, outbound: Queue):
+        self._factory = factory
+        self._inbound = inbound
+        self._outbound = outbound
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatcher: Optional[Dispatcher] = None
+        self._proxies: Dict[int, ClientProxy] = {}
+        self._calls: Dict[int, Tuple[asyncio.Future, int]] = {}
+        self._calls_counter = itertools.count()
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._stopped: Optional[asyncio.Event] = None
+
+    def _read(self) -> None:
+        # Queue is read after stop message (`None`) as well, since updates that
+        # are being finished still get replies to their calls. Reading stops
+        # when event loop of worker is closed.
+        while True:
+            message = self._inbound.get()
+
+            try:
+                self._loop.call_soon_threadsafe(self._on_message, message)
+            except RuntimeError:
+                return
+
+    def _on_message(self, message: Optional[Tuple]) -> None:
+        if message is None:
+            self._stopped.set()
+            return
+
+        kind, *payload = message
+
+        if kind == "update":
+            self._on_update(*payload)
+
+        elif kind == "client":
+            client_index, attributes = payload
+            self._get_proxy(client_index)._set_attributes(pickle.loads(attributes))
+
+        elif kind == "reply":
+            call_id, ok, value = payload
+            future, client_index = self._calls.pop(call_id, (None, None))
+
+            if future is None or future.done():
+                return
+
+            value = pickle.loads(value)
+
+            if ok:
+                future.set_result(_bind(value, self._get_proxy(client_index)))
+            else:
+                future.set_exception(value)
+
+    def _on_update(self, seq: int, key: int, client_index: int, payload: bytes) -> None:
+        previous = self._tails.get(key)
+        task = self._loop.create_task(self._process(seq, key, client_index, payload, previous))
+        self._tails[key] = task
+
+    async def _process(
+        self,
+        seq: int,
+        key: int,
+        client_index: int,
+        payload: bytes,
+        previous: Optional[asyncio.Task],
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        try:
+            handler_type, update = pickle.loads(payload)
+            client = self._get_proxy(client_index)
+            _bind(update, client)
+
+            await self._dispatcher.feed_update(
+                client=client, update=update, handler_type=handler_type
+            )
+
+        except Exception:
+            log.exception("Error while processing update in worker")
+
+        finally:
+            self._outbound.put(("done", seq))
+
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    def _get_proxy(self, client_index: int) -> ClientProxy:
+        proxy = self._proxies.get(client_index)
+
+        if proxy is None:
+            proxy = ClientProxy(worker=self, client_index=client_index)
+            self._proxies[client_index] = proxy
+
+        return proxy
+
+    async def call(self, client_index: int, name: str, args: tuple, kwargs: dict) -> Any:
+        call_id = next(self._calls_counter)
+        future = self._loop.create_future()
+        self._calls[call_id] = (future, client_index)
+
+        payload = pickle.dumps((client_index, name, args, kwargs))
+        self._outbound.put(("call", call_id, payload))
+
+        try:
+            return await future
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._dispatcher = self._factory()
+
+        await self._dispatcher.start(only_start=True)
+
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+
+        await self._stopped.wait()
+
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+        await self._dispatcher.stop()
+
+
+def _worker_main(factory: DispatcherFactory, inbound: Queue, outbound: Queue) -> None:
+    worker = _Worker(factory=factory, inbound=inbound, outbound=outbound)
+
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+
+class _Shard:
+    def __init__(self, index: int, max_pending: int):
+        self.index = index
+        self.process: Optional[BaseProcess] = None
+        self.inbound: Optional[Queue] = None
+        self.outbound: Optional[Queue] = None
+        self.semaphore = asyncio.Semaphore(max_pending)
+        self.pending: Dict[int, Handler] = {}
+        # indexes of clients which attributes were sent to current worker
+        self.clients: Set[int] = set()
+        self.restarts: int = 0
+
+
+class ShardedDispatcher(Dispatcher):
+    """Dispatcher that sends updates to worker processes instead of handling them
+    in current process. Each worker runs `Dispatcher` returned by `factory`.
+    """
+
+    def __init__(
+        self,
+        *clients: Client,
+        factory: DispatcherFactory,
+        workers: int = 2,
+        max_pending: int = 100,
+        supervise_interval: float = 1.0,
+        mp_context: str = "spawn",
+        ignore_preparation: bool = False,
+        clear_on_prepare: bool = True,
+    ):
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+
+        super().__init__(
+            *clients,
+            ignore_preparation=ignore_preparation,
+            clear_on_prepare=clear_on_prepare,
+        )
+
+        self._factory = factory
+        self._workers_count = workers
+        self._max_pending = max_pending
+        self._supervise_interval = supervise_interval
+        self._mp_context = multiprocessing.get_context(mp_context)
+
+        self._shards: List[_Shard] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._running: bool = False
+
+    @property
+    def restarts(self) -> Dict[int, int]:
+        return {shard.index: shard.restarts for shard in self._shards}
+
+    def accepts_raw_update_type(self, update_type: type) -> bool:
+        # handlers live in workers, so every raw update is sent to them
+        return True
+
+    def _client_index(self, client: Client) -> int:
+        for index, known_client in enumerate(self._clients):
+            if known_client is client:
+                return index
+
+        self._clients.append(client)
+        return len(self._clients) - 1
+
+    def _spawn(self, shard: _Shard) -> None:
+        shard.clients = set()
+        shard.inbound = self._mp_context.Queue()
+        shard.outbound = self._mp_context.Queue()
+        shard.process = self._mp_context.Process(
+            target=_worker_main,
+            args=(self._factory, shard.inbound, shard.outbound),
+            name=f"dispyro-worker-{shard.index}",
+            daemon=True,
+        )
+        shard.process.start()
+
+        reader = threading.Thread(target=self._read, args=(shard, shard.outbound), daemon=True)
+        reader.start()
+
+    def _read(self, shard: _Shard, outbound: Queue) -> None:
+        while True:
+            message = outbound.get()
+
+            if message is None:
+                return
+
+            self._loop.call_soon_threadsafe(self._on_message, shard, outbound, message)
+
+    def _on_message(self, shard: _Shard, outbound: Queue, message: Tuple) -> None:
+        if outbound is not shard.outbound:
+            # message from worker that was already restarted
+            return
+
+        kind, *payload = message
+
+        if kind == "done":
+            (seq,) = payload
+
+            if shard.pending.pop(seq, None) is not None:
+                shard.semaphore.release()
+
+        elif kind == "call":
+            call_id, call = payload
+            self._loop.create_task(self._execute_call(shard, shard.inbound, call_id, call))
+
+    async def _execute_call(
+        self, shard: _Shard, inbound: Queue, call_id: int, call: bytes
+    ) -> None:
+        try:
+            client_index, name, args, kwargs = pickle.loads(call)
+            client = self._clients[client_index]
+            result = await getattr(client, name)(*args, **kwargs)
+
+        except Exception as e:
+            reply = ("reply", call_id, False, _dump_exception(e))
+
+        else:
+            try:
+                reply = ("reply", call_id, True, pickle.dumps(result))
+            except Exception as e:
+                reply = ("reply", call_id, False, _dump_exception(e))
+
+        inbound.put(reply)
+
+    async def _supervise(self) -> None:
+        while self._running:
+            await asyncio.sleep(self._supervise_interval)
+
+            for shard in self._shards:
+                if not self._running or shard.process.is_alive():
+                    continue
+
+                log.warning(
+                    "Worker %s exited with code %s, %s pending updates lost, restarting",
+                    shard.index,
+                    shard.process.exitcode,
+                    len(shard.pending),
+                )
+
+                shard.outbound.put(None)
+
+                for _ in shard.pending:
+                    shard.semaphore.release()
+
+                shard.pending.clear()
+                shard.restarts += 1
+                self._spawn(shard)
+
+    async def feed_update(self, client: Client, update: Update, handler_type: Handler) -> None:
+        if not self._running:
+            log.warning("Update received while workers are not running, skipping it")
+            return
+
+        key = get_shard_key(update)
+        shard = self._shards[key % len(self._shards)]
+
+        payload = pickle.dumps((handler_type, update), protocol=pickle.HIGHEST_PROTOCOL)
+        client_index = self._client_index(client)
+
+        await shard.semaphore.acquire()
+
+        if not self._running:
+            return
+
+        if client_index not in shard.clients:
+            shard.inbound.put(("client", client_index, _dump_client(client)))
+            shard.clients.add(client_index)
+
+        seq = next(self._seq)
+        shard.pending[seq] = handler_type
+        shard.inbound.put(("update", seq, key, client_index, payload))
+
+    async def start(
+        self,
+        *clients: Client,
+        ignore_preparation: bool = None,
+        only_start: bool = False,
+    ) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+
+        if not self._shards:
+            self._shards = [
+                _Shard(index=index, max_pending=self._max_pending)
+                for index in range(self._workers_count)
+            ]
+
+            for shard in self._shards:
+                self._spawn(shard)
+
+            self._supervisor = self._loop.create_task(self._supervise())
+
+        await super().start(*clients, ignore_preparation=ignore_preparation, only_start=only_start)
+
+    async def stop(self) -> None:
+        # Workers are stopped before clients, so updates they are finishing can
+        # still make calls through the owning clients.
+        self._running = False
+
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+
+        for shard in self._shards:
+            shard.inbound.put(None)
+
+        for shard in self._shards:
+            await self._loop.run_in_executor(None, shard.process.join, 10)
+
+            if shard.process.is_alive():
+                shard.process.terminate()
+
+            shard.outbound.put(None)
+
+            # wake up feeders waiting for free slot, they will skip their updates
+            for _ in range(self._max_pending):
+                shard.semaphore.release()
+
+        self._shards = []
+
+        await super().stop()
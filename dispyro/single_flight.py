@@ -0,0 +1,218 @@
+# This file defines single-flight primitive, which merges concurrent calls with
+# the same key into one: first call runs function, calls made while it's
+# running wait for its result. Optionally, results are cached for `ttl`
+# seconds, so calls made right after that don't run function as well.
+#
+# If every caller waiting for result is cancelled, function call is cancelled
+# too. Exceptions are propagated to all waiting callers and never cached.
+#
+# Calls are made with `await flights.do(key, function, *args, **kwargs)`, where
+# `flights` is `SingleFlight` instance (it can be passed to dispatcher as
+# dependency, e.g. `Dispatcher(client, flights=SingleFlight())`). Instance is
+# also decorator factory: functions decorated with `@flights()` (or
+# `@flights(key=...)`, where `key` takes the same arguments as function) make
+# their calls through `do`. Decorated functions keep their signatures, so
+# decorated filters and handlers callbacks get the same dependencies as
+# originals. `forget` and `clear` drop cached results.
+#
+# `default_key` of decorated functions is scoped to update (see `update_key`):
+# calls made for the same update (received by the same client) are merged, no
+# matter which dependencies they get. So function used by several filters of
+# one update is called once for it. Calls of other functions are keyed by
+# their arguments, which should be hashable then.
+
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from pyrogram import Client, types
+
+from .types import PackedRawUpdate, Update
+from .utils import get_chat_id
+
+ReturnType = TypeVar("ReturnType")
+
+KeyFactory = Callable[..., Hashable]
+
+
+# updates which `id` identifies update itself
+IDENTIFIED_UPDATE_TYPES = (
+    types.Message,
+    types.CallbackQuery,
+    types.InlineQuery,
+    types.Poll,
+)
+
+
+def update_key(client: Client, update: Update) -> Hashable:
+    """Key of `update` received by `client`. Raises `TypeError` for updates
+    that can't be identified (e.g. user statuses), explicit key should be used
+    for them.
+    """
+
+    if isinstance(update, PackedRawUpdate):
+        return id(client), update.update.write()
+
+    if isinstance(update, IDENTIFIED_UPDATE_TYPES):
+        return id(client), type(update), get_chat_id(update), update.id
+
+    raise TypeError(f"{type(update).__name__} updates can't be identified, pass `key` explicitly")
+
+
+def default_key(*args, **kwargs) -> Hashable:
+    if len(args) >= 2 and isinstance(args[1], (types.Object, PackedRawUpdate)):
+        return update_key(args[0], args[1])
+
+    return args, tuple(sorted(kwargs.items()))
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    coalesced: int = 0
+    cached: int = 0
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = 0, max_size: int = 10_000):
+        self._ttl = ttl
+        self._max_size = max_size
+
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._results: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.stats = SingleFlightStats()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether call with `key` is running now."""
+
+        return key in self._flights
+
+    def _get_result(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._results.get(key)
+
+        if entry is None:
+            return False, None
+
+        expires_at, result = entry
+
+        if expires_at <= time.monotonic():
+            del self._results[key]
+            return False, None
+
+        self._results.move_to_end(key)
+
+        return True, result
+
+    def _put_result(self, key: Hashable, result: Any) -> None:
+        self._results[key] = (time.monotonic() + self._ttl, result)
+        self._results.move_to_end(key)
+
+        while len(self._results) > self._max_size:
+            self._results.popitem(last=False)
+
+    def forget(self, key: Hashable) -> None:
+        self._results.pop(key, None)
+
+    def clear(self) -> None:
+        self._results.clear()
+
+    async def _run(
+        self, key: Hashable, function: Callable[..., Any], args: tuple, kwargs: dict
+    ) -> Any:
+        result = function(*args, **kwargs)
+
+        if inspect.isawaitable(result):
+            result = await result
+
+        if self._ttl:
+            self._put_result(key, result)
+
+        return result
+
+    def _start(
+        self, key: Hashable, function: Callable[..., Any], args: tuple, kwargs: dict
+    ) -> _Flight:
+        task = asyncio.get_running_loop().create_task(self._run(key, function, args, kwargs))
+        flight = self._flights[key] = _Flight(task=task)
+
+        def forget(_: asyncio.Task) -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        task.add_done_callback(forget)
+
+        return flight
+
+    async def do(
+        self, key: Hashable, function: Callable[..., Awaitable[ReturnType]], *args, **kwargs
+    ) -> ReturnType:
+        """Calls `function` with `args` and `kwargs`, unless call with the same
+        `key` is running already (or its result is cached), and returns result.
+        """
+
+        if self._ttl:
+            found, result = self._get_result(key)
+
+            if found:
+                self.stats.cached += 1
+                return result
+
+        flight = self._flights.get(key)
+
+        if flight is None:
+            self.stats.calls += 1
+            flight = self._start(key, function, args, kwargs)
+        else:
+            self.stats.coalesced += 1
+
+        flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+
+            if not flight.waiters and not flight.task.done():
+                # callers coming after that start new call instead of joining
+                # cancelled one
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+                flight.task.cancel()
+
+    def __call__(self, key: KeyFactory = default_key) -> Callable[[Callable], Callable]:
+        """Decorator, which makes concurrent calls of coroutine function with
+        the same key (returned by `key`, which takes the same arguments as
+        function) share one call. Keys of different functions never match.
+        """
+
+        def decorator(
+            function: Callable[..., Awaitable[ReturnType]]
+        ) -> Callable[..., Awaitable[ReturnType]]:
+            @wraps(function)
+            async def wrapper(*args, **kwargs) -> ReturnType:
+                call_key = (function, key(*args, **kwargs))
+
+                return await self.do(call_key, function, *args, **kwargs)
+
+            # dependencies are chosen by signature, so it's kept
+            wrapper.__signature__ = inspect.signature(function)
+
+            return wrapper
+
+        return decorator
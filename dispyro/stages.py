@@ -0,0 +1,398 @@
+# This file defines update stages. Stages are attached to `Dispatcher` and
+# process every update before it's fed to routers, in order they were added.
+# Stage can drop update (by returning `None`), replace it with another update
+# or add dependencies for handlers to `deps`.
+#
+# Stages that wait for more updates (see `HoldingStage`) don't block pyrogram
+# worker while waiting: they take update (returning `None`) and feed it to the
+# rest of stages and to routers later, with `Dispatcher.resume_update`.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+from pyrogram import Client, handlers, raw, types
+from pyrogram import utils as pyrogram_utils
+from pyrogram.handlers.handler import Handler
+
+import dispyro
+
+from .types import PackedRawUpdate, Update
+from .utils import get_chat_id
+
+log = logging.getLogger(__name__)
+
+MESSAGE_HANDLER_TYPES = (handlers.MessageHandler, handlers.EditedMessageHandler)
+
+DedupKeyFactory = Callable[[Client, Update, Handler], Optional[Hashable]]
+
+
+class UpdateStage:
+    """Base class for update stages."""
+
+    # names of dependencies stage adds to `deps`
+    provides: Tuple[str, ...] = ()
+
+    def attach(self, dispatcher: "dispyro.Dispatcher") -> None:
+        """Is called when stage is added to `dispatcher`."""
+
+    def feed_peers(self, users: Dict[int, raw.base.User], chats: Dict[int, raw.base.Chat]) -> None:
+        """Is called with `users` and `chats` maps of every raw update received,
+        even if raw update itself is not dispatched.
+        """
+
+    async def flush(self) -> None:
+        """Is called when dispatcher stops, before routers are flushed."""
+
+    async def __call__(
+        self, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> Optional[Update]:
+        return update
+
+
+class HoldingStage(UpdateStage):
+    """Base class for stages that hold updates back for a while. Held update is
+    fed to the rest of stages and to routers in separate task, so pyrogram
+    worker that received it is free to process other updates meanwhile.
+    """
+
+    def __init__(self):
+        self._dispatcher: Optional["dispyro.Dispatcher"] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def attach(self, dispatcher: "dispyro.Dispatcher") -> None:
+        self._dispatcher = dispatcher
+
+    def _resume(self, client: Client, update: Update, handler_type: Handler, deps: Dict) -> None:
+        task = asyncio.get_running_loop().create_task(
+            self._feed(client, update, handler_type, deps)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _feed(
+        self, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> None:
+        try:
+            await self._dispatcher.resume_update(self, client, update, handler_type, deps)
+        except Exception:
+            log.exception("Error while processing update held by %r", self)
+
+    def _release_all(self) -> None:
+        """Resumes all held updates right now."""
+
+        raise NotImplementedError
+
+    async def flush(self) -> None:
+        """Feeds held updates right now and waits for them to be processed."""
+
+        self._release_all()
+
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def __repr__(self) -> str:
+        return self.__class__.__name__
+
+
+def message_key(client: Client, update: Update, handler_type: Handler) -> Optional[Hashable]:
+    """Deduplication key made of chat id and message id of new and edited
+    messages, other updates are not deduplicated. Message ids are the same for
+    different accounts only in channels and supergroups, so in other chats
+    messages are deduplicated only within one client.
+    """
+
+    if handler_type not in MESSAGE_HANDLER_TYPES or not isinstance(update, types.Message):
+        return None
+
+    chat_id = get_chat_id(update)
+    shared = chat_id is not None and pyrogram_utils.get_peer_type(chat_id) == "channel"
+
+    return handler_type, None if shared else client, chat_id, update.id, update.edit_date
+
+
+def raw_key(client: Client, update: Update, handler_type: Handler) -> Optional[Hashable]:
+    """Deduplication key made of serialized raw update. Only raw updates are
+    deduplicated.
+    """
+
+    if not isinstance(update, PackedRawUpdate):
+        return None
+
+    return handler_type, hash(update.update.write())
+
+
+def default_key(client: Client, update: Update, handler_type: Handler) -> Optional[Hashable]:
+    if isinstance(update, PackedRawUpdate):
+        return raw_key(client, update, handler_type)
+
+    return message_key(client, update, handler_type)
+
+
+@dataclass
+class DeduplicatorStats:
+    seen: int = 0
+    duplicates: int = 0
+
+    @property
+    def rate(self) -> float:
+        return self.duplicates / self.seen if self.seen else 0.0
+
+
+class Deduplicator(UpdateStage):
+    """Stage that drops updates already seen during last `window` seconds. Used
+    when several clients receive the same updates (e.g. accounts in the same
+    group). At most `max_size` keys are remembered.
+    """
+
+    def __init__(
+        self,
+        window: float = 60,
+        max_size: int = 10_000,
+        key: DedupKeyFactory = default_key,
+    ):
+        self._window = window
+        self._max_size = max_size
+        self._key = key
+
+        self._keys: Deque[Tuple[float, Hashable]] = deque()
+        self._seen: Set[Hashable] = set()
+        self.stats = DeduplicatorStats()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _forget_oldest(self) -> None:
+        _, key = self._keys.popleft()
+        self._seen.discard(key)
+
+    def is_duplicate(self, client: Client, update: Update, handler_type: Handler) -> bool:
+        key = self._key(client, update, handler_type)
+
+        if key is None:
+            return False
+
+        self.stats.seen += 1
+
+        now = time.monotonic()
+        deadline = now - self._window
+
+        while self._keys and self._keys[0][0] <= deadline:
+            self._forget_oldest()
+
+        if key in self._seen:
+            self.stats.duplicates += 1
+            return True
+
+        if len(self._keys) >= self._max_size:
+            self._forget_oldest()
+
+        self._keys.append((now, key))
+        self._seen.add(key)
+
+        return False
+
+    async def __call__(
+        self, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> Optional[Update]:
+        if self.is_duplicate(client, update, handler_type):
+            return None
+
+        return update
+
+
+# Telegram doesn't allow more than 10 media in one group
+MAX_MEDIA_GROUP_SIZE = 10
+
+
+class _MediaGroup:
+    __slots__ = ("client", "deps", "messages", "timer")
+
+    def __init__(self, client: Client, deps: Dict, timer: asyncio.TimerHandle):
+        self.client = client
+        # dependencies of first message
+        self.deps = deps
+        self.messages: List[types.Message] = []
+        self.timer = timer
+
+
+@dataclass
+class MediaGroupAggregatorStats:
+    groups: int = 0
+    messages: int = 0
+    overflows: int = 0
+
+
+class MediaGroupAggregator(HoldingStage):
+    """Stage that collects messages of one media group (album) and feeds them
+    to routers as single update. Messages are collected for `window` seconds
+    after first one is received (or until group is complete), then first message
+    is fed to routers and whole group is available for handlers as `media_group`
+    dependency (`None` for messages that are not part of media group). Group is
+    fed in separate task, see `HoldingStage`.
+
+    At most `max_groups` groups are collected at the same time, messages of
+    other groups are fed to routers one by one.
+    """
+
+    provides = ("media_group",)
+
+    def __init__(self, window: float = 0.5, max_groups: int = 1000):
+        super().__init__()
+
+        self._window = window
+        self._max_groups = max_groups
+
+        self._groups: Dict[Tuple[int, int, str], _MediaGroup] = {}
+        self.stats = MediaGroupAggregatorStats()
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def _release(self, key: Tuple[int, int, str]) -> None:
+        group = self._groups.pop(key, None)
+
+        if group is None:
+            return
+
+        group.timer.cancel()
+
+        messages = sorted(group.messages, key=lambda message: message.id)
+        group.deps["media_group"] = messages
+
+        self._resume(group.client, messages[0], handlers.MessageHandler, group.deps)
+
+    def _release_all(self) -> None:
+        for key in list(self._groups):
+            self._release(key)
+
+    async def __call__(
+        self, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> Optional[Update]:
+        if handler_type is not handlers.MessageHandler:
+            return update
+
+        media_group_id = getattr(update, "media_group_id", None)
+        deps["media_group"] = None
+
+        if media_group_id is None:
+            return update
+
+        key = (id(client), get_chat_id(update), media_group_id)
+        group = self._groups.get(key)
+
+        if group is not None:
+            group.messages.append(update)
+            self.stats.messages += 1
+
+            if len(group.messages) >= MAX_MEDIA_GROUP_SIZE:
+                self._release(key)
+
+            return None
+
+        if len(self._groups) >= self._max_groups:
+            self.stats.overflows += 1
+            deps["media_group"] = [update]
+            return update
+
+        if self._dispatcher is None:
+            raise RuntimeError(f"{self!r} is not added to dispatcher")
+
+        timer = asyncio.get_running_loop().call_later(self._window, self._release, key)
+        group = _MediaGroup(client=client, deps=deps, timer=timer)
+        group.messages.append(update)
+
+        self._groups[key] = group
+        self.stats.groups += 1
+        self.stats.messages += 1
+
+        return None
+
+
+class _PendingEdit:
+    __slots__ = ("client", "update", "deps", "timer")
+
+    def __init__(
+        self, client: Client, update: types.Message, deps: Dict, timer: asyncio.TimerHandle
+    ):
+        self.client = client
+        # latest edit and its dependencies
+        self.update = update
+        self.deps = deps
+        self.timer = timer
+
+
+@dataclass
+class EditCoalescerStats:
+    dispatched: int = 0
+    coalesced: int = 0
+    overflows: int = 0
+
+
+class EditCoalescer(HoldingStage):
+    """Stage that coalesces rapid edits of the same message. After first edit is
+    received, edits of that message are collected for `window` seconds, then
+    only latest one is fed to routers (in separate task, see `HoldingStage`),
+    others are dropped.
+
+    At most `max_pending` messages are tracked at the same time, edits of other
+    messages are fed to routers right away.
+    """
+
+    def __init__(self, window: float = 1.0, max_pending: int = 10_000):
+        super().__init__()
+
+        self._window = window
+        self._max_pending = max_pending
+
+        self._pending: Dict[Tuple[int, Optional[int], int], _PendingEdit] = {}
+        self.stats = EditCoalescerStats()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _release(self, key: Tuple[int, Optional[int], int]) -> None:
+        pending = self._pending.pop(key, None)
+
+        if pending is None:
+            return
+
+        pending.timer.cancel()
+        self.stats.dispatched += 1
+
+        self._resume(pending.client, pending.update, handlers.EditedMessageHandler, pending.deps)
+
+    def _release_all(self) -> None:
+        for key in list(self._pending):
+            self._release(key)
+
+    async def __call__(
+        self, client: Client, update: Update, handler_type: Handler, deps: Dict
+    ) -> Optional[Update]:
+        if handler_type is not handlers.EditedMessageHandler:
+            return update
+
+        key = (id(client), get_chat_id(update), update.id)
+        pending = self._pending.get(key)
+
+        if pending is not None:
+            pending.update = update
+            pending.deps = deps
+            self.stats.coalesced += 1
+            return None
+
+        if len(self._pending) >= self._max_pending:
+            self.stats.overflows += 1
+            self.stats.dispatched += 1
+            return update
+
+        if self._dispatcher is None:
+            raise RuntimeError(f"{self!r} is not added to dispatcher")
+
+        timer = asyncio.get_running_loop().call_later(self._window, self._release, key)
+        self._pending[key] = _PendingEdit(client=client, update=update, deps=deps, timer=timer)
+
+        return None
@@ -1,13 +1,101 @@
-from dataclasses import dataclass
-from typing import Dict, Generic, TypeVar
+from typing import Dict, Generic, Optional, TypeVar, Union
 
-from pyrogram.raw.base import Chat, Update, User
+from pyrogram import raw
+from pyrogram.raw.base import Chat, Peer, Update, User
 
 T = TypeVar("T", bound=Update)
 
 
-@dataclass
+def get_raw_peer(update: Update) -> Optional[Peer]:
+    """Returns peer raw `update` belongs to, if any."""
+
+    message = getattr(update, "message", None)
+    peer = getattr(message, "peer_id", None) or getattr(update, "peer", None)
+
+    if isinstance(peer, Peer):
+        return peer
+
+    channel_id = getattr(update, "channel_id", None)
+    if channel_id is not None:
+        return raw.types.PeerChannel(channel_id=channel_id)
+
+    chat_id = getattr(update, "chat_id", None)
+    if chat_id is not None:
+        return raw.types.PeerChat(chat_id=chat_id)
+
+    user_id = getattr(update, "user_id", None)
+    if user_id is not None:
+        return raw.types.PeerUser(user_id=user_id)
+
+    return None
+
+
 class PackedRawUpdate(Generic[T]):
-    update: T
-    users: Dict[int, User]
-    chats: Dict[int, Chat]
+    """Raw update together with `users` and `chats` maps received with it.
+
+    Is created only if there are handlers interested in type of `update`.
+    Peers are not resolved until requested.
+    """
+
+    __slots__ = ("update", "users", "chats")
+
+    def __init__(self, update: T, users: Dict[int, User], chats: Dict[int, Chat]):
+        self.update = update
+        self.users = users
+        self.chats = chats
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(update={self.update!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PackedRawUpdate):
+            return NotImplemented
+
+        return (self.update, self.users, self.chats) == (other.update, other.users, other.chats)
+
+    __hash__ = None
+
+    @property
+    def peer(self) -> Optional[Peer]:
+        return get_raw_peer(self.update)
+
+    def get_user(self, user_id: int) -> Optional[User]:
+        return self.users.get(user_id)
+
+    def get_chat(self, chat_id: int) -> Optional[Chat]:
+        """Returns raw chat (or channel) by its raw id (without `-` or `-100` prefix)."""
+
+        return self.chats.get(chat_id)
+
+    def resolve_peer(self, peer: Peer) -> Optional[Union[User, Chat]]:
+        if isinstance(peer, raw.types.PeerUser):
+            return self.users.get(peer.user_id)
+
+        if isinstance(peer, raw.types.PeerChat):
+            return self.chats.get(peer.chat_id)
+
+        if isinstance(peer, raw.types.PeerChannel):
+            return self.chats.get(peer.channel_id)
+
+        return None
+
+    @property
+    def chat(self) -> Optional[Union[User, Chat]]:
+        """Raw chat (or user, for private chats) update belongs to."""
+
+        peer = self.peer
+
+        return self.resolve_peer(peer) if peer is not None else None
+
+    @property
+    def user(self) -> Optional[User]:
+        """Raw user who caused update."""
+
+        user_id = getattr(self.update, "user_id", None)
+
+        if user_id is None:
+            message = getattr(self.update, "message", None)
+            from_id = getattr(message, "from_id", None) or getattr(message, "peer_id", None)
+            user_id = getattr(from_id, "user_id", None)
+
+        return self.users.get(user_id) if user_id is not None else None
@@ -1,5 +1,6 @@
 from .filter_callback import FilterCallback
 from .handler_callback import (
+    BatchHandlerCallback,
     CallbackQueryHandlerCallback,
     ChatMemberUpdatedHandlerCallback,
     ChosenInlineResultHandlerCallback,
@@ -14,6 +15,7 @@ from .handler_callback import (
 
 __all__ = (
     "FilterCallback",
+    "BatchHandlerCallback",
     "CallbackQueryHandlerCallback",
     "ChatMemberUpdatedHandlerCallback",
     "ChosenInlineResultHandlerCallback",
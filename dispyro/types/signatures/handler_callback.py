@@ -14,6 +14,13 @@ from pyrogram.types import (
 import dispyro
 
 
+class BatchHandlerCallback(Protocol):
+    """Signature class for BatchHandler callback with DI support."""
+
+    async def __call__(self, client: Client, updates: List["dispyro.types.Update"], **deps) -> Any:
+        ...
+
+
 class CallbackQueryHandlerCallback(Protocol):
     """Signature class for CallbackQueryHandler callback with DI support."""
 
@@ -1,22 +1,93 @@
+import asyncio
+import importlib
 import inspect
-from functools import wraps
+import weakref
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial, wraps
 from inspect import Parameter
-from typing import Any, Callable, Dict, List, TypeVar
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+from pyrogram import types as pyrogram_types
+from pyrogram import utils as pyrogram_utils
+
+from .types import PackedRawUpdate, Update
 
 ReturnType = TypeVar("ReturnType")
 
+_executor: Optional[Executor] = None
 
-def get_needed_kwargs(callable: Callable, **kwargs) -> Dict[str, Any]:
-    """Helper function that fetches needed `kwargs`.
-    Returns only needed kwargs in a form of a `dict`.
+
+class CallSpec(NamedTuple):
+    """Parameters of callable, that are filled with dependencies."""
+
+    # names of parameters that can be passed as keyword arguments
+    kwnames: FrozenSet[str]
+    # names of such parameters without default values
+    required: FrozenSet[str]
+    # whether callable takes `**kwargs`, so it gets all dependencies
+    var_kwargs: bool
+
+
+# specs of inspected callables, by number of their positional parameters
+_call_specs: Dict[int, "weakref.WeakKeyDictionary[Callable, CallSpec]"] = {
+    2: weakref.WeakKeyDictionary(),
+    3: weakref.WeakKeyDictionary(),
+}
+
+
+def get_call_spec(callable: Callable) -> CallSpec:
+    """Inspects signature of `callable`. First two parameters are considered
+    to be positional arguments (client and update). Functions made by
+    `safe_call` have the same spec as callables they wrap. Specs are cached,
+    so signature of every function is inspected once.
     """
 
+    spec = _get_safe_call_spec(callable)
+
+    if spec is not None:
+        return spec
+
+    positional = 2
+
+    # bound methods are created on every attribute access, so spec of
+    # function they are bound to is cached instead
+    if inspect.ismethod(callable):
+        callable = callable.__func__
+        positional = 3
+
+    cache = _call_specs[positional]
+
+    try:
+        return cache[callable]
+    except KeyError:
+        spec = cache[callable] = _inspect_call_spec(callable, positional)
+    except TypeError:
+        # callable can't be weakly referenced or hashed
+        spec = _inspect_call_spec(callable, positional)
+
+    return spec
+
+
+def _inspect_call_spec(callable: Callable, positional: int) -> CallSpec:
     signature = inspect.signature(callable, follow_wrapped=False)
     kwnames: List[str] = []
+    required: List[str] = []
 
     params = signature.parameters.copy()
 
-    positional_args = list(params.keys())[:2]  # client and update are positional arguments
+    # client and update (and `self` of methods) are positional arguments
+    positional_args = list(params.keys())[:positional]
 
     for argname in positional_args:
         argparam = params[argname]
@@ -26,6 +97,8 @@ def get_needed_kwargs(callable: Callable, **kwargs) -> Dict[str, Any]:
 
         params.pop(argname)
 
+    var_kwargs = False
+
     for argname, argparam in params.items():
         kind = argparam.kind
 
@@ -35,20 +108,254 @@ def get_needed_kwargs(callable: Callable, **kwargs) -> Dict[str, Any]:
         elif kind in {Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY}:
             kwnames.append(argname)
 
+            if argparam.default is Parameter.empty:
+                required.append(argname)
+
         elif kind is Parameter.VAR_KEYWORD:
-            return kwargs
+            var_kwargs = True
+
+    return CallSpec(
+        kwnames=frozenset(kwnames), required=frozenset(required), var_kwargs=var_kwargs
+    )
+
+
+def _get_safe_call_spec(callable: Callable) -> Optional[CallSpec]:
+    # `functools.wraps` copies attributes of wrapped function to wrapper, so
+    # spec is trusted only if it was made for function wrapper wraps
+    entry = getattr(callable, "__call_spec__", None)
+
+    if entry is None:
+        return None
+
+    wrapped, spec = entry
+
+    if getattr(callable, "__wrapped__", None) is not wrapped:
+        return None
+
+    return spec
+
+
+def provide_deps(wrapper: Callable, *names: str) -> None:
+    """Marks `wrapper` (made with `functools.wraps`) as providing dependencies
+    `names` to function it wraps, so validation checks wrapped function too.
+    """
+
+    wrapper.__provided_deps__ = (wrapper.__wrapped__, frozenset(names))
+
+
+def get_missing_kwargs(callable: Callable, deps: Set[str]) -> Set[str]:
+    """Returns names of dependencies required by `callable`, which are not in
+    `deps`. Functions marked with `provide_deps` are checked together with
+    functions they wrap.
+    """
+
+    # functions made by `safe_call` pass dependencies to wrapped callables as is
+    while _get_safe_call_spec(callable) is not None:
+        callable = callable.__wrapped__
+
+    missing = set(get_call_spec(callable).required - deps)
+    entry = getattr(callable, "__provided_deps__", None)
+
+    if entry is not None and entry[0] is getattr(callable, "__wrapped__", None):
+        wrapped, provided = entry
+        missing |= get_missing_kwargs(wrapped, deps | provided)
+
+    return missing
+
+
+def takes_kwargs(callable: Callable, names: Set[str]) -> bool:
+    """Whether `callable` takes any of `names` (or all dependencies with
+    `**kwargs`). Functions marked with `provide_deps` are checked together
+    with functions they wrap.
+    """
+
+    while _get_safe_call_spec(callable) is not None:
+        callable = callable.__wrapped__
+
+    spec = get_call_spec(callable)
+
+    if spec.kwnames & names:
+        return True
+
+    entry = getattr(callable, "__provided_deps__", None)
+
+    if entry is not None and entry[0] is getattr(callable, "__wrapped__", None):
+        # wrapper takes `**kwargs` to pass them to wrapped function
+        wrapped, provided = entry
+        return takes_kwargs(wrapped, names - provided)
+
+    return spec.var_kwargs
+
+
+def filter_kwargs(spec: CallSpec, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    if spec.var_kwargs:
+        return kwargs
+
+    return {name: value for name, value in kwargs.items() if name in spec.kwnames}
+
+
+def get_needed_kwargs(callable: Callable, **kwargs) -> Dict[str, Any]:
+    """Helper function that fetches needed `kwargs`.
+    Returns only needed kwargs in a form of a `dict`.
+    """
 
-    needed_kwargs = {k: v for k, v in kwargs.items() if k in kwnames}
+    return filter_kwargs(get_call_spec(callable), kwargs)
 
-    return needed_kwargs
 
+def get_import_path(callback: Callable[..., Any]) -> str:
+    path = f"{callback.__module__}:{callback.__qualname__}"
 
-def safe_call(callable: Callable[..., ReturnType]) -> Callable[..., ReturnType]:
-    """Helper function that makes new `callable` which feeds only needed `kwargs` to original."""
+    if "<" in path or resolve_import_path(path) is not callback:
+        raise ValueError(f"{callback!r} can't be imported by path, define it at module level")
+
+    return path
+
+
+def resolve_import_path(path: str) -> Any:
+    """Returns object by import path in form of `package.module:name`."""
+
+    module_name, _, qualname = path.partition(":")
+    value = importlib.import_module(module_name)
+
+    for attribute in qualname.split("."):
+        value = getattr(value, attribute)
+
+    return value
+
+
+def is_coroutine_callable(callable: Callable) -> bool:
+    """Helper function that checks whether calling `callable` returns coroutine."""
+
+    if inspect.iscoroutinefunction(callable):
+        return True
+
+    call = getattr(callable, "__call__", None)
+
+    return inspect.iscoroutinefunction(call)
+
+
+def get_executor() -> Executor:
+    """Returns executor used to run synchronous callbacks. By default, it's
+    `ThreadPoolExecutor`, created on first use.
+    """
+
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(thread_name_prefix="dispyro")
+
+    return _executor
+
+
+def set_executor(executor: Executor) -> None:
+    """Sets executor used to run synchronous callbacks, which don't have their own."""
+
+    global _executor
+    _executor = executor
+
+
+def safe_call(
+    callable: Callable[..., ReturnType],
+    executor: Executor = None,
+    run_inline: bool = False,
+) -> Callable[..., Awaitable[ReturnType]]:
+    """Helper function that makes new coroutine function which feeds only needed
+    `kwargs` to original `callable`.
+
+    If `callable` is not a coroutine function, it's called in `executor` (or
+    in the one returned by `get_executor`), so it doesn't block event loop.
+    Cheap synchronous callables can be called right in event loop with `run_inline`.
+
+    Signature of `callable` is inspected once, result is returned by
+    `get_call_spec` for returned function.
+    """
+
+    is_coroutine = is_coroutine_callable(callable)
+    spec = get_call_spec(callable)
 
     @wraps(callable)
-    def wrapper(*args, **kwargs) -> ReturnType:
-        needed_kwargs = get_needed_kwargs(callable=callable, **kwargs)
-        return callable(*args, **needed_kwargs)
+    async def wrapper(*args, **kwargs) -> ReturnType:
+        needed_kwargs = filter_kwargs(spec, kwargs)
+
+        if is_coroutine:
+            return await callable(*args, **needed_kwargs)
+
+        if run_inline:
+            result = callable(*args, **needed_kwargs)
+
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                executor or get_executor(), partial(callable, *args, **needed_kwargs)
+            )
+
+        if inspect.isawaitable(result):
+            result = await result
+
+        return result
+
+    wrapper.__call_spec__ = (callable, spec)
 
     return wrapper
+
+
+def get_chat_id(update: Update) -> Optional[int]:
+    """Helper function that fetches id of chat `update` belongs to.
+    Returns `None` if update is not bound to any chat (e.g. inline queries or polls).
+    """
+
+    if isinstance(update, PackedRawUpdate):
+        peer = update.peer
+        return pyrogram_utils.get_peer_id(peer) if peer is not None else None
+
+    if isinstance(update, list):
+        update = update[0] if update else None
+
+    if isinstance(update, pyrogram_types.User):
+        return update.id
+
+    chat = getattr(update, "chat", None)
+
+    if chat is None:
+        message = getattr(update, "message", None)
+        chat = getattr(message, "chat", None)
+
+    return getattr(chat, "id", None)
+
+
+def get_user_id(update: Update) -> Optional[int]:
+    """Helper function that fetches id of user who caused `update`.
+    Returns `None` if there is no such user (e.g. channel posts).
+    """
+
+    if isinstance(update, PackedRawUpdate):
+        return getattr(update.update, "user_id", None)
+
+    if isinstance(update, list):
+        update = update[0] if update else None
+
+    if isinstance(update, pyrogram_types.User):
+        return update.id
+
+    user = getattr(update, "from_user", None)
+
+    return getattr(user, "id", None)
+
+
+def get_text(update: Update) -> Optional[str]:
+    """Helper function that fetches text of `update`: text or caption of
+    messages, data of callback queries and text of inline queries.
+    Returns `None` if update has no text.
+    """
+
+    if isinstance(update, pyrogram_types.Message):
+        return update.text or update.caption
+
+    if isinstance(update, pyrogram_types.CallbackQuery):
+        data = update.data
+        return data.decode(errors="ignore") if isinstance(data, bytes) else data
+
+    if isinstance(update, pyrogram_types.InlineQuery):
+        return update.query
+
+    return None
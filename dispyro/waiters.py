@@ -0,0 +1,165 @@
+# This file defines waiters, used to implement conversations: handler can call
+# `Dispatcher.wait_for` and get next update matching given conditions (e.g.
+# user's answer to the question bot just asked) without registering temporary
+# handlers.
+#
+# Waiters are checked before update is fed to routers. Update that resolved
+# waiter is not fed to routers (unless waiter was created with
+# `consume=False`). Pending waiters are indexed by update type, chat id and
+# user id, so only waiters that can possibly match update are checked, waiters
+# of the same key are checked in order they were created. Timeouts don't need
+# separate task per waiter: they are scheduled on dispatcher's scheduler
+# (if it has one) or on event loop.
+
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Type, Union
+
+from pyrogram import Client
+from pyrogram.handlers.handler import Handler
+
+from .filters import Filter
+from .scheduler import Scheduler, Timer
+from .types import AnyFilter, Update
+from .utils import get_chat_id, get_user_id
+
+WaiterKey = Tuple[Type[Handler], Optional[int], Optional[int]]
+
+
+class Waiter:
+    __slots__ = ("key", "filters", "consume", "future", "timer")
+
+    def __init__(self, key: WaiterKey, filters: Filter, consume: bool, future: asyncio.Future):
+        self.key = key
+        self.filters = filters
+        self.consume = consume
+        self.future = future
+        self.timer: Optional[Union[asyncio.TimerHandle, Timer]] = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} `{self.key}`"
+
+
+@dataclass
+class WaitersStats:
+    created: int = 0
+    resolved: int = 0
+    timed_out: int = 0
+
+
+class Waiters:
+    """Index of pending waiters, attached to `Dispatcher`."""
+
+    def __init__(self, scheduler: Scheduler = None):
+        self._scheduler = scheduler
+        # inner dicts are used as ordered sets, so waiters are removed in O(1)
+        self._waiters: Dict[WaiterKey, Dict[Waiter, None]] = {}
+        self.stats = WaitersStats()
+
+    def __len__(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._waiters)
+
+    def _add(self, waiter: Waiter) -> None:
+        self._waiters.setdefault(waiter.key, {})[waiter] = None
+
+    def _remove(self, waiter: Waiter) -> None:
+        waiters = self._waiters.get(waiter.key)
+
+        if waiters is None:
+            return
+
+        waiters.pop(waiter, None)
+
+        if not waiters:
+            del self._waiters[waiter.key]
+
+    def _expire(self, waiter: Waiter) -> None:
+        if not waiter.future.done():
+            self.stats.timed_out += 1
+            waiter.future.set_exception(asyncio.TimeoutError())
+
+    async def wait(
+        self,
+        update_type: Type[Handler],
+        filters: AnyFilter = None,
+        timeout: float = None,
+        chat_id: int = None,
+        user_id: int = None,
+        consume: bool = True,
+    ) -> Update:
+        loop = asyncio.get_running_loop()
+
+        waiter = Waiter(
+            key=(update_type, chat_id, user_id),
+            filters=Filter() & filters if filters else Filter(),
+            consume=consume,
+            future=loop.create_future(),
+        )
+
+        if timeout is not None:
+            if self._scheduler is not None and self._scheduler.running:
+                waiter.timer = self._scheduler.call_later(timeout, self._expire, waiter)
+            else:
+                waiter.timer = loop.call_later(timeout, self._expire, waiter)
+
+        self._add(waiter)
+        self.stats.created += 1
+
+        try:
+            return await waiter.future
+        finally:
+            if waiter.timer is not None:
+                waiter.timer.cancel()
+
+            self._remove(waiter)
+
+    async def feed_update(
+        self, client: Client, update: Update, handler_type: Type[Handler], deps: Dict
+    ) -> bool:
+        """Resolves first waiter matching `update`. Returns `True` if update
+        was consumed by waiter and must not be fed to routers.
+        """
+
+        if not self._waiters:
+            return False
+
+        chat_id = get_chat_id(update)
+        user_id = get_user_id(update)
+
+        # from the most specific key to the least one, without duplicates
+        keys = dict.fromkeys(
+            (
+                (handler_type, chat_id, user_id),
+                (handler_type, chat_id, None),
+                (handler_type, None, user_id),
+                (handler_type, None, None),
+            )
+        )
+
+        for key in keys:
+            waiters = self._waiters.get(key)
+
+            if not waiters:
+                continue
+
+            for waiter in list(waiters):
+                if waiter.future.done():
+                    continue
+
+                if not await waiter.filters(client=client, update=update, **deps):
+                    continue
+
+                # future could be resolved (e.g. timed out) while filters were checked
+                if waiter.future.done():
+                    continue
+
+                self._remove(waiter)
+                waiter.future.set_result(update)
+                self.stats.resolved += 1
+
+                return waiter.consume
+
+        return False
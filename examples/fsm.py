@@ -0,0 +1,50 @@
+import asyncio
+
+from pyrogram import Client, filters, types
+
+from dispyro import Dispatcher, Router
+from dispyro.fsm import FSMContext, MemoryStorage, State, StateFilter, StatesGroup
+
+router = Router()
+router.message.filter(filters.private)  # processing only private messages
+
+
+class Form(StatesGroup):
+    name = State()
+    age = State()
+
+
+@router.message(StateFilter(None) & filters.command("form"))
+async def start_form(_, message: types.Message, state: FSMContext):
+    await state.set_state(Form.name)
+    await message.reply_text(text="What is your name?")
+
+
+@router.message(StateFilter(Form.name))
+async def process_name(_, message: types.Message, state: FSMContext):
+    await state.update_data(name=message.text)
+    await state.set_state(Form.age)
+    await message.reply_text(text="How old are you?")
+
+
+@router.message(StateFilter(Form.age))
+async def process_age(_, message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    await message.reply_text(text=f"Nice to meet you, {data['name']} ({message.text})!")
+
+
+async def main():
+    client = Client(
+        name="dispyro",
+        api_id=2040,  # TDesktop api_id, better to be replaced with your value
+        api_hash="b18441a1ff607e10a989891a5462e627",  # TDesktop api_hash, better to be replaced with your value
+    )
+    dispatcher = Dispatcher(client, storage=MemoryStorage(ttl=3600))
+    dispatcher.add_router(router)
+
+    await dispatcher.start()
+
+
+loop = asyncio.get_event_loop()
+loop.run_until_complete(main())
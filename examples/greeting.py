@@ -0,0 +1,11 @@
+from pyrogram import filters, types
+
+from dispyro import Router
+
+router = Router(name="greeting")
+
+
+# edit this text while bot is running, then send `/reload`
+@router.message(filters.command("hello"))
+async def hello(_, message: types.Message):
+    await message.reply_text(text="Hello!")
@@ -0,0 +1,34 @@
+import asyncio
+
+from pyrogram import Client, filters, types
+
+from dispyro import Dispatcher
+
+dispatcher = Dispatcher()
+
+
+@dispatcher.message(filters.command("reload") & filters.me)
+async def reload(_, message: types.Message):
+    try:
+        await dispatcher.reload_router("greeting:router")
+    except Exception as error:
+        # old router is kept
+        await message.reply_text(text=f"Reload failed: {error!r}")
+        return
+
+    await message.reply_text(text="Reloaded!")
+
+
+async def main():
+    client = Client(
+        name="dispyro",
+        api_id=2040,  # TDesktop api_id, better to be replaced with your value
+        api_hash="b18441a1ff607e10a989891a5462e627",  # TDesktop api_hash, better to be replaced with your value
+    )
+    dispatcher.load_router("greeting:router")
+
+    await dispatcher.start(client)
+
+
+loop = asyncio.get_event_loop()
+loop.run_until_complete(main())
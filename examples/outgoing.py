@@ -0,0 +1,32 @@
+import asyncio
+
+from pyrogram import Client, filters, types
+
+from dispyro import Dispatcher, OutgoingQueue, Router
+
+router = Router()
+
+
+@router.message(filters.command("count"))
+async def count(client: Client, message: types.Message, outgoing: OutgoingQueue):
+    sent: types.Message = await outgoing.send_message(client, message.chat.id, "0")
+
+    # edits are made within rate limits, queued edits of message are merged
+    for number in range(1, 21):
+        outgoing.edit_message_text(client, message.chat.id, sent.id, str(number))
+
+
+async def main():
+    client = Client(
+        name="dispyro",
+        api_id=2040,  # TDesktop api_id, better to be replaced with your value
+        api_hash="b18441a1ff607e10a989891a5462e627",  # TDesktop api_hash, better to be replaced with your value
+    )
+    dispatcher = Dispatcher(client, outgoing=OutgoingQueue())
+    dispatcher.add_router(router)
+
+    await dispatcher.start()
+
+
+loop = asyncio.get_event_loop()
+loop.run_until_complete(main())
@@ -0,0 +1,38 @@
+import asyncio
+
+from pyrogram import Client, filters, types
+
+from dispyro import Dispatcher, Router, ShardedDispatcher
+
+router = Router()
+router.message.filter(filters.me)  # processing only messages from account itself
+
+
+@router.message(filters.command("ping", prefixes="."))
+async def handler(_, message: types.Message):
+    # `message` is bound to client proxy, so this call is executed by client in main process
+    await message.edit_text(text="🏓 pong from worker!")
+
+
+def make_dispatcher() -> Dispatcher:
+    # called in every worker process, must be defined on module level
+    dispatcher = Dispatcher()
+    dispatcher.add_router(router)
+
+    return dispatcher
+
+
+async def main():
+    client = Client(
+        name="dispyro",
+        api_id=2040,  # TDesktop api_id, better to be replaced with your value
+        api_hash="b18441a1ff607e10a989891a5462e627",  # TDesktop api_hash, better to be replaced with your value
+    )
+    dispatcher = ShardedDispatcher(client, factory=make_dispatcher, workers=4)
+
+    await dispatcher.start()
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
@@ -0,0 +1,42 @@
+import asyncio
+
+from pyrogram import Client, filters, handlers, types
+
+from dispyro import Dispatcher, Router
+
+router = Router()
+router.message.filter(filters.private)  # processing only private messages
+
+
+@router.message(filters.command("ask"))
+async def ask(_, message: types.Message, dispatcher: Dispatcher):
+    await message.reply_text(text="What is your name?")
+
+    try:
+        answer: types.Message = await dispatcher.wait_for(
+            handlers.MessageHandler,
+            filters=filters.text,
+            timeout=60,
+            chat_id=message.chat.id,
+        )
+    except asyncio.TimeoutError:
+        await message.reply_text(text="Too slow!")
+        return
+
+    await answer.reply_text(text=f"Nice to meet you, {answer.text}!")
+
+
+async def main():
+    client = Client(
+        name="dispyro",
+        api_id=2040,  # TDesktop api_id, better to be replaced with your value
+        api_hash="b18441a1ff607e10a989891a5462e627",  # TDesktop api_hash, better to be replaced with your value
+    )
+    dispatcher = Dispatcher(client)
+    dispatcher.add_router(router)
+
+    await dispatcher.start()
+
+
+loop = asyncio.get_event_loop()
+loop.run_until_complete(main())
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import pytest
+
+from dispyro import Filter
+from dispyro.circuit_breaker import CircuitBreaker
+from dispyro.enums import CircuitState
+
+
+def test_cancelled_filter_call_is_not_failure():
+    circuit_breaker = CircuitBreaker(failure_threshold=1)
+
+    async def hang(client, update):
+        await asyncio.sleep(10)
+
+    async def main():
+        task = asyncio.ensure_future(Filter(hang, circuit_breaker=circuit_breaker)(None, None))
+        await asyncio.sleep(0)
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+    assert circuit_breaker.state is CircuitState.CLOSED
+    assert circuit_breaker.stats.failures == 0
+
+
+def test_failures_out_of_window_are_dropped():
+    circuit_breaker = CircuitBreaker(failure_threshold=3, window=0.05)
+
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    time.sleep(0.1)
+
+    assert circuit_breaker.stats.recent_failures == 0
+
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state is CircuitState.CLOSED
+    assert circuit_breaker.stats.recent_failures == 1
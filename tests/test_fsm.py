@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from pyrogram import handlers, types
+
+from dispyro import Dispatcher, Router
+from dispyro.fsm import MemoryStorage, SQLiteStorage, StateFilter
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+
+    async def get_state(self, key):
+        self.loads += 1
+
+        return await super().get_state(key)
+
+
+def make_message(text: str) -> types.Message:
+    return types.Message(id=1, chat=types.Chat(id=1), from_user=types.User(id=1), text=text)
+
+
+def make_poll() -> types.Poll:
+    return types.Poll(id="1", question="?", options=[], is_closed=False)
+
+
+def make_dispatcher(router: Router):
+    storage = CountingStorage()
+    dispatcher = Dispatcher(storage=storage)
+    dispatcher.add_router(router)
+    dispatcher.freeze()
+
+    return dispatcher, storage
+
+
+def test_state_is_not_loaded_when_not_used():
+    router = Router()
+
+    @router.message()
+    async def echo(client, message):
+        pass
+
+    dispatcher, storage = make_dispatcher(router)
+
+    asyncio.run(dispatcher.feed_update(None, make_message("hi"), handlers.MessageHandler))
+
+    assert storage.loads == 0
+
+
+def test_state_is_loaded_when_used():
+    router = Router()
+
+    @router.message(filters=StateFilter(None))
+    async def start(client, message):
+        pass
+
+    dispatcher, storage = make_dispatcher(router)
+
+    asyncio.run(dispatcher.feed_update(None, make_message("hi"), handlers.MessageHandler))
+    asyncio.run(dispatcher.feed_update(None, make_poll(), handlers.PollHandler))
+
+    assert storage.loads == 1
+
+
+def test_state_is_loaded_after_runtime_registration():
+    router = Router()
+    dispatcher, storage = make_dispatcher(router)
+
+    async def form(client, message, state):
+        pass
+
+    router.message.register(form)
+    asyncio.run(dispatcher.feed_update(None, make_message("hi"), handlers.MessageHandler))
+
+    assert storage.loads == 1
+
+    router.message.unregister(form)
+    asyncio.run(dispatcher.feed_update(None, make_message("hi"), handlers.MessageHandler))
+
+    assert storage.loads == 1
+
+
+def test_state_is_not_loaded_without_key():
+    router = Router()
+
+    @router.poll()
+    async def poll(client, poll, raw_state=None):
+        pass
+
+    dispatcher, storage = make_dispatcher(router)
+
+    asyncio.run(dispatcher.feed_update(None, make_poll(), handlers.PollHandler))
+
+    assert storage.loads == 0
+
+
+def test_sqlite_storage_close_shuts_down_executor(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "fsm.sqlite"))
+
+    async def use():
+        await storage.set_state((1, 1), "form")
+        await storage.close()
+
+    asyncio.run(use())
+
+    with pytest.raises(RuntimeError):
+        storage._executor.submit(print)
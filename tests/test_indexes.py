@@ -0,0 +1,37 @@
+from pyrogram import types
+
+from dispyro.filters import Regex
+from dispyro.indexes import RegexIndex
+
+
+def make_message(text: str) -> types.Message:
+    return types.Message(id=1, chat=types.Chat(id=1), from_user=types.User(id=1), text=text)
+
+
+def build_index(*filters: Regex) -> RegexIndex:
+    index = RegexIndex()
+
+    for number, filter in enumerate(filters):
+        index.add(handler=f"handler{number}", filter=filter)
+
+    index.build()
+
+    return index
+
+
+def test_regex_index_with_empty_match_and_missing_pattern():
+    index = build_index(Regex(r"\d*"), Regex(r"never"))
+
+    handlers, deps = index.lookup_with_deps(None, make_message("abc"), {})
+
+    assert handlers == ["handler0"]
+    assert deps["handler0"]["match"].group(0) == ""
+
+
+def test_regex_index_finds_overlapping_patterns():
+    index = build_index(Regex(r"ab"), Regex(r"b\w+"), Regex(r"^x"))
+
+    handlers, deps = index.lookup_with_deps(None, make_message("zabc"), {})
+
+    assert handlers == ["handler0", "handler1"]
+    assert deps["handler1"]["match"].group(0) == "bc"
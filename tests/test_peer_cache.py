@@ -0,0 +1,32 @@
+import asyncio
+
+from pyrogram import enums, types
+
+from dispyro import PeerCache
+
+
+def make_private_message(user_id: int) -> types.Message:
+    user = types.User(id=user_id, first_name="Alice")
+    chat = types.Chat(id=user_id, type=enums.ChatType.PRIVATE, first_name="Alice")
+
+    return types.Message(id=1, chat=chat, from_user=user, text="hi")
+
+
+def test_private_chat_doesnt_replace_user():
+    cache = PeerCache()
+    cache.feed(make_private_message(user_id=5))
+
+    user = asyncio.run(cache.get_user(None, 5))
+    chat = asyncio.run(cache.get_chat(None, 5))
+
+    assert isinstance(user, types.User) and user.id == 5
+    assert isinstance(chat, types.Chat) and chat.type is enums.ChatType.PRIVATE
+    assert cache.stats.hits == 2 and cache.stats.misses == 0
+
+
+def test_peer_of_other_type_is_miss():
+    cache = PeerCache()
+    cache.feed(types.Chat(id=-100, type=enums.ChatType.GROUP, title="group"))
+
+    assert asyncio.run(cache.get_user(None, -100)) is None
+    assert cache.stats.hits == 0 and cache.stats.misses == 1
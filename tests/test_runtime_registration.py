@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from pyrogram import handlers, types
+
+from dispyro import Dispatcher, Router
+from dispyro.handlers import Handler
+from dispyro.handlers_holders import HandlersHolder
+
+
+def make_message(text: str) -> types.Message:
+    return types.Message(id=1, chat=types.Chat(id=1), from_user=types.User(id=1), text=text)
+
+
+async def callback(client, message):
+    pass
+
+
+def make_dispatcher(routers: int, handlers_per_router: int) -> Dispatcher:
+    dispatcher = Dispatcher()
+
+    for _ in range(routers):
+        router = Router()
+
+        for _ in range(handlers_per_router):
+            router.message.register(callback)
+            router.callback_query.register(callback)
+
+        dispatcher.add_router(router)
+
+    dispatcher.freeze()
+
+    return dispatcher
+
+
+def count_runtime_changes_work(monkeypatch, dispatcher: Dispatcher) -> dict:
+    calls = {"validated": 0, "plans": 0}
+
+    get_missing_deps = Handler.get_missing_deps
+    build_plan = HandlersHolder._build_plan
+
+    def counted_get_missing_deps(self, deps):
+        calls["validated"] += 1
+        return get_missing_deps(self, deps)
+
+    def counted_build_plan(self):
+        calls["plans"] += 1
+        return build_plan(self)
+
+    monkeypatch.setattr(Handler, "get_missing_deps", counted_get_missing_deps)
+    monkeypatch.setattr(HandlersHolder, "_build_plan", counted_build_plan)
+
+    router = Router()
+    dispatcher.add_router(router)
+    calls.update(validated=0, plans=0)
+
+    added = [router.edited_message.add(callback) for _ in range(10)]
+
+    for handler in added:
+        router.edited_message.unregister(handler)
+
+    monkeypatch.undo()
+
+    return calls
+
+
+def test_runtime_changes_cost_does_not_depend_on_other_handlers(monkeypatch):
+    small = count_runtime_changes_work(
+        monkeypatch, make_dispatcher(routers=2, handlers_per_router=2)
+    )
+    large = count_runtime_changes_work(
+        monkeypatch, make_dispatcher(routers=50, handlers_per_router=20)
+    )
+
+    assert small == large
+    # only added handlers are validated, only changed holder is rebuilt
+    assert large == {"validated": 10, "plans": 20}
+
+
+def test_runtime_handler_is_validated_and_dispatched():
+    dispatcher = make_dispatcher(routers=1, handlers_per_router=1)
+    router = Router()
+    dispatcher.add_router(router)
+    got = []
+
+    async def needs_missing(client, message, missing):
+        pass
+
+    with pytest.raises(ValueError):
+        router.edited_message.register(needs_missing)
+
+    assert router.edited_message.handlers == []
+    assert router not in dispatcher._dispatch_table[handlers.EditedMessageHandler]
+
+    async def edited(client, message):
+        got.append(message.text)
+
+    handler = router.edited_message.add(edited)
+
+    assert router in dispatcher._dispatch_table[handlers.EditedMessageHandler]
+    assert dispatcher.freeze_report.handlers == 3
+
+    update = make_message("edited")
+    asyncio.run(dispatcher.feed_update(None, update, handlers.EditedMessageHandler))
+
+    router.edited_message.unregister(handler)
+    asyncio.run(dispatcher.feed_update(None, update, handlers.EditedMessageHandler))
+
+    assert got == ["edited"]
+    assert router not in dispatcher._dispatch_table[handlers.EditedMessageHandler]
+    assert dispatcher.freeze_report.handlers == 2
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from dispyro import Scheduler, SQLiteJobStore
+
+
+async def remind(client, job):
+    pass
+
+
+def test_persistent_job_is_saved_when_scheduled_before_loop(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite"))
+    scheduler = Scheduler(store=store)
+
+    scheduler.schedule(remind, delay=60, id="remind", persistent=True)
+    scheduler.schedule(remind, delay=60, id="cancelled", persistent=True)
+    scheduler.cancel("cancelled")
+
+    async def run():
+        await scheduler.start()
+        rows = await store.load()
+        await scheduler.shutdown()
+
+        return rows
+
+    rows = asyncio.run(run())
+
+    assert [id for id, *_ in rows] == ["remind"]
+    assert scheduler.get_job("remind") is not None
+
+
+def test_job_store_close_shuts_down_executor(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite"))
+
+    async def use():
+        await store.load()
+        await store.close()
+
+    asyncio.run(use())
+
+    with pytest.raises(RuntimeError):
+        store._executor.submit(print)
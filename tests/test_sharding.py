@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from pyrogram import Client, filters, types
+
+from dispyro.sharding import ClientProxy, _dump_client, _Worker
+
+
+def make_message(text: str) -> types.Message:
+    return types.Message(id=1, chat=types.Chat(id=1), from_user=types.User(id=1), text=text)
+
+
+class FakeWorker:
+    def __init__(self):
+        self.calls = []
+
+    async def call(self, client_index: int, name: str, args: tuple, kwargs: dict):
+        self.calls.append((client_index, name, args, kwargs))
+
+
+def test_command_filter_works_with_client_proxy():
+    client = Client("bot", in_memory=True)
+    client.me = types.User(id=42, username="bot")
+
+    worker = _Worker(factory=None, inbound=None, outbound=None)
+    worker._on_message(("client", 0, _dump_client(client)))
+    proxy = worker._get_proxy(0)
+
+    async def check(text: str) -> bool:
+        return bool(await filters.command("ping", prefixes=".")(proxy, make_message(text)))
+
+    assert proxy.me.username == "bot"
+    assert asyncio.run(check(".ping"))
+    assert asyncio.run(check(".ping@bot"))
+    assert not asyncio.run(check(".ping@other_bot"))
+
+
+def test_client_proxy_forwards_only_coroutine_methods():
+    worker = FakeWorker()
+    proxy = ClientProxy(worker=worker, client_index=0, attributes={"name": "bot"})
+
+    asyncio.run(proxy.send_message(1, text="hi"))
+
+    assert worker.calls == [(0, "send_message", (1,), {"text": "hi"})]
+    assert proxy.name == "bot"
+
+    for name in ("add_handler", "workdir", "unknown"):
+        with pytest.raises(AttributeError):
+            getattr(proxy, name)
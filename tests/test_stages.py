@@ -0,0 +1,81 @@
+import asyncio
+
+from pyrogram import handlers, types
+
+from dispyro import Dispatcher
+from dispyro.stages import EditCoalescer, MediaGroupAggregator
+
+
+def make_message(message_id: int, media_group_id: str = None) -> types.Message:
+    return types.Message(
+        id=message_id,
+        chat=types.Chat(id=1),
+        from_user=types.User(id=1),
+        media_group_id=media_group_id,
+    )
+
+
+def test_media_group_doesnt_block_worker():
+    dispatcher = Dispatcher()
+    dispatcher.add_stage(MediaGroupAggregator(window=0.05))
+    received = []
+
+    @dispatcher.message()
+    async def album(client, message, media_group):
+        received.append([item.id for item in media_group])
+
+    async def run():
+        for message_id in (2, 1):
+            await dispatcher.feed_update(
+                None, make_message(message_id, "album"), handlers.MessageHandler
+            )
+
+        # workers are free while group is being collected
+        assert received == []
+
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+    assert received == [[1, 2]]
+
+
+def test_media_group_is_fed_on_stop():
+    dispatcher = Dispatcher()
+    dispatcher.add_stage(MediaGroupAggregator(window=60))
+    received = []
+
+    @dispatcher.message()
+    async def album(client, message, media_group):
+        received.append(len(media_group))
+
+    async def run():
+        await dispatcher.feed_update(None, make_message(1, "album"), handlers.MessageHandler)
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert received == [1]
+
+
+def test_edits_are_coalesced_without_blocking_worker():
+    dispatcher = Dispatcher()
+    dispatcher.add_stage(EditCoalescer(window=0.05))
+    received = []
+
+    @dispatcher.edited_message()
+    async def edited(client, message):
+        received.append(message.text)
+
+    async def run():
+        for text in ("a", "ab", "abc"):
+            message = types.Message(id=1, chat=types.Chat(id=1), text=text)
+            await dispatcher.feed_update(None, message, handlers.EditedMessageHandler)
+
+        assert received == []
+
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+    assert received == ["abc"]